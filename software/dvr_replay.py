@@ -0,0 +1,105 @@
+"""
+Replay DVR recordings (see lib/DvrRecorder.py) from any wall-clock time
+
+Seeks straight to the first frame at or after `--at` using the segment indexes, then plays
+forward across segments at the recorded pace (or `--speed` times faster).
+
+Examples (run from the folder kibbie was run from, so `recordings/` is found):
+    python3 software/dvr_replay.py --at "2023-02-13 08:00"
+    python3 software/dvr_replay.py --at "2023-02-13 08:00:30" --speed 4
+    python3 software/dvr_replay.py --at "2023-02-13 08:00:30" --export frame.png
+    python3 software/dvr_replay.py --list
+
+Keys while playing: space to pause, q to quit
+"""
+
+import argparse
+import os
+import time
+
+import cv2
+
+import lib.DvrRecorder as Dvr
+
+TIME_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+
+def parse_time(time_string):
+    for time_format in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(time_string, time_format))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f'Could not parse "{time_string}" (use YYYY-MM-DD [HH:MM[:SS]])')
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) + f".{int(timestamp * 10) % 10}"
+
+def print_segments(folder):
+    for path in Dvr.list_segments(folder):
+        times = Dvr.read_frame_times(path)
+        if len(times) == 0:
+            print(f"{os.path.basename(path)}  (empty)")
+            continue
+        size_mb = os.path.getsize(path + Dvr.VIDEO_SUFFIX) / 1e6
+        print(f"{os.path.basename(path)}  {format_time(times[0])} - {format_time(times[-1])}  {len(times):6d} frames  {size_mb:7.1f} MB")
+
+# Frames (time, image) from `frame_number` of the segment at `video_path` to the end of the recordings
+def frames_from(video_path, frame_number, folder):
+    segments = [path + Dvr.VIDEO_SUFFIX for path in Dvr.list_segments(folder)]
+    for path in segments[segments.index(video_path):]:
+        times = Dvr.read_frame_times(path[:-len(Dvr.VIDEO_SUFFIX)])
+        vid = cv2.VideoCapture(path)
+        vid.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+        for t in times[frame_number:]:
+            ret, image = vid.read()
+            if not ret:
+                break
+            yield t, image
+        vid.release()
+        frame_number = 0
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Replay DVR recordings from a wall-clock time")
+    ap.add_argument("--folder", default=Dvr.RECORDINGS_FOLDER, help="recordings folder")
+    ap.add_argument("--at", type=parse_time, help="time to start from (YYYY-MM-DD [HH:MM[:SS]])")
+    ap.add_argument("--speed", type=float, default=1.0, help="playback speed")
+    ap.add_argument("--export", help="save the frame at --at to this image file instead of playing")
+    ap.add_argument("--list", action="store_true", help="list segments and the times they cover")
+    args = ap.parse_args()
+
+    if args.list or args.at is None:
+        print_segments(args.folder)
+        exit()
+
+    found = Dvr.seek(args.at, args.folder)
+    if found is None:
+        print(f"Nothing recorded at or after {format_time(args.at)}")
+        exit(1)
+    video_path, frame_number, frame_time = found
+    print(f"Starting at {format_time(frame_time)} ({video_path} frame {frame_number})")
+
+    if args.export:
+        for t, image in frames_from(video_path, frame_number, args.folder):
+            cv2.imwrite(args.export, image)
+            print(f"Saved {format_time(t)} to {args.export}")
+            break
+        exit()
+
+    start_wall_time = time.time()
+    is_paused = False
+    for t, image in frames_from(video_path, frame_number, args.folder):
+        cv2.putText(img=image, text=format_time(t), org=(5, image.shape[0] - 5), fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+                    fontScale=0.3, color=(255, 255, 255), thickness=1, lineType=cv2.LINE_AA)
+        cv2.imshow("replay", image)
+
+        # Keep the recorded pace
+        delay_ms = max(1, int(((t - frame_time) / args.speed - (time.time() - start_wall_time)) * 1000))
+        key = cv2.waitKey(0 if is_paused else delay_ms)
+        if key == ord('q'):
+            break
+        if key == ord(' '):
+            is_paused = not is_paused
+            start_wall_time = time.time()
+            frame_time = t
+
+    cv2.destroyAllWindows()
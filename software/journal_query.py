@@ -0,0 +1,48 @@
+"""
+Query the Kibbie event journal (see lib/EventJournal.py)
+
+Examples (run from the folder kibbie was run from, so `journal/` is found):
+    python3 software/journal_query.py --since 2023-02-12 --until 2023-02-13 --type dispense
+    python3 software/journal_query.py --since 2023-02-12 --type door_open --corral NOODLE_L --per-day
+"""
+
+import argparse
+from collections import Counter
+import time
+
+from lib.EventJournal import EventType, JournalReader, JOURNAL_FOLDER
+
+DATE_FORMAT = "%Y-%m-%d"
+
+def parse_date(date_string):
+    return time.mktime(time.strptime(date_string, DATE_FORMAT))
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Query the Kibbie event journal")
+    ap.add_argument("--folder", default=JOURNAL_FOLDER, help="journal folder")
+    ap.add_argument("--since", type=parse_date, default=0, help="start date (YYYY-MM-DD, inclusive)")
+    ap.add_argument("--until", type=parse_date, default=float("inf"), help="end date (YYYY-MM-DD, exclusive)")
+    ap.add_argument("--type", action="append", choices=[event_type.value for event_type in EventType], help="event type (repeatable)")
+    ap.add_argument("--corral", help="only events for this corral")
+    ap.add_argument("--cat", help="only events for this cat")
+    ap.add_argument("--per-day", action="store_true", help="print counts per day instead of events")
+    args = ap.parse_args()
+
+    event_types = None if args.type is None else [EventType(event_type) for event_type in args.type]
+    fields = {}
+    if args.corral:
+        fields["corral"] = args.corral
+    if args.cat:
+        fields["cat"] = args.cat
+
+    journal = JournalReader(args.folder)
+    events = journal.query(args.since, args.until, event_types, **fields)
+
+    if args.per_day:
+        counts = Counter(time.strftime(DATE_FORMAT, time.localtime(event["t"])) for event in events)
+        for day in sorted(counts):
+            print(f"{day}: {counts[day]}")
+    else:
+        for event in events:
+            details = ", ".join(f"{key}={value}" for key, value in event.items() if key not in ["t", "type"])
+            print(f'[{time.asctime(time.localtime(event["t"]))}] {event["type"]} {details}')
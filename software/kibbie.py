@@ -1,15 +1,31 @@
 import os
 import time
-from multiprocessing import Process, Queue
+from multiprocessing import Pipe, Process, Queue
 
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 
 import lib.ImgTools as ImgTools
 import lib.KibbieServoUtils as Servo
-from lib.Dispenser import Dispenser
+from lib.ClipRecorder import ClipRecorder
+from lib.CurrentHistory import CurrentHistory
+from lib.CurrentPlot import CurrentPlot
+from lib.Dispenser import SERVO_ACK_TIMEOUT_S, Dispenser
+from lib.DvrRecorder import DvrRecorder
+from lib.DoorProfileMatcher import DoorProfileMatcher
+from lib.EventJournal import EventJournal, EventType
+from lib.FrameBroadcaster import FrameBroadcaster
 from lib.KibbieSerial import KibbieSerial
+from lib.LogWriter import LogWriter
+from lib.SerialBroker import SerialBroker, SerialBrokerClient, is_broker_running
+from lib.SnapshotExporter import SnapshotExporter
+from lib.StorageManager import StorageManager
+from lib.TelemetryRecorder import TelemetryRecorder
+from lib.ThumbnailCache import ThumbnailCache
+from lib.WebServer import WebServer
+from lib.ServoProtocol import ServoCommand, ServoOpcode, ServoProtocolError
+from lib.ServoStateBoard import ServoStateBoard
+from lib.StallDetector import StallDetector
 
 from lib.Parameters import *
 
@@ -47,6 +63,32 @@ MASK_REGION_LEFT = [[356.0, 376.0], [350.0, 20.0], [626.0, 22.0], [630.0, 296.0]
 # How often the servo process executes
 SERVO_PROCESS_PERIOD_S = 0.05 # s, 20 Hz
 
+# How far back the on-demand current plot goes
+CURRENT_PLOT_WINDOW_S = 60 * 10 # s
+
+# A door counts as moving for this long after its last queued movement (the servo is still travelling)
+STALL_MOVEMENT_GRACE_S = 1.0 # s
+
+# After a door stalls it holds still for this long, then reverses (re-latching it) and holds again before
+# normal operation resumes. Doubles with each consecutive stall, up to DOOR_STALL_MAX_BACKOFF_S.
+DOOR_STALL_BACKOFF_S = 2.0 # s
+DOOR_STALL_MAX_BACKOFF_S = 30.0 # s
+
+# Door current profiles are classified this long after the door command completes (the servo is still settling)
+DOOR_PROFILE_SETTLE_S = 0.5 # s
+
+# Door current profile matches below this confidence are reported as unrecognized
+DOOR_PROFILE_MIN_CONFIDENCE = 0.4
+
+# Door current profile templates that indicate a problem
+DOOR_PROFILE_PROBLEMS = ["obstructed", "stall"]
+
+# Commands accepted from the web server (POST /control with {"command": <name>}, see WEB_CONTROL_TOKEN)
+#   export: export the current frame
+#   plot: save a plot of current to snapshots/current.png
+#   dispense: dispense now (corral=<corral name>)
+WEB_COMMANDS = ["export", "plot", "dispense"]
+
 
 
 ########################
@@ -57,12 +99,15 @@ class kibbie:
     # config: config information, including (per cat):
     #   - Mask polygon (list of [x, y] points describing polygon on UNSCALED image)
     #   - Dispenses per day (float)
-    def __init__(self, camera, log_filename, config, servo_command_queue, servo_log_queue) -> None:
-        # Open log file (append mode)
-        self.logfile = open(log_filename, 'a')
+    def __init__(self, camera, log_filename, config, servo_command_conn, servo_log_queue, servo_ack_queue, servo_state_board) -> None:
+        # Log file (appended to by a background writer thread)
+        self.log_writer = LogWriter(log_filename, echo=LOG_ECHO_TO_CONSOLE)
         self.log("=====================================")
         self.log("Initializing kibbie...")
 
+        # Typed event journal (door, dispense, detection and state machine events)
+        self.journal = EventJournal()
+
         # Save path to file or index of camera (used to open video capture object)
         self.camera = camera
 
@@ -75,6 +120,7 @@ class kibbie:
 
         # Track a filtered number of pixels per corral per cat to make door less sensitive
         # Target something like 2s time constant?
+        self.raw_pixels = []        # Unfiltered number of pixels per corral per cat (for telemetry)
         self.filtered_pixels = []
         self.filter_ratio = 0.80 # (every cycle, this fraction of new value will come from previous value)
                                     # Use 0.95 for ~20 FPS
@@ -89,6 +135,19 @@ class kibbie:
         # Track per-corral dispenser state machines
         self.corral_dispensers = []
 
+        # Track the most recent servo command IDs per corral to match completion acknowledgements
+        self.corral_door_command_id = [None for _ in config["corrals"]]
+        self.corral_door_command_time = [None for _ in config["corrals"]]      # When the door command was sent (None once its profile is classified)
+        self.corral_door_command_action = [None for _ in config["corrals"]]    # "opening" or "closing"
+        self.corral_door_complete_time = [None for _ in config["corrals"]]     # When the door command was acknowledged
+        self.corral_dispense_command_id = [None for _ in config["corrals"]]
+        self.cancelled_servo_command_ids = set()                                # Commands acknowledged as cancelled (eg., door stall)
+
+        # Stalled door recovery (see DOOR_STALL_BACKOFF_S)
+        self.corral_door_reverse_time = [None for _ in config["corrals"]]      # When to reverse a stalled door (None if not stalled)
+        self.corral_door_hold_until = [0 for _ in config["corrals"]]           # Door is left alone until this time
+        self.corral_door_stall_count = [0 for _ in config["corrals"]]          # Consecutive stalls (reset when a door command completes)
+
         # Preprocess the configuration
         for i,corral in enumerate(config["corrals"]):
             # Pre-scale config values
@@ -104,6 +163,7 @@ class kibbie:
             self.masks.append(cat_masks)
 
             # Initialize weighted average number of pixels per cat
+            self.raw_pixels.append([0]*len(config["cats"]))
             self.filtered_pixels.append([0]*len(config["cats"]))
 
             # Find farthest left coordinate for debug print
@@ -115,7 +175,7 @@ class kibbie:
             config["corrals"][i]["farthestLeftCoordinate"] = farthestLeftCoordinate
 
             # Initialize dispenser object for each corral
-            dispenser = Dispenser(dispenses_per_day=corral["dispensesPerDay"], dispenser_name=corral["name"], logfile=self.logfile)
+            dispenser = Dispenser(dispenses_per_day=corral["dispensesPerDay"], dispenser_name=corral["name"], log_writer=self.log_writer, journal=self.journal)
             self.corral_dispensers.append(dispenser)
         
         self.config = config
@@ -131,6 +191,33 @@ class kibbie:
         # Timestamp of last frame - used to calculate FPS to display on debug image
         self.last_time_s = None
 
+        # Deletes old snapshots and clips to stay within the storage budget
+        self.storage_manager = StorageManager(log=self.log)
+
+        # Thumbnails for the web gallery, made as snapshots and clips are written
+        self.thumbnail_cache = ThumbnailCache(log=self.log) if ENABLE_THUMBNAILS else None
+
+        # Snapshots are encoded and written on background threads
+        self.snapshot_exporter = SnapshotExporter(log=self.log, on_export=self.on_file_written)
+
+        # Short video clips around door and dispense events
+        self.clip_recorder = ClipRecorder(log=self.log, on_clip=self.on_file_written) if ENABLE_CLIP_RECORDER else None
+
+        # Continuous recording into rolling segments
+        self.dvr_recorder = DvrRecorder(log=self.log) if ENABLE_DVR else None
+
+        # Live MJPEG stream of the annotated frame (encoded once per frame, only while someone is watching)
+        self.frame_broadcaster = FrameBroadcaster() if ENABLE_STREAM else None
+
+        # Snapshots, clips, status, live stream and control for browsers on the LAN
+        self.web_server = None
+        self.next_web_status_time = 0
+        if ENABLE_WEB_SERVER:
+            try:
+                self.web_server = WebServer(broadcaster=self.frame_broadcaster, thumbnail_cache=self.thumbnail_cache, command_names=WEB_COMMANDS, log=self.log)
+            except OSError as e:
+                self.log(f"*** Could not start web server on port {WEB_PORT}: {e}")
+
         # Variables to support periodic frame exports while door is open
         self.export_frame_on_timer = False          # Set to True while door is open to export
         self.next_export_frame_on_timer_time = 0    # Set to next time to export (time.time()) while self.export_frame_on_timer is True
@@ -144,8 +231,15 @@ class kibbie:
         self.mask_has_disallowed_cat = [False]*Servo.NUM_CHANNELS_USED
 
         # Initialize serial controller (and efuse controller)
+        # Samples are shared with other tools (eg., plot_current.py) through a serial broker
+        self.serial_broker = None
         if IS_ARDUINO_MONITOR_ATTACHED:
-            self.kbSerial = KibbieSerial()
+            if is_broker_running():
+                # serial_broker.py already owns the port
+                self.kbSerial = SerialBrokerClient("stream")
+            else:
+                self.kbSerial = KibbieSerial()
+                self.serial_broker = SerialBroker(self.kbSerial)
         else:
             self.kbSerial = None
 
@@ -153,59 +247,155 @@ class kibbie:
         time.sleep(0.5)
 
         # Variables for plotting current from serial
-        self.current_history = []
-        self.fig, self.ax = plt.subplots()
+        self.current_history = CurrentHistory(KibbieSerial.NUM_CURRENT_CHANNELS)
+        self.current_sample_count = 0   # Serial samples already added to current_history
+        self.frame_currents = np.zeros((0, KibbieSerial.NUM_CURRENT_CHANNELS))  # Current samples received this frame
+        self.stall_detector = StallDetector(KibbieSerial.NUM_CURRENT_CHANNELS)
+        self.door_profile_matcher = DoorProfileMatcher()
+        self.current_plot = CurrentPlot(KibbieSerial.NUM_CURRENT_CHANNELS, xlim=(-CURRENT_PLOT_WINDOW_S, 0))
+
+        # Per-frame detection internals for offline analysis (eg., tuning minPixelThreshold)
+        self.telemetry_recorder = TelemetryRecorder(
+            [corral["name"] for corral in config["corrals"]],
+            [cat["name"] for cat in config["cats"]],
+            KibbieSerial.NUM_CURRENT_CHANNELS,
+            log=self.log) if ENABLE_TELEMETRY else None
 
         # Initialize servo controller on a separate process (not hung up by main thread processing)
-        # self.servo_command_queue = Queue()      # Kibbie -> Servo queue for commands
-        # self.servo_log_queue = Queue()  # Servo -> Kibbie queue for logs to write to disk
-        # self.servo_process_handle = Process(target=self.servo_process, args=(self.servo_command_queue, self.servo_log_queue,))
-        # self.servo_process_handle.start()
-        self.servo_command_queue = servo_command_queue      # Kibbie -> Servo queue for commands
-        self.servo_log_queue     = servo_log_queue          # Servo -> Kibbie queue for logs to write to disk
+        self.servo_command_conn  = servo_command_conn       # Kibbie -> Servo pipe for binary commands (see lib/ServoProtocol.py)
+        self.servo_log_queue     = servo_log_queue          # Servo -> Kibbie queue for (time, source, message) logs to write to disk
+        self.servo_ack_queue     = servo_ack_queue          # Servo -> Kibbie queue for command completion events
+        self.servo_state_board   = servo_state_board        # Servo -> Kibbie shared-memory servo state (read any time)
+
+        # Every servo command gets a unique ID. Commands stay pending until the servo process acknowledges them.
+        self.next_servo_command_id = 0
+        self.pending_servo_commands = {}    # Command ID -> opcode
 
         self.print_help()
     
 
     def __del__(self):
         self.log("Kibbie shutting down...")
-        self.logfile.close()
+        self.log_writer.close()
+        self.journal.close()
 
     #############################################################
     # Servo process methods
     #############################################################
     
+    # Helper function to send a command to the servo process
+    # Returns the command ID used to match its completion acknowledgement
+    def send_servo_command(self, opcode, **kwargs):
+        command_id = self.next_servo_command_id
+        self.next_servo_command_id += 1
+
+        command = ServoCommand(opcode, command_id, **kwargs)
+        try:
+            self.servo_command_conn.send_bytes(command.encode())
+        except ServoProtocolError as e:
+            self.log(f"*** Invalid servo command {command}: {e}")
+            return None
+
+        self.pending_servo_commands[command_id] = opcode
+        return command_id
+
     # Helper function to queue servo actions
     def queue_servo_angle_stepped(self, channel, target_angle, latch_channel, latch_angle_unlocked, latch_angle_locked, offset_seconds=0):
-        self.servo_command_queue.put(["queue_angle_stepped", channel, target_angle, latch_channel, latch_angle_unlocked, latch_angle_locked, offset_seconds])
+        return self.send_servo_command(ServoOpcode.QUEUE_ANGLE_STEPPED, channel=channel, target_angle=target_angle, latch_channel=latch_channel,
+            latch_angle_unlocked=latch_angle_unlocked, latch_angle_locked=latch_angle_locked, offset_seconds=offset_seconds)
     
+    # Queue a corral's door to open or close, and track it for current profile classification
+    def queue_corral_door(self, i, is_open):
+        corral = self.config["corrals"][i]
+        target_angle = corral["doorServoAngleOpen"] if is_open else corral["doorServoAngleClosed"]
+        self.cancelled_servo_command_ids.discard(self.corral_door_command_id[i])
+        self.corral_door_command_id[i] = self.queue_servo_angle_stepped(corral["doorServoChannel"], target_angle, corral["doorLatchServoChannel"], corral["doorLatchServoAngleUnlocked"], corral["doorLatchServoAngleLocked"])
+        self.corral_door_command_time[i] = time.time()
+        self.corral_door_command_action[i] = "opening" if is_open else "closing"
+        self.corral_door_complete_time[i] = None
+        return self.corral_door_command_id[i]
+
     def queue_servo_dispense_food(self, channel):
-        self.servo_command_queue.put(["dispense_food", channel])
-    
-    def queue_servo_print_status(self):
-        self.servo_command_queue.put(["print_status"])
+        return self.send_servo_command(ServoOpcode.DISPENSE_FOOD, channel=channel)
     
+    def queue_servo_cancel_motion(self, channel):
+        return self.send_servo_command(ServoOpcode.CANCEL_MOTION, channel=channel)
+
     def queue_servo_exit(self):
-        self.servo_command_queue.put(["exit"])
+        return self.send_servo_command(ServoOpcode.EXIT)
     
-    # Periodic function to log servo output to log file
+    # Periodic function to pass servo logs on to the log writer
     def process_servo_log_queue(self):
         while not self.servo_log_queue.empty():
-            output = self.servo_log_queue.get()
-            self.logfile.write(f"{output}\n")
-            self.logfile.flush()
+            t, source, message = self.servo_log_queue.get()
+            self.log_writer.log(message, source=source, t=t)
+
+    # Periodic function to collect command completion events from the servo process
+    def process_servo_ack_queue(self):
+        while not self.servo_ack_queue.empty():
+            _, command_id, status = self.servo_ack_queue.get()
+            opcode = self.pending_servo_commands.pop(command_id, None)
+            if status != Servo.COMMAND_STATUS_DONE:
+                self.log(f"Servo command {command_id} ({opcode.name if opcode else None}) {status}")
+            if status == Servo.COMMAND_STATUS_CANCELLED:
+                self.cancelled_servo_command_ids.add(command_id)
+            if command_id in self.corral_door_command_id:
+                i = self.corral_door_command_id.index(command_id)
+                self.corral_door_complete_time[i] = time.time()
+                if status == Servo.COMMAND_STATUS_DONE:
+                    self.corral_door_stall_count[i] = 0
+
+    # Print servo status straight from the shared-memory state board (no round trip to the servo process)
+    def print_servo_status(self):
+        state = self.servo_state_board.read()
+        if state is None:
+            self.log("Servo status unavailable (servo process busy writing state)")
+            return
+
+        self.log("--------------")
+        self.log(f"Servo status (published {state.age():.2f} s ago):")
+        for channel,channel_state in enumerate(state.channels):
+            if channel_state.target_angle != 0:
+                self.log(f"    Ch {channel}: {channel_state}")
+        self.log(f"  Total dispenses:")
+        for channel,channel_state in enumerate(state.channels):
+            if channel_state.dispense_count > 0:
+                self.log(f"    Ch {channel} : {channel_state.dispense_count}")
+        self.log(f"  Uptime: {state.uptime():.0f} seconds")
+        self.log("--------------")
+
+    # Returns True if the servo process has acknowledged the command (including if it was cancelled)
+    def is_servo_command_complete(self, command_id):
+        return command_id is not None and command_id not in self.pending_servo_commands
+
+    # Returns True if the command was stopped part-way (eg., door stall)
+    def is_servo_command_cancelled(self, command_id):
+        return command_id in self.cancelled_servo_command_ids
+
+    # Block until the servo process acknowledges all of `command_ids`
+    # Returns False if `timeout_s` elapsed first
+    def wait_for_servo_commands(self, command_ids, timeout_s=SERVO_ACK_TIMEOUT_S):
+        timeout_time = time.time() + timeout_s
+        while True:
+            self.process_servo_ack_queue()
+            self.process_servo_log_queue()
+
+            if all(self.is_servo_command_complete(command_id) for command_id in command_ids):
+                return True
+
+            if time.time() >= timeout_time:
+                return False
+
+            time.sleep(SERVO_PROCESS_PERIOD_S)
 
 
     #############################################################
     # Main process methods
     #############################################################
 
-    # Utility to write to the log file and print to console
+    # Utility to write to the log file and print to console (queued, never blocks)
     def log(self, s):
-        output = f"[{time.asctime()}] {s}"
-        self.logfile.write(f"{output}\n")
-        self.logfile.flush()
-        print(output)
+        self.log_writer.log(s)
     
     # Helper function to scale up images from processing scale to display scale
     def scale_for_display(self, image):
@@ -239,6 +429,7 @@ class kibbie:
 
                 # Check for cat
                 num_nonzero_px = cv2.countNonZero(self.masks[corral_idx][cat_idx])
+                self.raw_pixels[corral_idx][cat_idx] = num_nonzero_px
 
                 # Perform filter
                 num_nonzero_px_filt = (
@@ -253,11 +444,13 @@ class kibbie:
                     cat_is_allowed = True
                     if prev_allowed != cat_detected:
                         self.log(f'Detected allowed cat {cat["name"]} {"entered" if cat_detected else "left"} {corral["name"]} corral')
+                        self.journal.append(EventType.CAT_ENTERED if cat_detected else EventType.CAT_LEFT, cat=cat["name"], corral=corral["name"], allowed=True)
                     self.mask_has_allowed_cat[corral_idx] |= cat_detected
                 else:
                     cat_is_allowed = False
                     if prev_disallowed != cat_detected:
                         self.log(f'Detected disallowed cat {cat["name"]} {"entered" if cat_detected else "left"} {corral["name"]} corral')
+                        self.journal.append(EventType.CAT_ENTERED if cat_detected else EventType.CAT_LEFT, cat=cat["name"], corral=corral["name"], allowed=False)
                     self.mask_has_disallowed_cat[corral_idx] |= cat_detected
 
                 # Show mask for debug
@@ -297,14 +490,25 @@ class kibbie:
     def check_and_operate_servos(self):
         # Check each region and perform door and dispenser actions
         for i,corral in enumerate(self.config["corrals"]):
+            # Reverse a stalled door once it has held still for a while
+            if self.corral_door_reverse_time[i] is not None and time.time() >= self.corral_door_reverse_time[i]:
+                self.reverse_stalled_door(i)
+
+            # Leave a stalled door alone until it has been reversed and has had time to settle
+            if time.time() < self.corral_door_hold_until[i]:
+                pass
+
             # Check for corral door-open conditions or actively dispensing
-            if (self.mask_has_allowed_cat[i] and not self.mask_has_disallowed_cat[i]) or self.corral_dispensers[i].open_door_request:
+            elif (self.mask_has_allowed_cat[i] and not self.mask_has_disallowed_cat[i]) or self.corral_dispensers[i].open_door_request:
                 if not self.corral_door_open[i]:
                     # Detected a change - log and perform operations
                     self.log(f'Opening {corral["name"]} door')
-                    self.queue_servo_angle_stepped(corral["doorServoChannel"], corral["doorServoAngleOpen"], corral["doorLatchServoChannel"], corral["doorLatchServoAngleUnlocked"], corral["doorLatchServoAngleLocked"])
+                    self.queue_corral_door(i, is_open=True)
+                    self.journal.append(EventType.DOOR_OPEN, corral=corral["name"], for_dispense=self.corral_dispensers[i].open_door_request)
                     
                     self.export_current_frame(postfix=f'opening-{corral["name"]}', annotated_only=True)
+                    if self.clip_recorder:
+                        self.clip_recorder.trigger(f'opening-{corral["name"]}')
                     if self.config["saveSnapshotWhileDoorOpenPeriodSeconds"] > 0:
                         self.export_frame_on_timer = True
                         self.next_export_frame_on_timer_time = (time.time() + self.config["saveSnapshotWhileDoorOpenPeriodSeconds"])
@@ -315,10 +519,13 @@ class kibbie:
                 if self.corral_door_open[i]:
                     # Detected a change - log and perform operations
                     self.log(f'Closing {corral["name"]} door')
-                    self.queue_servo_angle_stepped(corral["doorServoChannel"], corral["doorServoAngleClosed"], corral["doorLatchServoChannel"], corral["doorLatchServoAngleUnlocked"], corral["doorLatchServoAngleLocked"])
+                    self.queue_corral_door(i, is_open=False)
+                    self.journal.append(EventType.DOOR_CLOSE, corral=corral["name"])
 
                     self.export_frame_on_timer = False
                     self.export_current_frame(f'closing-{corral["name"]}', annotated_only=True)
+                    if self.clip_recorder:
+                        self.clip_recorder.trigger(f'closing-{corral["name"]}')
 
                     self.corral_door_open[i] = False
             
@@ -328,35 +535,44 @@ class kibbie:
                     self.corral_dispensing[i] = True
 
                     self.log(f'Dispensing food in corral {corral["name"]}')
+                    if self.clip_recorder:
+                        self.clip_recorder.trigger(f'dispensing-{corral["name"]}')
 
                     # Request dispense once
-                    self.queue_servo_dispense_food(corral["dispenserServoChannel"])
+                    self.corral_dispense_command_id[i] = self.queue_servo_dispense_food(corral["dispenserServoChannel"])
+                    self.journal.append(EventType.DISPENSE, corral=corral["name"], channel=corral["dispenserServoChannel"])
             else:
                 # Reset flag
                 self.corral_dispensing[i] = False
+                self.corral_dispense_command_id[i] = None
                     
 
     # Used as part of shut-down sequence
     def close_doors(self):
         for i,corral in enumerate(self.config["corrals"]):
-            self.queue_servo_angle_stepped(corral["doorServoChannel"], corral["doorServoAngleClosed"], corral["doorLatchServoChannel"], corral["doorLatchServoAngleUnlocked"], corral["doorLatchServoAngleLocked"])
+            self.queue_corral_door(i, is_open=False)
             self.log(f'Closing {corral["name"]} door')
+            self.journal.append(EventType.DOOR_CLOSE, corral=corral["name"], manual=True)
         
-        # self.servo.block_until_servos_done()
-        # FIXME: Wait hard-coded time for doors to close until we can get feedback from servo process that doors are all closed
-        time.sleep(5.0)
-        self.log(f'Doors closed')
+        # Wait for the servo process to report that all doors finished closing
+        if self.wait_for_servo_commands(self.corral_door_command_id):
+            self.log(f'Doors closed')
+        else:
+            self.log(f'*** Timed out waiting for doors to close')
 
 
     # Used as part of manual servicing sequence
     def open_doors(self):
         for i,corral in enumerate(self.config["corrals"]):
-            self.queue_servo_angle_stepped(corral["doorServoChannel"], corral["doorServoAngleOpen"], corral["doorLatchServoChannel"], corral["doorLatchServoAngleUnlocked"], corral["doorLatchServoAngleLocked"])
+            self.queue_corral_door(i, is_open=True)
             self.log(f'Opening {corral["name"]} door')
+            self.journal.append(EventType.DOOR_OPEN, corral=corral["name"], manual=True)
         
-        # We used to block until servos were done moving, but don't have a solution right now after moving servo to its own process
-        # self.servo.block_until_servos_done()
-        # self.log(f'Doors opened')
+        # Wait for the servo process to report that all doors finished opening
+        if self.wait_for_servo_commands(self.corral_door_command_id):
+            self.log(f'Doors opened')
+        else:
+            self.log(f'*** Timed out waiting for doors to open')
 
 
     # Presents image and overlays any masks
@@ -418,9 +634,77 @@ class kibbie:
 
         # Then update each state machine
         for i,dispenser in enumerate(self.corral_dispensers):
-            dispenser.step(any_mask_has_allowed_cat, any_mask_has_disallowed_cat)
+            # Door is only considered open once the servo process acknowledged the latest open command
+            # (a cancelled open left the door part-way)
+            door_command_id = self.corral_door_command_id[i]
+            door_opened = self.corral_door_open[i] and self.is_servo_command_complete(door_command_id) and not self.is_servo_command_cancelled(door_command_id)
+            door_blocked = time.time() < self.corral_door_hold_until[i]
+            dispense_complete = self.is_servo_command_complete(self.corral_dispense_command_id[i])
+            dispenser.step(any_mask_has_allowed_cat, any_mask_has_disallowed_cat, door_opened, dispense_complete, door_blocked)
     
 
+    # Called from the snapshot and clip writer threads with each written file
+    def on_file_written(self, filepath):
+        self.storage_manager.add(filepath)
+        if self.thumbnail_cache:
+            try:
+                self.thumbnail_cache.get(filepath)
+            except OSError as e:
+                self.log(f"*** Failed to make thumbnail of {filepath}: {e}")
+
+    # Periodic function to run commands received by the web server (see WEB_COMMANDS)
+    def process_web_commands(self):
+        while not self.web_server.commands.empty():
+            command, params = self.web_server.commands.get()
+            self.log(f"Web command {command} {params if params else ''}")
+            if command == "export":
+                self.export_current_frame()
+            elif command == "plot":
+                self.plot_current()
+            elif command == "dispense":
+                corral_names = [corral["name"] for corral in self.config["corrals"]]
+                if params.get("corral") in corral_names:
+                    self.corral_dispensers[corral_names.index(params["corral"])].schedule_dispense_now()
+                else:
+                    self.log(f'*** Web dispense needs corral=<one of {", ".join(corral_names)}>')
+
+    # Status published at /status.json
+    def get_status(self):
+        corrals = []
+        for i,corral in enumerate(self.config["corrals"]):
+            dispenser = self.corral_dispensers[i]
+            corrals.append({
+                "name": corral["name"],
+                "door_open": self.corral_door_open[i],
+                "dispenser_state": dispenser.state.name,
+                "next_dispense_time": dispenser.persistence.get("next_dispense_time"),
+                "allowed_cat": self.mask_has_allowed_cat[i],
+                "disallowed_cat": self.mask_has_disallowed_cat[i],
+                "filtered_pixels": {cat["name"]: round(self.filtered_pixels[i][j], 1) for j,cat in enumerate(self.config["cats"])},
+                "min_pixel_threshold": corral["minPixelThreshold"],
+            })
+        return {
+            "time": time.time(),
+            "corrals": corrals,
+            "current": self.kbSerial.channel_current if self.kbSerial else [],
+            "storage_bytes": self.storage_manager.usage(),
+            "stream_viewers": self.frame_broadcaster.num_subscribers if self.frame_broadcaster else 0,
+        }
+
+    # Record one telemetry row for the current frame
+    def record_telemetry(self):
+        num_corrals = len(self.corral_dispensers)
+        self.telemetry_recorder.record(
+            self.raw_pixels,
+            self.filtered_pixels,
+            self.mask_has_allowed_cat[:num_corrals],
+            self.mask_has_disallowed_cat[:num_corrals],
+            self.corral_door_open,
+            [dispenser.state.value for dispenser in self.corral_dispensers],
+            self.frame_currents)
+        self.frame_currents = self.frame_currents[:0]
+
+
     # Helper function to export current frame to the `software/images/` folder
     def export_current_frame(self, postfix="", annotated_only=False):
         current_time = time.localtime(time.time())
@@ -433,23 +717,26 @@ class kibbie:
         if annotated_only:
             # Single frame export (intended for auto-export)
             folder = f"snapshots/{date_string}"
-            os.makedirs(folder, exist_ok=True)
 
             # Only export the annotated frame of corrals
-            cv2.imwrite(f"{folder}/{filename}.png", self.images["corrals"])
+            filepath = self.snapshot_exporter.export(f"{folder}/{filename}", self.images["corrals"])
 
-            self.log(f'Exported current frame to "f{folder}/{filename}.png"')
+            if filepath is None:
+                self.log(f'*** Dropped export of current frame (export queue full, {self.snapshot_exporter.num_dropped} dropped)')
+            else:
+                self.log(f'Exporting current frame to "{filepath}"')
         else:
             # Export all frames (intended for user request)
             folder = f"snapshots/{filename}/"
             os.makedirs(folder, exist_ok=True)
 
             for key in self.images:
-                cv2.imwrite(f"{folder}/{key}.png", self.images[key])
+                if self.snapshot_exporter.export(f"{folder}/{key}", self.images[key]) is None:
+                    self.log(f'*** Dropped export of {key} frame (export queue full)')
             
             self.plot_current(f"{folder}/current.png")
 
-            self.log(f'Exported current frame to "{folder}/*.png"')
+            self.log(f'Exporting current frame to "{folder}"')
 
 
     # Helper function to get and handle keyboard input
@@ -481,11 +768,10 @@ class kibbie:
             print("PAUSED. Press any key to continue...")
             cv2.waitKey(0)
         elif key == ord('s'):
-            self.queue_servo_print_status()
-            time.sleep(2 * SERVO_PROCESS_PERIOD_S)  # Wait for servo process to complete request
-            self.process_servo_log_queue()
+            self.print_servo_status()
             for dispenser in self.corral_dispensers:
                 dispenser.print_status()
+            self.log(f"Snapshot storage: " + ", ".join(f"{category} {size / 1e6:.0f} MB" for category, size in self.storage_manager.usage().items()))
         elif key == ord('q'):
             # Return False to quit
             return False
@@ -526,6 +812,15 @@ class kibbie:
         self.images["raw"] = frame
         self.img = cv2.resize(frame, (0, 0), fx=scale, fy=scale)
 
+        # Record before white balance. At the default DVR_SCALE (processing scale) recordings are for
+        # viewing only, since kibbie would downsample them again; use DVR_SCALE = 1.0 to replay them
+        # through kibbie
+        if self.dvr_recorder:
+            if DVR_SCALE is None or DVR_SCALE == scale:
+                self.dvr_recorder.add_frame(self.img)
+            else:
+                self.dvr_recorder.add_frame(cv2.resize(frame, (0, 0), fx=DVR_SCALE, fy=DVR_SCALE))
+
         # Save image dimensions for later use
         if self.height_px != self.img.shape[0]:
             self.height_px = self.img.shape[0]
@@ -542,37 +837,109 @@ class kibbie:
         return True
 
 
+    # Add all current samples received since the last call to the history
     def sample_current(self):
-        NUM_CURRENT_SAMPLES_TO_SAVE = 1000
-
-        # Add current sample
         if self.kbSerial:
-            for i,channel_sample in enumerate(self.kbSerial.channel_current):
-                # Initialize sample if it's the first time receiving it
-                if i == len(self.current_history):
-                    self.current_history.append([channel_sample])
+            times, _, currents, self.current_sample_count = self.kbSerial.snapshot(since=self.current_sample_count)
+            self.frame_currents = currents
+            self.current_history.extend(times, currents)
+            self.check_for_stalls(times, currents)
+            self.classify_door_profiles()
+
+    # Run stall detection over new current samples, and cancel the movement of any stalled door
+    def check_for_stalls(self, times, currents):
+        for stall in self.stall_detector.update(times, currents):
+            for i,corral in enumerate(self.config["corrals"]):
+                if corral["currentSenseChannel"] != stall.channel:
+                    continue
+
+                # Only a door that is moving can be stopped
+                # If the state board can't be read (writer busy), don't let that skip the cancel: use kibbie's own view
+                servo_state = self.servo_state_board.read()
+                if servo_state is not None:
+                    door_state = servo_state.channels[corral["doorServoChannel"]]
+                    is_moving = door_state.queue_depth > 0 or time.time() - door_state.last_update < STALL_MOVEMENT_GRACE_S
                 else:
-                    self.current_history[i].append(channel_sample)
-
-                # Remove oldest sample if too long
-                if len(self.current_history[i]) > NUM_CURRENT_SAMPLES_TO_SAVE:
-                    self.current_history[i] = self.current_history[i][1:]
+                    is_moving = self.is_door_command_active(i)
+
+                if is_moving:
+                    self.log(f'*** Stall detected on {corral["name"]} door ({stall.current:.2f} A for {stall.detect_time - stall.start_time:.2f} s). Cancelling door movement')
+                    self.queue_servo_cancel_motion(corral["doorServoChannel"])
+                    self.queue_servo_cancel_motion(corral["doorLatchServoChannel"])
+
+                    # Hold, then reverse the door (see reverse_stalled_door)
+                    backoff_s = min(DOOR_STALL_BACKOFF_S * 2 ** self.corral_door_stall_count[i], DOOR_STALL_MAX_BACKOFF_S)
+                    self.corral_door_stall_count[i] += 1
+                    self.corral_door_reverse_time[i] = time.time() + backoff_s
+                    self.corral_door_hold_until[i] = self.corral_door_reverse_time[i] + backoff_s
+                else:
+                    self.log(f'*** Sustained overcurrent on idle {corral["name"]} door ({stall.current:.2f} A for {stall.detect_time - stall.start_time:.2f} s)')
+                self.journal.append(EventType.DOOR_STALL, corral=corral["name"], current=round(stall.current, 3), cancelled=is_moving)
     
 
-    # Plot current on-demand
+    # Returns True if a door (or its latch) may still be moving according to the commands kibbie sent:
+    # its door command hasn't been acknowledged yet, or was acknowledged so recently that the latch may
+    # still be locking (the ack comes with the last door movement, before the latch)
+    def is_door_command_active(self, i):
+        command_id = self.corral_door_command_id[i]
+        if command_id is None:
+            return False
+        if not self.is_servo_command_complete(command_id):
+            return True
+        complete_time = self.corral_door_complete_time[i]
+        latch_time_s = Servo.DELAY_SERVO_LATCH_ADDITIONAL + Servo.DELAY_DOOR_LATCH_SERVO_WAIT
+        return complete_time is not None and time.time() - complete_time < latch_time_s + STALL_MOVEMENT_GRACE_S
+
+    # Move a stalled door back to where it came from (re-latching it), so it is never left part-way and unlatched
+    # A stalled open closes the door again, a stalled close (eg., something in the way) re-opens it
+    # Normal operation resumes (and retries the movement if still needed) once corral_door_hold_until passes
+    def reverse_stalled_door(self, i):
+        corral = self.config["corrals"][i]
+        self.corral_door_reverse_time[i] = None
+        is_open = not self.corral_door_open[i]
+
+        self.log(f'{"Re-opening" if is_open else "Closing"} stalled {corral["name"]} door')
+        self.queue_corral_door(i, is_open=is_open)
+        self.journal.append(EventType.DOOR_OPEN if is_open else EventType.DOOR_CLOSE, corral=corral["name"], after_stall=True)
+        self.corral_door_open[i] = is_open
+        if not is_open:
+            self.export_frame_on_timer = False
+
+
+    # Classify the current profile of each door movement once it has finished
+    def classify_door_profiles(self):
+        for i,corral in enumerate(self.config["corrals"]):
+            command_time = self.corral_door_command_time[i]
+            if command_time is None or not self.is_servo_command_complete(self.corral_door_command_id[i]):
+                continue
+
+            # Wait for the servo to settle after its final movement
+            if self.corral_door_complete_time[i] is None:
+                self.corral_door_complete_time[i] = time.time()
+            if time.time() < self.corral_door_complete_time[i] + DOOR_PROFILE_SETTLE_S:
+                continue
+            self.corral_door_command_time[i] = None
+
+            times, currents = self.current_history.raw(command_time)
+            match = self.door_profile_matcher.classify(times, currents[:, corral["currentSenseChannel"]], DOOR_PROFILE_MIN_CONFIDENCE)
+            action = self.corral_door_command_action[i]
+            if match is None:
+                self.log(f'{corral["name"]} door {action} current profile: no current samples')
+            elif match.name is None:
+                self.log(f'{corral["name"]} door {action} current profile: unrecognized, {match}')
+            elif match.name in DOOR_PROFILE_PROBLEMS:
+                self.log(f'*** {corral["name"]} door {action} current profile: {match}')
+            else:
+                self.log(f'{corral["name"]} door {action} current profile: {match}')
+
+    # Plot the last CURRENT_PLOT_WINDOW_S of current on-demand
+    # (older windows are plotted from per-second or per-minute min/max/mean)
     def plot_current(self, filepath="snapshots/current.png"):
-        self.fig, self.ax = plt.subplots()
-        if len(self.current_history) >= 2:
-            # self.ax.plot(range(len(self.current_history[0])), 'g^', self.current_history[0], self.current_history[0]) #, 'g^', x2, y2, 'g-')
-            self.ax.plot(range(len(self.current_history[0])), self.current_history[0]) #, 'g^', x2, y2, 'g-')
-            self.ax.plot(range(len(self.current_history[1])), self.current_history[1])
-
-        self.ax.set(xlabel='sample number', ylabel='Current (A)',
-            title='Kibbie Door Current')
-        self.ax.grid()
-        self.ax.set_ylim(-0.1, 2.0)
-
-        self.fig.savefig(filepath)
+        now = time.time()
+        times, means, mins, maxs = self.current_history.window(now - CURRENT_PLOT_WINDOW_S)
+        self.current_plot.update(times - now, means, mins, maxs)
+        self.current_plot.save(filepath)
+        self.storage_manager.add(filepath)
         self.log(f"Saved plot of current to {filepath}")
 
     def main(self):
@@ -602,11 +969,21 @@ class kibbie:
             # Display debug image
             self.refresh_image()
 
-            # Update serial
+            # Buffer the annotated frame for event clips
+            if self.clip_recorder:
+                self.clip_recorder.add_frame(self.images["corrals"])
+
+            # Publish the annotated frame to stream viewers
+            if self.frame_broadcaster:
+                self.frame_broadcaster.add_frame(self.images["corrals"])
+
+            # Sample current (serial is read on a background thread)
             if self.kbSerial:
-                self.kbSerial.update()
                 self.sample_current()
 
+            # Collect servo command completions before running state machines that depend on them
+            self.process_servo_ack_queue()
+
             # Dispense food state machine
             self.dispenser_state_machine()
 
@@ -614,6 +991,17 @@ class kibbie:
             # Includes door open/close and scheduled dispenser checks
             self.check_and_operate_servos()
 
+            # Record this frame's detection internals
+            if self.telemetry_recorder:
+                self.record_telemetry()
+
+            # Run commands from the web server and update its status page
+            if self.web_server:
+                self.process_web_commands()
+                if self.next_web_status_time <= time.time():
+                    self.web_server.publish_status(self.get_status())
+                    self.next_web_status_time = time.time() + WEB_STATUS_PERIOD_S
+
             # Export current frame while door open, if enabled
             if self.export_frame_on_timer and self.next_export_frame_on_timer_time <= time.time():
                 # Get names of open corrals
@@ -646,47 +1034,85 @@ class kibbie:
         # previous state
         self.close_doors()
 
-        # Wait for doors to close, then exit child processes
+        # Doors are closed, exit child processes
         self.queue_servo_exit()
 
+        # Write any pending dispenser state
+        for dispenser in self.corral_dispensers:
+            dispenser.persistence.flush()
+
+        # Stop serving
+        if self.web_server:
+            self.web_server.close()
+        if self.frame_broadcaster:
+            self.frame_broadcaster.close()
+
+        # Finish writing queued snapshots and clips
+        self.snapshot_exporter.close()
+        if self.clip_recorder:
+            self.clip_recorder.close()
+        if self.dvr_recorder:
+            self.dvr_recorder.close()
+        if self.telemetry_recorder:
+            self.telemetry_recorder.close()
+        if self.thumbnail_cache:
+            self.thumbnail_cache.close()
+        self.storage_manager.close()
+
+        if self.serial_broker:
+            self.serial_broker.close()
+        if self.kbSerial:
+            self.kbSerial.close()
+
 
 ########################
 # Servo process
 ########################
 
 # Main servo process function
-def servo_process( command_queue, log_queue):
+# Commands arrive on `command_conn` as binary ServoCommand frames (see lib/ServoProtocol.py)
+# Completion of each command is published on `ack_queue` as ["complete", command_id, status]
+# Servo state is published to the shared-memory board named `state_board_name`
+def servo_process( command_conn, log_queue, ack_queue, state_board_name):
     print(f"*** servo_process: Starting...")
 
-    servo = Servo.KibbieServoUtils(log_queue)
+    state_board = ServoStateBoard(Servo.NUM_CHANNELS_USED, name=state_board_name)
+    servo = Servo.KibbieServoUtils(log_queue, ack_queue, state_board)
     servo.init_servos()
 
     while(1):
         # Fetch any commands
-        while not command_queue.empty():
-            command = command_queue.get()
-            opcode = command[0]
+        while command_conn.poll():
+            try:
+                command = ServoCommand.decode(command_conn.recv_bytes())
+            except ServoProtocolError as e:
+                servo.log(f"*** Dropped invalid command: {e}")
+                continue
 
-            print(f"*** servo_process: Executing '{opcode}'")
+            print(f"*** servo_process: Executing {command}")
 
             # Process command / check for exit
-            if opcode == "exit":
+            if command.opcode == ServoOpcode.EXIT:
+                # Finish queued movements (eg., a door command completes before its latch locks)
+                servo.block_until_servos_done()
+
+                # Child processes skip atexit handlers, so write any pending servo angles explicitly
+                servo.persisted_angles.flush()
+                servo.publish_command_complete(command.command_id)
+                state_board.close()
                 return
-            if opcode == "queue_angle_stepped":
-                channel = command[1]
-                target_angle = command[2]
-                latch_channel = command[3]
-                latch_angle_unlocked = command[4]
-                latch_angle_locked = command[5]
-                offset_seconds = command[6]
-                servo.queue_angle_stepped(channel, target_angle, latch_channel, latch_angle_unlocked, latch_angle_locked, offset_seconds)
-
-            elif opcode == "dispense_food":
-                channel = command[1]
-                servo.dispense_food(channel)
+            if command.opcode == ServoOpcode.QUEUE_ANGLE_STEPPED:
+                servo.queue_angle_stepped(command.channel, command.target_angle, command.latch_channel, command.latch_angle_unlocked, command.latch_angle_locked, command.offset_seconds, command.command_id)
+
+            elif command.opcode == ServoOpcode.DISPENSE_FOOD:
+                servo.dispense_food(command.channel, command.command_id)
             
-            elif opcode == "print_status":
+            elif command.opcode == ServoOpcode.PRINT_STATUS:
                 servo.print_status()
+                servo.publish_command_complete(command.command_id)
+
+            elif command.opcode == ServoOpcode.CANCEL_MOTION:
+                servo.cancel_motion(command.channel, command.command_id)
         
         servo.run_loop()
         
@@ -699,9 +1125,11 @@ def servo_process( command_queue, log_queue):
 ########################
 if __name__=="__main__":
     # Set up servo process
-    servo_command_queue = Queue()      # Kibbie -> Servo queue for commands
-    servo_log_queue = Queue()  # Servo -> Kibbie queue for logs to write to disk
-    servo_process_handle = Process(target=servo_process, args=(servo_command_queue, servo_log_queue,))
+    servo_command_recv_conn, servo_command_send_conn = Pipe(duplex=False)   # Kibbie -> Servo pipe for commands
+    servo_log_queue = Queue()  # Servo -> Kibbie queue for (time, source, message) logs to write to disk
+    servo_ack_queue = Queue()  # Servo -> Kibbie queue for command completion events
+    servo_state_board = ServoStateBoard(Servo.NUM_CHANNELS_USED)   # Servo -> Kibbie shared-memory servo state
+    servo_process_handle = Process(target=servo_process, args=(servo_command_recv_conn, servo_log_queue, servo_ack_queue, servo_state_board.name,))
     servo_process_handle.start()
     
     kb = kibbie(
@@ -745,6 +1173,8 @@ if __name__=="__main__":
                     "doorLatchServoChannel": Servo.CHANNEL_DOOR_LATCH_LEFT,
                     "doorLatchServoAngleUnlocked": Servo.ANGLE_DOOR_LATCH_LEFT_UNLOCKED,
                     "doorLatchServoAngleLocked": Servo.ANGLE_DOOR_LATCH_LEFT_LOCKED,
+                    # Kibbie monitor current sense channel for the door (A0)
+                    "currentSenseChannel": 0,
                 },
                 {
                     "name": "CAMI_R",
@@ -762,13 +1192,18 @@ if __name__=="__main__":
                     "doorLatchServoChannel": Servo.CHANNEL_DOOR_LATCH_RIGHT,
                     "doorLatchServoAngleUnlocked": Servo.ANGLE_DOOR_LATCH_RIGHT_UNLOCKED,
                     "doorLatchServoAngleLocked": Servo.ANGLE_DOOR_LATCH_RIGHT_LOCKED,
+                    # Kibbie monitor current sense channel for the door (A1)
+                    "currentSenseChannel": 1,
                 }
             ],
         },
-        servo_command_queue=servo_command_queue,
+        servo_command_conn=servo_command_send_conn,
         servo_log_queue=servo_log_queue,
+        servo_ack_queue=servo_ack_queue,
+        servo_state_board=servo_state_board,
     )
     kb.main()
     
     # Wait for process to complete here
     servo_process_handle.join()
+    servo_state_board.close()
@@ -0,0 +1,207 @@
+"""
+Event clip recorder
+
+Keeps the last few seconds of frames in memory and writes a short video clip around each event
+(door open/close, dispense), so every feeding can be reviewed without recording continuously.
+
+Frames are JPEG-compressed as they arrive (bounding memory to roughly PRE_ROLL_S of small JPEGs)
+and clips are written as MJPG .avi files, all on background threads:
+ - encoder thread: compresses frames into the pre-roll ring buffer and collects frames for pending clips
+ - writer thread: decodes a finished clip's frames and writes the video
+
+A clip covers PRE_ROLL_S before its first event to POST_ROLL_S after its last event. Events that
+arrive while a clip is still collecting frames extend that clip rather than starting a new one.
+
+Clips are written to `clips/<YYYY-MM-DD>/<HH-MM-SS>-<event>.avi`, and each clip adds a line to
+`clips/index.jsonl`:
+
+    {"file": "2023-02-13/08-00-00-opening-NOODLE_L.avi", "start": 1676275190.0, "end": 1676275210.0,
+     "frames": 180, "fps": 9.0, "events": [{"t": 1676275200.0, "name": "opening-NOODLE_L"}]}
+
+"""
+
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .Parameters import CLIP_JPEG_QUALITY, CLIP_POST_ROLL_S, CLIP_PRE_ROLL_S
+
+CLIPS_FOLDER = "clips"
+INDEX_FILENAME = "index.jsonl"
+
+# Frames waiting to be compressed. New frames are dropped if the encoder falls this far behind.
+MAX_QUEUED_FRAMES = 8
+
+# A pending clip is finished this long after its end even if no more frames arrive (eg., camera stalled)
+FINISH_TIMEOUT_S = 2.0
+
+
+# Frames and events of a clip being collected
+class Clip:
+    def __init__(self, start_time, end_time):
+        self.start_time = start_time
+        self.end_time = end_time
+        self.frames = []    # (time, JPEG bytes)
+        self.events = []    # (time, name)
+
+
+class ClipRecorder:
+    # log: function to report written clips and errors (called from background threads)
+    # on_clip: optional function called with the filepath of each written clip (from the writer thread)
+    def __init__(self, folder=CLIPS_FOLDER, pre_roll_s=CLIP_PRE_ROLL_S, post_roll_s=CLIP_POST_ROLL_S, jpeg_quality=CLIP_JPEG_QUALITY, log=print, on_clip=None):
+        self.folder = folder
+        self.pre_roll_s = pre_roll_s
+        self.post_roll_s = post_roll_s
+        self.encode_parameters = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        self.log = log
+        self.on_clip = on_clip
+
+        self.frame_queue = queue.Queue(maxsize=MAX_QUEUED_FRAMES)   # (time, image), or None to stop
+        self.event_queue = queue.SimpleQueue()                      # (time, name)
+        self.clip_queue = queue.SimpleQueue()                       # Finished clips to write, or None to stop
+
+        # Only touched by the encoder thread
+        self.pre_roll_frames = collections.deque()  # (time, JPEG bytes) of the last pre_roll_s
+        self.pending_clip = None
+
+        # Statistics
+        self.num_dropped_frames = 0
+        self.num_clips = 0
+
+        self.encoder_thread = threading.Thread(target=self.run_encoder, name="kibbie-clip-encoder", daemon=True)
+        self.writer_thread = threading.Thread(target=self.run_writer, name="kibbie-clip-writer", daemon=True)
+        self.encoder_thread.start()
+        self.writer_thread.start()
+
+    # Add a frame (never blocks). The image is copied, so the caller can keep drawing on it
+    def add_frame(self, image, t=None):
+        try:
+            self.frame_queue.put_nowait((time.time() if t is None else t, image.copy()))
+        except queue.Full:
+            self.num_dropped_frames += 1
+
+    # Record a clip around an event (eg., "opening-NOODLE_L")
+    def trigger(self, name, t=None):
+        self.event_queue.put((time.time() if t is None else t, name))
+
+    # Finish the pending clip with the frames received so far, write all clips and stop
+    def close(self):
+        self.frame_queue.put(None)
+        self.encoder_thread.join()
+        self.clip_queue.put(None)
+        self.writer_thread.join()
+
+
+    #############################################################
+    # Encoder thread
+    #############################################################
+
+    def run_encoder(self):
+        while True:
+            try:
+                frame = self.frame_queue.get(timeout=FINISH_TIMEOUT_S)
+            except queue.Empty:
+                frame = False
+            self.process_events()
+
+            if frame is None:
+                self.finish_clip()
+                return
+            if frame is False:
+                if self.pending_clip is not None and time.time() > self.pending_clip.end_time + FINISH_TIMEOUT_S:
+                    self.finish_clip()
+                continue
+
+            t, image = frame
+            is_encoded, data = cv2.imencode(".jpg", image, self.encode_parameters)
+            if not is_encoded:
+                continue
+            data = data.tobytes()
+
+            if self.pending_clip is not None and t > self.pending_clip.end_time:
+                self.finish_clip()
+            if self.pending_clip is not None and t >= self.pending_clip.start_time:
+                self.pending_clip.frames.append((t, data))
+
+            self.pre_roll_frames.append((t, data))
+            while self.pre_roll_frames[0][0] < t - self.pre_roll_s:
+                self.pre_roll_frames.popleft()
+
+    # Start or extend the pending clip for each new event
+    def process_events(self):
+        while True:
+            try:
+                t, name = self.event_queue.get_nowait()
+            except queue.Empty:
+                return
+
+            if self.pending_clip is None:
+                self.pending_clip = Clip(t - self.pre_roll_s, t + self.post_roll_s)
+                self.pending_clip.frames = [frame for frame in self.pre_roll_frames if frame[0] >= self.pending_clip.start_time]
+            else:
+                self.pending_clip.end_time = max(self.pending_clip.end_time, t + self.post_roll_s)
+            self.pending_clip.events.append((t, name))
+
+    def finish_clip(self):
+        if self.pending_clip is not None and len(self.pending_clip.frames) > 0:
+            self.clip_queue.put(self.pending_clip)
+        self.pending_clip = None
+
+
+    #############################################################
+    # Writer thread
+    #############################################################
+
+    def run_writer(self):
+        while True:
+            clip = self.clip_queue.get()
+            if clip is None:
+                return
+            try:
+                self.write_clip(clip)
+            except Exception as e:
+                self.log(f"*** Failed to write clip: {e}")
+
+    def write_clip(self, clip):
+        first_event_time, first_event_name = clip.events[0]
+        local_time = time.localtime(first_event_time)
+        filename = os.path.join(time.strftime("%Y-%m-%d", local_time), f"{time.strftime('%H-%M-%S', local_time)}-{first_event_name}.avi")
+        filepath = os.path.join(self.folder, filename)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+        # The loop rate varies, so play back at the average rate the frames arrived
+        times = [t for t, _ in clip.frames]
+        fps = (len(times) - 1) / (times[-1] - times[0]) if len(times) > 1 and times[-1] > times[0] else 1.0
+
+        writer = None
+        for _, data in clip.frames:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if writer is None:
+                height, width = image.shape[:2]
+                writer = cv2.VideoWriter(filepath, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+                if not writer.isOpened():
+                    raise Exception(f"could not open {filepath}")
+            writer.write(image)
+        writer.release()
+
+        entry = {
+            "file": filename,
+            "start": times[0],
+            "end": times[-1],
+            "frames": len(times),
+            "fps": round(fps, 2),
+            "events": [{"t": t, "name": name} for t, name in clip.events],
+        }
+        with open(os.path.join(self.folder, INDEX_FILENAME), "a") as fout:
+            fout.write(json.dumps(entry) + "\n")
+
+        self.num_clips += 1
+        if self.on_clip is not None:
+            self.on_clip(filepath)
+        self.log(f'Saved clip of {", ".join(name for _, name in clip.events)} to "{filepath}" ({len(times)} frames)')
@@ -0,0 +1,165 @@
+"""
+Current history
+
+Fixed-memory, timestamped history of multi-channel current samples with O(1) appends.
+
+Samples are kept at several resolutions:
+ - raw: the most recent RAW_CAPACITY samples, as received
+ - tiers: per-bucket min/max/mean (eg., per second for hours, per minute for days), updated
+   incrementally as samples arrive, so long windows can be plotted or analyzed without keeping every sample
+
+Use `raw` for recent full-rate samples (eg., stall analysis), and `window` to get the finest
+resolution that covers a time range (eg., plotting the last day).
+
+"""
+
+import numpy as np
+
+# Number of raw samples kept (~4.5 minutes at 500 Hz, ~45 minutes at 10 Hz)
+RAW_CAPACITY = 1 << 17
+
+# (bucket seconds, number of buckets) of each downsampled tier, finest first
+DEFAULT_TIERS = [
+    (1.0, 60 * 60 * 6),         # Per second for 6 hours
+    (60.0, 60 * 24 * 7),        # Per minute for 7 days
+]
+
+
+class RingBuffer:
+    # Circular buffer of timestamped rows with `width` columns
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.rows = np.zeros((capacity, width))
+        self.count = 0  # Total rows ever added (the next row number)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # Add rows (one per time). Only the newest `capacity` rows are kept.
+    def extend(self, times, rows):
+        num_new = len(times)
+        keep = min(num_new, self.capacity)
+        indices = np.arange(self.count + num_new - keep, self.count + num_new) % self.capacity
+        self.times[indices] = times[-keep:]
+        self.rows[indices] = rows[-keep:]
+        self.count += num_new
+
+    # True if the buffer holds rows with t <= start_time, or has never dropped a row
+    def covers(self, start_time):
+        if self.count <= self.capacity:
+            return True
+        return self.times[self.count % self.capacity] <= start_time
+
+    # Copy of rows with start_time <= t < end_time, oldest first
+    def get(self, start_time=-float("inf"), end_time=float("inf")):
+        indices = np.arange(self.count - len(self), self.count) % self.capacity
+        times = self.times[indices]
+
+        # Rows are in time order, so the range is contiguous
+        first, last = np.searchsorted(times, [start_time, end_time])
+        return times[first:last], self.rows[indices[first:last]]
+
+
+class Tier:
+    # Per-bucket min/max/mean of each channel
+    def __init__(self, bucket_seconds, num_buckets, num_channels):
+        self.bucket_seconds = bucket_seconds
+        self.num_channels = num_channels
+
+        # Completed buckets. Columns: min of each channel, then max, then mean
+        self.buckets = RingBuffer(num_buckets, 3 * num_channels)
+
+        # Bucket being accumulated
+        self.pending_bucket = None
+        self.pending_min = None
+        self.pending_max = None
+        self.pending_sum = None
+        self.pending_count = 0
+
+    def extend(self, times, values):
+        bucket_numbers = np.floor(times / self.bucket_seconds).astype(np.int64)
+
+        # Split samples into runs of the same bucket (times are in order)
+        run_starts = np.flatnonzero(np.diff(bucket_numbers, prepend=bucket_numbers[0] - 1))
+        run_mins = np.minimum.reduceat(values, run_starts)
+        run_maxs = np.maximum.reduceat(values, run_starts)
+        run_sums = np.add.reduceat(values, run_starts)
+        run_counts = np.diff(np.append(run_starts, len(times)))
+        run_buckets = bucket_numbers[run_starts]
+
+        # The first run may continue the pending bucket
+        if self.pending_bucket == run_buckets[0]:
+            run_mins[0] = np.minimum(run_mins[0], self.pending_min)
+            run_maxs[0] = np.maximum(run_maxs[0], self.pending_max)
+            run_sums[0] += self.pending_sum
+            run_counts[0] += self.pending_count
+        elif self.pending_bucket is not None:
+            self.add_bucket(np.array([self.pending_bucket]), self.pending_min[None], self.pending_max[None], self.pending_sum[None], np.array([self.pending_count]))
+
+        # All runs but the last are complete
+        self.add_bucket(run_buckets[:-1], run_mins[:-1], run_maxs[:-1], run_sums[:-1], run_counts[:-1])
+        self.pending_bucket = run_buckets[-1]
+        self.pending_min = run_mins[-1]
+        self.pending_max = run_maxs[-1]
+        self.pending_sum = run_sums[-1]
+        self.pending_count = run_counts[-1]
+
+    def add_bucket(self, bucket_numbers, mins, maxs, sums, counts):
+        if len(bucket_numbers) == 0:
+            return
+        means = sums / counts[:, None]
+        self.buckets.extend(bucket_numbers * self.bucket_seconds, np.hstack((mins, maxs, means)))
+
+    # Returns (times, means, mins, maxs) of buckets starting in [start_time, end_time), including the pending bucket
+    def get(self, start_time=-float("inf"), end_time=float("inf")):
+        times, rows = self.buckets.get(start_time, end_time)
+        if self.pending_bucket is not None:
+            pending_time = self.pending_bucket * self.bucket_seconds
+            if start_time <= pending_time < end_time:
+                times = np.append(times, pending_time)
+                pending_row = np.hstack((self.pending_min, self.pending_max, self.pending_sum / self.pending_count))
+                rows = np.vstack((rows, pending_row))
+        n = self.num_channels
+        return times, rows[:, 2*n:], rows[:, :n], rows[:, n:2*n]
+
+
+class CurrentHistory:
+    def __init__(self, num_channels, raw_capacity=RAW_CAPACITY, tiers=DEFAULT_TIERS):
+        self.num_channels = num_channels
+        self.raw_samples = RingBuffer(raw_capacity, num_channels)
+        self.tiers = [Tier(bucket_seconds, num_buckets, num_channels) for bucket_seconds, num_buckets in tiers]
+
+    # Add one sample (one value per channel)
+    def append(self, t, values):
+        self.extend(np.array([t]), np.array([values], dtype=np.float64))
+
+    # Add samples: times (n,), values (n, num_channels), in time order
+    def extend(self, times, values):
+        if len(times) == 0:
+            return
+        values = np.asarray(values, dtype=np.float64)
+        self.raw_samples.extend(times, values)
+        for tier in self.tiers:
+            tier.extend(times, values)
+
+    def __len__(self):
+        return len(self.raw_samples)
+
+    # Full-rate samples with start_time <= t < end_time: (times, values)
+    def raw(self, start_time=-float("inf"), end_time=float("inf")):
+        return self.raw_samples.get(start_time, end_time)
+
+    # Samples covering [start_time, end_time) at the finest resolution still holding start_time
+    # Returns (times, means, mins, maxs). For raw samples, means, mins and maxs are the same values.
+    def window(self, start_time, end_time=float("inf")):
+        if self.raw_samples.covers(start_time) or len(self.tiers) == 0:
+            times, values = self.raw(start_time, end_time)
+            return times, values, values, values
+
+        for tier in self.tiers:
+            if tier.buckets.covers(start_time):
+                return tier.get(start_time, end_time)
+
+        # Nothing goes back far enough, so use the tier with the most history
+        return self.tiers[-1].get(start_time, end_time)
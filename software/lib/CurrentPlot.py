@@ -0,0 +1,82 @@
+"""
+Current plot
+
+Persistent matplotlib plot of door current, for kibbie's `i`/`e` exports and plot_current.py.
+
+The figure, axes and lines are created once and only their data is replaced on each update, so
+repeated plotting neither leaks figures nor pays for figure setup every time. The figure is
+rendered with the Agg backend directly (not through pyplot), so it works headless and is never
+registered with pyplot's figure manager.
+
+The time axis is fixed (eg., the last 10 minutes relative to now), so the axes, ticks, labels and
+grid are rendered once and cached. Each save only restores that background and draws the data.
+
+Saves are written to a temporary file and renamed, so readers (eg., a web page polling the PNG)
+never see a partial image. `save` can be rate-capped with `min_period_s`.
+
+"""
+
+import os
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+# Fast PNG compression (the plot is mostly flat color, so files stay small)
+PNG_COMPRESS_LEVEL = 1
+
+
+class CurrentPlot:
+    # xlim: time range (seconds relative to now), eg., (-600, 0)
+    def __init__(self, num_channels, xlim, title='Kibbie Door Current', ylim=(-0.1, 2.0)):
+        self.fig = Figure()
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+
+        self.ax.set(xlabel='time (s)', ylabel='Current (A)', title=title)
+        self.ax.grid()
+        self.ax.set_xlim(*xlim)
+        self.ax.set_ylim(*ylim)
+
+        # One mean line and one min/max band per channel
+        # Animated artists are left out of the cached background and drawn on every save
+        self.lines = [self.ax.plot([], [], animated=True)[0] for _ in range(num_channels)]
+        self.bands = [None] * num_channels
+        self.background = None
+
+        self.last_save_time = 0
+
+    # Replace the plotted data
+    # times: (n,) seconds relative to now (eg., -600 to 0)
+    # means: (n, num_channels). mins, maxs: (n, num_channels) to shade the range, or None
+    def update(self, times, means, mins=None, maxs=None):
+        for channel, line in enumerate(self.lines):
+            line.set_data(times, means[:, channel])
+
+            if self.bands[channel] is not None:
+                self.bands[channel].remove()
+                self.bands[channel] = None
+            if mins is not None and maxs is not None and mins is not means:
+                self.bands[channel] = self.ax.fill_between(times, mins[:, channel], maxs[:, channel], color=line.get_color(), alpha=0.3, animated=True)
+
+    # Render to a PNG. Returns False if skipped because the last save was less than min_period_s ago
+    def save(self, filepath, min_period_s=0):
+        now = time.time()
+        if now < self.last_save_time + min_period_s:
+            return False
+        self.last_save_time = now
+
+        if self.background is None:
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.canvas.restore_region(self.background)
+        for artist in self.bands + self.lines:
+            if artist is not None:
+                self.ax.draw_artist(artist)
+
+        temp_filepath = filepath + ".tmp"
+        Image.fromarray(np.asarray(self.canvas.buffer_rgba())).save(temp_filepath, format="png", compress_level=PNG_COMPRESS_LEVEL)
+        os.replace(temp_filepath, filepath)
+        return True
@@ -32,7 +32,7 @@ Dispenser state machine:
 from enum import Enum
 import time
 
-import lib.KibbieServoUtils as Servo
+from lib.EventJournal import EventType
 from lib.Persistence import Persistence
 
 DEBUG_DISPENSER_STATE_MACHINE = False # Set to True to schedule first dispense at time of init
@@ -46,13 +46,25 @@ class DispenserState(Enum):
 
 SECONDS_PER_DAY = 60 * 60 * 24 # s/min * min/hr * hr/day
 
+# Maximum time to wait for the servo process to acknowledge a door open or dispense
+# before moving on anyway (eg., if an acknowledgement is lost). Normal operation
+# transitions as soon as the acknowledgement arrives.
+# Also used by kibbie for blocking requests (eg., closing doors on shutdown).
+SERVO_ACK_TIMEOUT_S = 10 # s
+
+# Dispenser state is written to disk in the background at most this often, so step() never waits on the SD card
+PERSIST_DEBOUNCE_S = 1.0 # s
+
 class Dispenser:
-    def __init__(self, dispenses_per_day, dispenser_name, logfile):
+    # log_writer: LogWriter shared with kibbie
+    # journal: optional EventJournal to record state machine transitions in
+    def __init__(self, dispenses_per_day, dispenser_name, log_writer, journal=None):
         # Logging
         self.name = dispenser_name
-        self.logfile = logfile
+        self.log_writer = log_writer
+        self.journal = journal
 
-        self.persistence = Persistence(f"dispenser-{self.name}")
+        self.persistence = Persistence(f"dispenser-{self.name}", write_behind_seconds=PERSIST_DEBOUNCE_S)
 
         self.state = DispenserState.IDLE
         self.dispenses_per_day = dispenses_per_day
@@ -77,16 +89,13 @@ class Dispenser:
         self.open_door_request = False
         self.dispense_request = False
 
-        # Track timers for servo events
-        self.door_open_completion_time = 0
-        self.dispense_completion_time = 0
+        # Track timeouts for servo events (fallback if no completion acknowledgement arrives)
+        self.door_open_timeout_time = 0
+        self.dispense_timeout_time = 0
 
 
     def log(self, s):
-        output = f"[{time.asctime()}][Dispenser {self.name}] {s}"
-        self.logfile.write(f"{output}\n")
-        self.logfile.flush()
-        print(output)
+        self.log_writer.log(s, source=f"Dispenser {self.name}")
 
 
     def print_status(self):
@@ -97,6 +106,14 @@ class Dispenser:
         self.log("--------------")
     
 
+    # Transition the state machine, logging and journaling the transition
+    def set_state(self, new_state):
+        self.log(f"Transitioned {self.state.name}->{new_state.name}")
+        if self.journal is not None:
+            self.journal.append(EventType.STATE_TRANSITION, dispenser=self.name, from_state=self.state.name, to_state=new_state.name)
+        self.state = new_state
+
+
     # Force dispenser state machine to dispense food NOW
     def schedule_dispense_now(self):
         self.persistence.set("next_dispense_time", time.time())
@@ -104,8 +121,11 @@ class Dispenser:
     
 
     # Function to call at each step to run the state machine
+    # door_opened: True once the servo process acknowledged that this corral's door finished opening
+    # dispense_complete: True once the servo process acknowledged that the requested dispense finished
+    # door_blocked: True while the door can't be used (eg., recovering from a stall)
     # Returns door and dispenser commands
-    def step(self, allowed_cat_detected, disallowed_cat_detected):
+    def step(self, allowed_cat_detected, disallowed_cat_detected, door_opened=False, dispense_complete=False, door_blocked=False):
         current_time = time.time()
 
         if self.state == DispenserState.IDLE:
@@ -115,49 +135,45 @@ class Dispenser:
                 self.persistence.set("next_dispense_time", current_time + (SECONDS_PER_DAY / self.dispenses_per_day))
 
                 # Set next state
-                self.state = DispenserState.SEARCHING
-
-                self.log("Transitioned IDLE->SEARCHING")
+                self.set_state(DispenserState.SEARCHING)
 
         elif self.state == DispenserState.SEARCHING:
             # Transition to opening on no cats detected
-            if not allowed_cat_detected and not disallowed_cat_detected:
+            if not allowed_cat_detected and not disallowed_cat_detected and not door_blocked:
                 # On transition, open door
                 self.open_door_request = True
-                self.door_open_completion_time = current_time + Servo.DELAY_CONSECUTIVE_SERVO_STEP_WAIT # Door uses the queue_angle_stepped() function
-                self.log(f"Scheduled door open completion time for {time.asctime(time.localtime(self.door_open_completion_time))}")
+                self.door_open_timeout_time = current_time + SERVO_ACK_TIMEOUT_S
 
                 # Set next state
-                self.state = DispenserState.OPENING
-
-                self.log("Transitioned SEARCHING->OPENING")
+                self.set_state(DispenserState.OPENING)
         
         elif self.state == DispenserState.OPENING:
-            # Transition back to SEARCHING if a cat is detected
-            if allowed_cat_detected or disallowed_cat_detected:
+            # Transition back to SEARCHING if a cat is detected, or if the door failed to open (eg., stalled)
+            if allowed_cat_detected or disallowed_cat_detected or door_blocked:
+                if door_blocked:
+                    self.log("*** Door blocked while opening, retrying once it recovers")
                 self.open_door_request = False
-                self.state = DispenserState.SEARCHING
+                self.set_state(DispenserState.SEARCHING)
 
-                self.log("Transitioned OPENING->SEARCHING")
+            # Transition to DISPENSING once the servo process reports the door is open
+            elif door_opened or current_time >= self.door_open_timeout_time:
+                if not door_opened:
+                    self.log("*** Timed out waiting for door open acknowledgement")
 
-            # Transition to DISPENSING once the door is open
-            # Check servo state somehow (timer?)
-            elif current_time >= self.door_open_completion_time:
                 self.dispense_request = True
-                self.dispense_completion_time = current_time + Servo.DELAY_CONSECUTIVE_SERVO_WAIT # Dispenser uses the queue_angle() function
-
-                self.state = DispenserState.DISPENSING
+                self.dispense_timeout_time = current_time + SERVO_ACK_TIMEOUT_S
 
-                self.log("Transitioned OPENING->DISPENSING")
+                self.set_state(DispenserState.DISPENSING)
 
         elif self.state == DispenserState.DISPENSING:
-            # Transition to IDLE once dispensing is complete
-            if current_time >= self.dispense_completion_time:
+            # Transition to IDLE once the servo process reports dispensing is complete
+            if dispense_complete or current_time >= self.dispense_timeout_time:
+                if not dispense_complete:
+                    self.log("*** Timed out waiting for dispense acknowledgement")
+
                 self.dispense_request = False
                 self.open_door_request = False
 
-                self.state = DispenserState.IDLE
-
-                self.log("Transitioned DISPENSING->IDLE")
+                self.set_state(DispenserState.IDLE)
         
         return self.open_door_request, self.dispense_request
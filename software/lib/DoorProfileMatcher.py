@@ -0,0 +1,119 @@
+"""
+Door current profile matcher
+
+Classifies door movements from their current draw by comparing the current after each door
+command against stored templates (eg., normal open, normal close, obstructed, stall) using
+normalized cross-correlation, so actuation problems show up in the log without watching video.
+
+Templates are fixed-rate current profiles stored in data/door_current_templates.json
+(generated by serial_demo/build_door_templates.py from annotated recordings):
+
+    {
+        "sample_period_s": 0.05,
+        "templates": [{"name": "normal_open", "current": [0.05, 0.71, ...]}, ...]
+    }
+
+A live window is resampled to the same rate, and every template is correlated against every
+alignment (lag) of the window in one matrix product. Normalized cross-correlation ignores
+amplitude, so each score is weighted by how closely the RMS current matches the template's
+(a stall and a normal move can have similar shapes at very different currents). Windows whose
+best score is below `min_confidence` (eg., no current at all) are reported as no match.
+
+The bundled templates were cut from a single annotated recording, and `build_door_templates.py
+--check` classifies that same recording, so it only checks that the templates were cut correctly.
+They have not been validated against other doors or recordings.
+
+"""
+
+import json
+import os
+
+import numpy as np
+
+DEFAULT_TEMPLATES_FILEPATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "door_current_templates.json")
+
+# Windows (or parts of windows) with a standard deviation below this are treated as flat
+MIN_STD_A = 0.01
+
+# Best scores below this are reported as no match
+MIN_CONFIDENCE = 0.4
+
+
+# Result of classifying a window
+class DoorProfileMatch:
+    def __init__(self, name, confidence, lag_s, scores):
+        self.name = name                # Best-matching template, or None if no template scored at least min_confidence
+        self.confidence = confidence    # Score of the best template, 0 to 1
+        self.lag_s = lag_s              # Offset into the window where the best template matched
+        self.scores = scores            # Template name -> score
+
+    def __str__(self):
+        if self.name is None:
+            return "no match (" + ", ".join(f"{name} {score:.2f}" for name, score in sorted(self.scores.items(), key=lambda item: -item[1])) + ")"
+        others = ", ".join(f"{name} {score:.2f}" for name, score in sorted(self.scores.items(), key=lambda item: -item[1]) if name != self.name)
+        return f"{self.name} ({self.confidence:.2f} at +{self.lag_s:.2f} s; {others})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+# z-normalize the last axis (flat rows become zeros)
+def normalize_rows(rows):
+    centered = rows - rows.mean(axis=-1, keepdims=True)
+    std = centered.std(axis=-1, keepdims=True)
+    return np.where(std > MIN_STD_A, centered / np.maximum(std, MIN_STD_A), 0.0)
+
+
+class DoorProfileMatcher:
+    def __init__(self, templates_filepath=DEFAULT_TEMPLATES_FILEPATH):
+        with open(templates_filepath) as fin:
+            templates = json.load(fin)
+
+        self.sample_period_s = templates["sample_period_s"]
+        self.names = [template["name"] for template in templates["templates"]]
+
+        # All templates are cropped to the shortest one so they can be matched as one matrix
+        self.template_length = min(len(template["current"]) for template in templates["templates"])
+        self.templates = np.array([template["current"][:self.template_length] for template in templates["templates"]])
+        self.normalized_templates = normalize_rows(self.templates)
+        self.template_rms = np.sqrt(np.mean(self.templates ** 2, axis=1))
+
+    # Duration covered by the templates
+    def template_duration_s(self):
+        return self.template_length * self.sample_period_s
+
+    # Classify the current of one door over a window
+    # times: sample times (s), in order. currents: current (A) at each time
+    # min_confidence: best scores below this are returned as no match (name None)
+    # Returns a DoorProfileMatch, or None if the window has too few samples
+    def classify(self, times, currents, min_confidence=MIN_CONFIDENCE):
+        if len(times) < 2:
+            return None
+
+        # Resample to the template rate, padding short windows with their final (settled) current
+        num_samples = max(self.template_length, int((times[-1] - times[0]) / self.sample_period_s) + 1)
+        grid = times[0] + np.arange(num_samples) * self.sample_period_s
+        window = np.interp(grid, times, currents)
+
+        # Every alignment of the templates within the window: (num_lags, template_length)
+        segments = np.lib.stride_tricks.sliding_window_view(window, self.template_length)
+
+        # Normalized cross-correlation of every template at every lag: (num_templates, num_lags)
+        correlation = self.normalized_templates @ normalize_rows(segments).T / self.template_length
+
+        # Weight by amplitude similarity (1 when RMS matches, 0.5 when off by a factor of 2, ...)
+        # Floored so a window with no current scores 0 instead of dividing by zero
+        segment_rms = np.maximum(np.sqrt(np.mean(segments ** 2, axis=1)), MIN_STD_A)
+        rms_ratio = segment_rms[None, :] / self.template_rms[:, None]
+        amplitude_similarity = np.minimum(rms_ratio, 1.0 / rms_ratio)
+        scores = np.clip(correlation, 0.0, 1.0) * amplitude_similarity
+
+        best_lags = np.argmax(scores, axis=1)
+        best_scores = scores[np.arange(len(self.names)), best_lags]
+        best = int(np.argmax(best_scores))
+        return DoorProfileMatch(
+            self.names[best] if best_scores[best] >= min_confidence else None,
+            float(best_scores[best]),
+            float(best_lags[best] * self.sample_period_s),
+            {name: float(score) for name, score in zip(self.names, best_scores)},
+        )
@@ -0,0 +1,185 @@
+"""
+DVR recorder
+
+Continuously records the camera stream (at processing scale by default, see DVR_SCALE in
+Parameters.py) into fixed-length MJPG segments under `recordings/`, deleting the oldest segments
+once the total size goes over DVR_MAX_BYTES (checked whenever a segment is closed). Frames are
+encoded and written on a background thread, and dropped (not queued) if the writer falls behind.
+
+Processing-scale recordings are for viewing (see dvr_replay.py). To replay recordings through
+kibbie, which downsamples its input to the processing scale, record camera frames (DVR_SCALE = 1.0).
+
+Each segment has a sidecar index with the wall-clock time of every frame (little-endian float64
+seconds since epoch, one per frame):
+
+    recordings/segment-<YYYY-MM-DD_HH-MM-SS>.avi
+    recordings/segment-<YYYY-MM-DD_HH-MM-SS>.times
+
+Segments play back at DVR_FPS, but the loop rate varies, so use the index for wall-clock times.
+Every MJPG frame is a keyframe, so `seek` can find the segment and frame number for any time from
+the indexes alone, and a reader can jump straight to it (see dvr_replay.py).
+
+"""
+
+import os
+import queue
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from .Parameters import DVR_FPS, DVR_MAX_BYTES, DVR_SEGMENT_DURATION_S
+
+RECORDINGS_FOLDER = "recordings"
+SEGMENT_PREFIX = "segment-"
+VIDEO_SUFFIX = ".avi"
+TIMES_SUFFIX = ".times"
+SEGMENT_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+# Frames waiting to be written. New frames are dropped if the writer falls this far behind.
+MAX_QUEUED_FRAMES = 16
+
+
+# Paths of all segments in `folder` (without suffix), oldest first
+def list_segments(folder=RECORDINGS_FOLDER):
+    if not os.path.isdir(folder):
+        return []
+    names = [name[:-len(VIDEO_SUFFIX)] for name in os.listdir(folder) if name.startswith(SEGMENT_PREFIX) and name.endswith(VIDEO_SUFFIX)]
+    return [os.path.join(folder, name) for name in sorted(names)]
+
+
+# Frame times of a segment (see module docstring)
+def read_frame_times(segment_path):
+    try:
+        return np.fromfile(segment_path + TIMES_SUFFIX, dtype="<f8")
+    except OSError:
+        return np.zeros(0)
+
+
+# Find the first frame at or after time `t`
+# Returns (segment path + VIDEO_SUFFIX, frame number, frame time), or None if nothing was recorded after t
+def seek(t, folder=RECORDINGS_FOLDER):
+    segments = list_segments(folder)
+
+    # Segment names are their start times, so only the segment starting at or before t (and later ones) can match
+    start_times = [time.mktime(time.strptime(os.path.basename(path)[len(SEGMENT_PREFIX):], SEGMENT_TIME_FORMAT)) for path in segments]
+    first = max(0, int(np.searchsorted(start_times, t, side="right")) - 1)
+
+    for path in segments[first:]:
+        times = read_frame_times(path)
+        frame_number = int(np.searchsorted(times, t))
+        if frame_number < len(times):
+            return path + VIDEO_SUFFIX, frame_number, float(times[frame_number])
+    return None
+
+
+class DvrRecorder:
+    # log: function to report segments and errors (called from the writer thread)
+    def __init__(self, folder=RECORDINGS_FOLDER, segment_duration_s=DVR_SEGMENT_DURATION_S, max_bytes=DVR_MAX_BYTES, fps=DVR_FPS, log=print):
+        self.folder = folder
+        self.segment_duration_s = segment_duration_s
+        self.max_bytes = max_bytes
+        self.fps = fps
+        self.log = log
+        os.makedirs(self.folder, exist_ok=True)
+
+        self.frame_queue = queue.Queue(maxsize=MAX_QUEUED_FRAMES)   # (time, image), or None to stop
+
+        # Active segment (only touched by the writer thread)
+        self.video_writer = None
+        self.times_file = None
+        self.segment_path = None
+        self.segment_start_time = 0
+        self.segment_size = None        # Frame size (width, height) of the active segment
+
+        # Statistics
+        self.num_dropped_frames = 0
+
+        self.writer_thread = threading.Thread(target=self.run, name="kibbie-dvr", daemon=True)
+        self.writer_thread.start()
+
+    # Add a frame (never blocks). The image is copied, so the caller can keep drawing on it
+    def add_frame(self, image, t=None):
+        try:
+            self.frame_queue.put_nowait((time.time() if t is None else t, image.copy()))
+        except queue.Full:
+            self.num_dropped_frames += 1
+
+    # Write queued frames, close the active segment and stop
+    def close(self):
+        self.frame_queue.put(None)
+        self.writer_thread.join()
+
+
+    #############################################################
+    # Writer thread
+    #############################################################
+
+    def run(self):
+        self.evict()
+        while True:
+            frame = self.frame_queue.get()
+            if frame is None:
+                self.close_segment()
+                return
+
+            t, image = frame
+            try:
+                self.write_frame(t, image)
+            except Exception as e:
+                self.log(f"*** DVR failed to write frame: {e}")
+                self.close_segment()
+
+    def write_frame(self, t, image):
+        size = (image.shape[1], image.shape[0])
+        if self.video_writer is None or t >= self.segment_start_time + self.segment_duration_s or size != self.segment_size:
+            self.close_segment()
+            self.open_segment(t, size)
+
+        self.video_writer.write(image)
+        self.times_file.write(struct.pack("<d", t))
+
+    def open_segment(self, t, size):
+        # Segment start times must be unique and increasing, since they are used to order segments
+        start_time = max(int(t), int(self.segment_start_time) + 1)
+        self.segment_path = os.path.join(self.folder, SEGMENT_PREFIX + time.strftime(SEGMENT_TIME_FORMAT, time.localtime(start_time)))
+        self.segment_start_time = start_time
+        self.segment_size = size
+
+        self.video_writer = cv2.VideoWriter(self.segment_path + VIDEO_SUFFIX, cv2.VideoWriter_fourcc(*"MJPG"), self.fps, size)
+        if not self.video_writer.isOpened():
+            self.video_writer = None
+            raise Exception(f"could not open {self.segment_path + VIDEO_SUFFIX}")
+        self.times_file = open(self.segment_path + TIMES_SUFFIX, "wb")
+
+    def close_segment(self):
+        if self.video_writer is not None:
+            self.video_writer.release()
+            self.video_writer = None
+        if self.times_file is not None:
+            self.times_file.close()
+            self.times_file = None
+            self.evict()
+
+    # Delete the oldest segments until the recordings fit in max_bytes (always keeping the newest)
+    def evict(self):
+        segments = list_segments(self.folder)
+        sizes = []
+        for path in segments:
+            size = 0
+            for suffix in [VIDEO_SUFFIX, TIMES_SUFFIX]:
+                if os.path.exists(path + suffix):
+                    size += os.path.getsize(path + suffix)
+            sizes.append(size)
+
+        total_size = sum(sizes)
+        for path, size in zip(segments[:-1], sizes):
+            if total_size <= self.max_bytes:
+                break
+            for suffix in [VIDEO_SUFFIX, TIMES_SUFFIX]:
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            total_size -= size
+            self.log(f"DVR deleted oldest segment {path}{VIDEO_SUFFIX}")
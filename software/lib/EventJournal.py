@@ -0,0 +1,311 @@
+"""
+Event journal
+
+Append-only journal of typed, timestamped Kibbie events (door open/close, dispenses, cats entering/leaving
+corrals, dispenser state machine transitions, door stalls), so questions like "how many times did Noodle eat yesterday"
+can be answered without scraping kibbie.log.
+
+Events are stored one JSON object per line in segment files under `journal/`:
+
+    journal/events-<YYYY-MM-DD_HH-MM-SS>.jsonl       Active and recent segments (named by their start time)
+    journal/events-<YYYY-MM-DD_HH-MM-SS>.jsonl.gz    Compacted (gzipped) older segments
+
+A new segment is started every SEGMENT_DURATION_S or once a segment reaches MAX_SEGMENT_BYTES.
+Segments older than COMPACT_AFTER_S are gzipped in the background.
+
+Events are written by a background writer thread (like kibbie.log, see LogWriter.py), so `append`
+never waits on the SD card.
+
+Queries only open segments overlapping the requested time range, and binary search uncompressed
+segments to the first event in range, so they never read the whole history.
+
+JournalReader only queries (eg., from journal_query.py while kibbie is running): it never creates
+the folder or starts the writer thread.
+
+"""
+
+import atexit
+from enum import Enum
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+JOURNAL_FOLDER = "journal"
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".jsonl"
+COMPACTED_SUFFIX = ".gz"
+SEGMENT_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+SEGMENT_DURATION_S = 60 * 60 * 24       # Start a new segment every day
+MAX_SEGMENT_BYTES = 16 * 1024 * 1024    # ... or once the segment gets this large
+COMPACT_AFTER_S = 60 * 60 * 24 * 7      # Gzip segments once they are a week old
+
+# Once a binary search narrows to this many bytes, scan linearly
+SEEK_LINEAR_SCAN_BYTES = 4096
+
+
+class EventType(Enum):
+    DOOR_OPEN = "door_open"
+    DOOR_CLOSE = "door_close"
+    DISPENSE = "dispense"
+    CAT_ENTERED = "cat_entered"
+    CAT_LEFT = "cat_left"
+    STATE_TRANSITION = "state_transition"
+    DOOR_STALL = "door_stall"
+
+
+# Segment start time from its filename
+def segment_start_time(filename):
+    name = filename[len(SEGMENT_PREFIX):].split(".")[0]
+    return time.mktime(time.strptime(name, SEGMENT_TIME_FORMAT))
+
+
+# Read-only access to a journal (eg., for journal_query.py while kibbie keeps writing)
+# Never creates the folder or starts any threads
+class JournalReader:
+    def __init__(self, folder=JOURNAL_FOLDER):
+        self.folder = folder
+
+
+    #############################################################
+    # Querying
+    #############################################################
+
+    # Returns a sorted list of (start_time, filename) for all segments
+    def list_segments(self):
+        if not os.path.isdir(self.folder):
+            return []
+        segments = []
+        for filename in os.listdir(self.folder):
+            if filename.startswith(SEGMENT_PREFIX) and (filename.endswith(SEGMENT_SUFFIX) or filename.endswith(SEGMENT_SUFFIX + COMPACTED_SUFFIX)):
+                segments.append((segment_start_time(filename), filename))
+        segments.sort()
+        return segments
+
+    # Yield events (as dictionaries) with start_time <= t < end_time, oldest first
+    # event_types: optional list of EventType to include
+    # fields: optional exact-match filters (eg., corral="NOODLE_L")
+    def query(self, start_time=0, end_time=float("inf"), event_types=None, **fields):
+        type_values = None if event_types is None else set(event_type.value for event_type in event_types)
+
+        segments = self.list_segments()
+        for i,(segment_start, filename) in enumerate(segments):
+            segment_end = segments[i + 1][0] if i + 1 < len(segments) else float("inf")
+            if segment_end <= start_time or segment_start >= end_time:
+                continue
+
+            for record in self.read_segment(filename, start_time):
+                if record["t"] >= end_time:
+                    break
+                if record["t"] < start_time:
+                    continue
+                if type_values is not None and record["type"] not in type_values:
+                    continue
+                if any(record.get(key) != value for key, value in fields.items()):
+                    continue
+                yield record
+
+    # Number of events matching a query
+    def count(self, start_time=0, end_time=float("inf"), event_types=None, **fields):
+        return sum(1 for _ in self.query(start_time, end_time, event_types, **fields))
+
+    # Yield records from a segment, starting near the first event at or after start_time
+    def read_segment(self, filename, start_time):
+        filepath = os.path.join(self.folder, filename)
+        if filename.endswith(COMPACTED_SUFFIX):
+            fin = gzip.open(filepath, "rb")
+        else:
+            fin = open(filepath, "rb")
+            fin.seek(self.find_offset(fin, os.path.getsize(filepath), start_time))
+
+        with fin:
+            for line in fin:
+                # Skip a partially written last line
+                if not line.endswith(b"\n"):
+                    break
+                yield json.loads(line)
+
+    # Binary search for the offset of a line at or before the first event with t >= start_time
+    def find_offset(self, fin, size, start_time):
+        low = 0
+        high = size
+        while high - low > SEEK_LINEAR_SCAN_BYTES:
+            middle = (low + high) // 2
+            fin.seek(middle)
+            fin.readline()  # Skip to the start of the next line
+            line_start = fin.tell()
+            line = fin.readline()
+            if not line.endswith(b"\n") or json.loads(line)["t"] >= start_time:
+                high = middle
+            else:
+                low = line_start
+        return low
+
+
+class EventJournal(JournalReader):
+    def __init__(self, folder=JOURNAL_FOLDER):
+        super().__init__(folder)
+        os.makedirs(self.folder, exist_ok=True)
+
+        # (timestamp, line) records waiting to be written, threading.Event flush requests, or None to stop
+        self.queue = queue.SimpleQueue()
+
+        # Active segment (opened on first write, only touched by the writer thread)
+        self.segment_file = None
+        self.segment_start_time = 0
+
+        self.compaction_thread = None
+
+        # Statistics
+        self.num_write_errors = 0
+
+        self.is_closed = False
+        self.writer_thread = threading.Thread(target=self.run, name="kibbie-journal-writer", daemon=True)
+        self.writer_thread.start()
+
+        # Write whatever is still queued on exit
+        atexit.register(self.close)
+
+
+    #############################################################
+    # Writing
+    #############################################################
+
+    # Queue an event for the journal (never blocks)
+    # fields: extra event information (eg., corral="NOODLE_L", cat="Noodle")
+    def append(self, event_type, timestamp=None, **fields):
+        if timestamp is None:
+            timestamp = time.time()
+
+        record = {"t": timestamp, "type": event_type.value}
+        record.update(fields)
+        self.queue.put((timestamp, (json.dumps(record) + "\n").encode()))
+
+    # Wait until every event appended so far is written to disk
+    def flush(self):
+        if self.is_closed:
+            return
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait()
+
+    # Write all queued events and stop the writer thread
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self.queue.put(None)
+        self.writer_thread.join()
+
+
+    #############################################################
+    # Writer thread
+    #############################################################
+
+    def run(self):
+        is_running = True
+        while is_running:
+            # Wait for the first record, then take everything queued
+            records = [self.queue.get()]
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            flush_requests = []
+            for record in records:
+                if record is None:
+                    is_running = False
+                elif isinstance(record, threading.Event):
+                    flush_requests.append(record)
+                else:
+                    self.write_record(*record)
+
+            try:
+                if self.segment_file is not None:
+                    self.segment_file.flush()
+            except OSError:
+                self.num_write_errors += 1
+            for flushed in flush_requests:
+                flushed.set()
+
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+
+    def write_record(self, timestamp, line):
+        try:
+            if self.needs_rotation(timestamp):
+                self.rotate(timestamp)
+            self.segment_file.write(line)
+        except OSError as e:
+            # Keep going (eg., SD card full), later events may still make it
+            self.num_write_errors += 1
+            if self.num_write_errors == 1:
+                print(f"*** Failed to write journal event: {e}")
+
+    def needs_rotation(self, timestamp):
+        return (
+            self.segment_file is None or
+            timestamp >= self.segment_start_time + SEGMENT_DURATION_S or
+            self.segment_file.tell() >= MAX_SEGMENT_BYTES
+        )
+
+    # Close the active segment and start a new one
+    def rotate(self, timestamp):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_file = None
+
+        # Segment start times must be unique and increasing, since they are used to order segments
+        start_time = max(int(timestamp), int(self.segment_start_time) + 1)
+        filename = SEGMENT_PREFIX + time.strftime(SEGMENT_TIME_FORMAT, time.localtime(start_time)) + SEGMENT_SUFFIX
+        self.segment_file = open(os.path.join(self.folder, filename), "ab")
+        self.segment_start_time = start_time
+
+        self.start_compaction()
+
+
+    #############################################################
+    # Compaction
+    #############################################################
+
+    # Gzip old segments on a background thread (never blocks the caller)
+    def start_compaction(self):
+        if self.compaction_thread is not None and self.compaction_thread.is_alive():
+            return
+        self.compaction_thread = threading.Thread(target=self.compact, name="journal-compaction", daemon=True)
+        self.compaction_thread.start()
+
+    def compact(self):
+        cutoff_time = time.time() - COMPACT_AFTER_S
+        segments = self.list_segments()
+        for i,(start_time, filename) in enumerate(segments):
+            # A segment is old once the next segment started before the cutoff
+            if i + 1 >= len(segments) or segments[i + 1][0] > cutoff_time:
+                break
+            if filename.endswith(COMPACTED_SUFFIX):
+                continue
+
+            filepath = os.path.join(self.folder, filename)
+            compacted_filepath = filepath + COMPACTED_SUFFIX
+            with open(filepath, "rb") as fin, gzip.open(compacted_filepath + ".tmp", "wb") as fout:
+                shutil.copyfileobj(fin, fout)
+            os.replace(compacted_filepath + ".tmp", compacted_filepath)
+            os.remove(filepath)
+
+
+    #############################################################
+    # Querying
+    #############################################################
+
+    # Same as JournalReader.query, but first waits for queued events so the active segment is readable
+    # up to the latest event
+    def query(self, start_time=0, end_time=float("inf"), event_types=None, **fields):
+        self.flush()
+        return super().query(start_time, end_time, event_types, **fields)
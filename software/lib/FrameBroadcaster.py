@@ -0,0 +1,127 @@
+"""
+Frame broadcaster
+
+Shares kibbie's annotated `corrals` frame with any number of MJPEG viewers (eg., phones on the
+LAN) without opening the camera again or encoding the frame once per viewer.
+
+Each frame is JPEG-encoded once, on a background thread, and only while someone is watching.
+The latest encoded frame is kept with a sequence number, and viewers block on a condition
+variable until a newer frame is published:
+
+    broadcaster.subscribe()
+    seq = 0
+    while streaming:
+        seq, jpeg = broadcaster.wait_for_frame(seq, timeout=1.0)
+        ...
+    broadcaster.unsubscribe()
+
+Code that can't block (eg., an asyncio event loop) can `add_listener` instead, and is called from
+the encoder thread after each new frame is published.
+
+The stream is served over HTTP by WebServer (`/live` and `/stream.mjpg`).
+
+"""
+
+import threading
+
+import cv2
+
+from .Parameters import STREAM_JPEG_QUALITY
+
+
+class FrameBroadcaster:
+    def __init__(self, jpeg_quality=STREAM_JPEG_QUALITY):
+        self.encode_parameters = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+
+        # Guards everything below. Notified when a frame is added or published.
+        self.condition = threading.Condition()
+        self.num_subscribers = 0
+        self.pending_image = None   # Latest frame waiting to be encoded (older ones are replaced)
+        self.sequence = 0           # Incremented for every published frame
+        self.jpeg = None            # Latest published frame
+        self.is_closed = False
+
+        # Functions called with (sequence, jpeg) from the encoder thread
+        self.listeners = []
+
+        # Statistics
+        self.num_encoded = 0
+        self.num_skipped = 0        # Frames replaced before the encoder got to them
+
+        self.thread = threading.Thread(target=self.run, name="kibbie-stream-encoder", daemon=True)
+        self.thread.start()
+
+    # Offer a frame (never blocks). Ignored unless someone is watching.
+    # The image is copied, so the caller can keep drawing on it
+    def add_frame(self, image):
+        if self.num_subscribers == 0:
+            return
+        image = image.copy()
+        with self.condition:
+            if self.pending_image is not None:
+                self.num_skipped += 1
+            self.pending_image = image
+            self.condition.notify_all()
+
+    def subscribe(self):
+        with self.condition:
+            self.num_subscribers += 1
+
+    def unsubscribe(self):
+        with self.condition:
+            self.num_subscribers -= 1
+
+    # listener: function called with (sequence, jpeg) for each published frame.
+    # Counts as a subscriber until removed. Must not block.
+    def add_listener(self, listener):
+        with self.condition:
+            self.listeners.append(listener)
+            self.num_subscribers += 1
+
+    def remove_listener(self, listener):
+        with self.condition:
+            self.listeners.remove(listener)
+            self.num_subscribers -= 1
+
+    # Wait for a frame newer than `after_sequence`. Returns (sequence, jpeg), or (after_sequence, None)
+    # on timeout or close
+    def wait_for_frame(self, after_sequence, timeout=None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > after_sequence or self.is_closed, timeout)
+            if self.sequence > after_sequence:
+                return self.sequence, self.jpeg
+            return after_sequence, None
+
+    def close(self):
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+    #############################################################
+    # Encoder thread
+    #############################################################
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending_image is not None or self.is_closed)
+                if self.is_closed:
+                    return
+                image = self.pending_image
+                self.pending_image = None
+
+            is_encoded, data = cv2.imencode(".jpg", image, self.encode_parameters)
+            if not is_encoded:
+                continue
+
+            with self.condition:
+                self.sequence += 1
+                self.jpeg = data.tobytes()
+                self.num_encoded += 1
+                sequence, jpeg, listeners = self.sequence, self.jpeg, list(self.listeners)
+                self.condition.notify_all()
+            for listener in listeners:
+                listener(sequence, jpeg)
+
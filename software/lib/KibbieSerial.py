@@ -6,57 +6,242 @@ Managees reading and writing operations of Kibbie, including:
 - Publishing serial heartbeat message
 - Publishing per-channel relay enable/disable messages
 
+Serial is read on a background thread, so callers (eg., the vision loop) never wait on serial I/O.
+Every current sample is stored in a fixed-size, timestamped ring buffer. Use `snapshot` to read
+recent samples, or `channel_current` for the latest sample of each channel.
+
+If the port is missing or disappears (eg., USB unplugged), the reader thread keeps retrying
+in the background until it comes back.
+
+Only one process can own the port, so other tools should read samples through the serial broker
+(see lib/SerialBroker.py) instead of opening their own KibbieSerial.
+
+Two protocols are supported (see SERIAL_PROTOCOL in Parameters.py):
+ - "text": `I,<t>,<ch0>,<ch1>` lines, parsed one line at a time
+ - "binary": fixed-size frames decoded in bulk with numpy (see lib/MonitorProtocol.py), for high sample rates.
+   The monitor sketch must be built with ENABLE_BINARY_OUTPUT, and the port is opened as 8N1 so no bits are stripped.
+
 """
 
+import threading
+import time
+
+import numpy as np
 import serial
 
-class KibbieSerial:
-    # Separator used between tokens in a message
-    SEPARATOR = ","
+from .MonitorProtocol import FrameDecoder
+from .Parameters import SERIAL_PROTOCOL
 
-    def __init__(self):
-        # Define serial port
-        self.ser = serial.Serial(
-            port='/dev/ttyACM0',
-            baudrate=115200,
-            parity=serial.PARITY_ODD,
-            stopbits=serial.STOPBITS_TWO,
-            bytesize=serial.SEVENBITS
-        )
-
-        # Buffer to store received data in
-        self.buffer_string = ""
-
-        # Store most recent current sample
-        self.channel_current = []
-
-        # Open port
-        try: 
-            if(self.ser.isOpen() == False):
-                self.ser.open()
-        except Exception as e:
-            print("error open serial port: ", e)
-            raise e
-    
+# Timestamped ring buffer of current samples, filled by a reader thread and read from any thread
+# Shared by KibbieSerial and SerialBrokerClient so both can be read the same way
+class CurrentSampleBuffer:
+    # Number of current channels reported by the monitor
+    NUM_CURRENT_CHANNELS = 2
+
+    # Number of samples kept in the ring buffer per protocol, sized for a few minutes at the monitor's
+    # output rate: ~7 minutes of text at 10 Hz, ~4 minutes of binary at 500 Hz (4 MB)
+    # Readers that fall further behind than this lose the oldest samples (see `snapshot`)
+    RING_BUFFER_SIZES = {"text": 4096, "binary": 131072}
+
+    # protocol: monitor protocol the samples come from, which sets the ring buffer size
+    def __init__(self, protocol=SERIAL_PROTOCOL):
+        self.ring_buffer_size = CurrentSampleBuffer.RING_BUFFER_SIZES[protocol]
+
+        # Ring buffer of current samples
+        # Row i holds the sample with sample number `i % ring_buffer_size`
+        self.sample_times = np.zeros(self.ring_buffer_size)                                     # Time received (seconds since epoch)
+        self.sample_monitor_times_ms = np.zeros(self.ring_buffer_size, dtype=np.int64)          # Monitor timestamp (ms since monitor boot)
+        self.sample_currents = np.zeros((self.ring_buffer_size, CurrentSampleBuffer.NUM_CURRENT_CHANNELS))  # Current (A)
+        self.num_samples = 0    # Total samples received (the next sample number)
 
-    # Getter to retrieve the last receieved current
+        # Guards the ring buffer (shared with the reader thread)
+        self.lock = threading.Lock()
+
+    # Latest current of each channel, in amps (empty until the first sample arrives)
+    @property
+    def channel_current(self):
+        with self.lock:
+            if self.num_samples == 0:
+                return []
+            return self.sample_currents[(self.num_samples - 1) % self.ring_buffer_size].tolist()
+
+    # Getter to retrieve the last receieved current of a channel
     # from Kibbie monitor. Returns current in amps
-    def channel_current(self, channel):
-        if channel < len(self.channel_current):
-            return self.channel_current[channel]
+    def get_channel_current(self, channel):
+        current = self.channel_current
+        if channel < len(current):
+            return current[channel]
         else:
             return 0
-    
-    def set_current(self, channel, current):
-        if channel < len(self.channel_current):
-            self.channel_current[channel] = current
-        elif channel == len(self.channel_current):
-            self.channel_current.append(current)
+
+    # Copy of buffered samples, oldest first
+    # since: only return samples with sample number >= since (eg., the `num_samples` returned by a previous call)
+    # Returns (times, monitor_times_ms, currents, num_samples), where currents has one column per channel
+    # Only the newest ring_buffer_size samples are kept: if fewer than num_samples - since samples are
+    # returned, the caller fell behind and the missing ones were overwritten
+    def snapshot(self, since=0):
+        with self.lock:
+            num_samples = self.num_samples
+            start = max(since, num_samples - self.ring_buffer_size, 0)
+            indices = np.arange(start, num_samples) % self.ring_buffer_size
+            return (self.sample_times[indices], self.sample_monitor_times_ms[indices], self.sample_currents[indices], num_samples)
+
+    # Add samples (arrays with one row per sample) to the ring buffer
+    def add_samples(self, times, monitor_times_ms, currents):
+        # Only the newest ring_buffer_size samples fit
+        num_new = len(times)
+        keep = min(num_new, self.ring_buffer_size)
+        with self.lock:
+            indices = np.arange(self.num_samples + num_new - keep, self.num_samples + num_new) % self.ring_buffer_size
+            self.sample_times[indices] = times[-keep:]
+            self.sample_monitor_times_ms[indices] = monitor_times_ms[-keep:]
+            self.sample_currents[indices] = currents[-keep:]
+            self.num_samples += num_new
+
+
+class KibbieSerial(CurrentSampleBuffer):
+    # Separator used between tokens in a message
+    SEPARATOR = ","
+
+    PORT = "/dev/ttyACM0"
+    BAUDRATE = 115200
+
+    # How long the reader thread waits for data before checking if it should stop
+    READ_TIMEOUT_S = 0.1
+
+    # How long to wait between attempts to (re)open the port
+    RECONNECT_PERIOD_S = 1.0
+
+    # protocol: "text" or "binary" (defaults to SERIAL_PROTOCOL)
+    def __init__(self, port=PORT, protocol=None):
+        self.port = port
+        self.protocol = protocol if protocol is not None else SERIAL_PROTOCOL
+        if self.protocol not in ["text", "binary"]:
+            raise Exception(f"Unknown serial protocol {self.protocol}")
+        self.ser = None
+
+        super().__init__(self.protocol)
+
+        # Received data not yet processed
+        self.text_buffer = bytearray()      # Partial line (text protocol)
+        self.frame_decoder = FrameDecoder() # Partial frame (binary protocol)
+
+        # Most recent efuse status per channel: (amp-seconds, is open), guarded by `lock`
+        self.efuse_status = [(0.0, False)] * KibbieSerial.NUM_CURRENT_CHANNELS
+
+        # Start reader thread
+        self.is_connected = False
+        self.reported_connect_error = False
+        self.stop_event = threading.Event()
+        self.reader_thread = threading.Thread(target=self.reader_loop, name="kibbie-serial", daemon=True)
+        self.reader_thread.start()
+
+    # Stop the reader thread and close the port
+    def close(self):
+        self.stop_event.set()
+        self.reader_thread.join()
+
+
+    #############################################################
+    # Reader thread
+    #############################################################
+
+    def reader_loop(self):
+        while not self.stop_event.is_set():
+            if self.ser is None and not self.connect():
+                self.stop_event.wait(KibbieSerial.RECONNECT_PERIOD_S)
+                continue
+
+            try:
+                # Blocks for up to READ_TIMEOUT_S waiting for the first byte
+                data = self.ser.read(max(1, self.ser.in_waiting))
+            except (serial.SerialException, OSError) as e:
+                print(f"*** Lost serial port {self.port}: {e}")
+                self.disconnect()
+                continue
+
+            if not data:
+                continue
+
+            receive_time = time.time()
+            if self.protocol == "binary":
+                self.process_frames(data, receive_time)
+            else:
+                self.process_text(data, receive_time)
+
+        self.disconnect()
+
+    # Try to open the port. Returns True on success
+    def connect(self):
+        if self.protocol == "binary":
+            framing = dict(parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, bytesize=serial.EIGHTBITS)
         else:
-            raise Exception(f"Current channel {channel} out of bounds!")
-    
+            framing = dict(parity=serial.PARITY_ODD, stopbits=serial.STOPBITS_TWO, bytesize=serial.SEVENBITS)
+
+        try:
+            self.ser = serial.Serial(
+                port=self.port,
+                baudrate=KibbieSerial.BAUDRATE,
+                timeout=KibbieSerial.READ_TIMEOUT_S,
+                **framing
+            )
+        except (serial.SerialException, OSError) as e:
+            # Only report the first failure of each outage
+            if not self.reported_connect_error:
+                print(f"error open serial port: {e} (retrying every {KibbieSerial.RECONNECT_PERIOD_S} s)")
+                self.reported_connect_error = True
+            return False
+
+        print(f"Opened serial port {self.port}")
+        self.is_connected = True
+        self.reported_connect_error = False
+        return True
+
+    def disconnect(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.ser = None
+        self.is_connected = False
+
+        # Data from before the disconnect can't be completed
+        self.text_buffer.clear()
+        self.frame_decoder.reset()
+
+    # Decode binary frames
+    def process_frames(self, data, receive_time):
+        frames = self.frame_decoder.decode(data)
+        if len(frames) == 0:
+            return
+        monitor_times_ms, currents, efuse_open = FrameDecoder.to_samples(frames)
+
+        # Frames arrive in bursts, so spread receive times using the monitor's own timestamps
+        # (millis() wraps every ~49 days)
+        times = receive_time - ((monitor_times_ms[-1] - monitor_times_ms) % (1 << 32)) / 1000.0
+        self.add_samples(times, monitor_times_ms, currents)
+
+        # Frames only carry whether each efuse is open, not its amp-seconds
+        with self.lock:
+            self.efuse_status = [(float("nan"), bool(is_open)) for is_open in efuse_open[-1]]
+
+    # Split text into lines and process each complete line
+    def process_text(self, data, receive_time):
+        self.text_buffer += data
+
+        # Process complete lines, keep any partial line for the next read
+        end = self.text_buffer.rfind(b"\n")
+        if end < 0:
+            return
+        lines = self.text_buffer[:end].split(b"\n")
+        del self.text_buffer[:end + 1]
+
+        for line in lines:
+            self.process_line(line.decode(errors="replace"), receive_time)
+
     # Helper method to process a single line of serial
-    def process_line(self, line):
+    def process_line(self, line, receive_time):
         # Remove trailing characters
         line = line.strip("\r")
 
@@ -66,35 +251,17 @@ class KibbieSerial:
 
         try:
             if opcode == "I":
-                # Current measurement
-                for i,sample in enumerate(tokens[2:]):
-                    self.set_current(i, float(sample))
-                
-                print(f"Updated current: {self.channel_current}")
-            else:
+                # Current measurement: I,<timestamp>,<ch0 current>,<ch1 current>
+                currents = [float(sample) for sample in tokens[2:2 + KibbieSerial.NUM_CURRENT_CHANNELS]]
+                if len(currents) != KibbieSerial.NUM_CURRENT_CHANNELS:
+                    raise Exception(f"expected {KibbieSerial.NUM_CURRENT_CHANNELS} channels")
+                self.add_samples(np.array([receive_time]), np.array([int(tokens[1])]), np.array([currents]))
+            elif opcode == "F":
+                # Efuse status: F,<timestamp>,<ch0 amp-seconds>,<ch0 open>,<ch1 amp-seconds>,<ch1 open>
+                values = tokens[2:]
+                with self.lock:
+                    self.efuse_status = [(float(values[2*i]), values[2*i + 1] == "1") for i in range(len(values) // 2)]
+            elif line:
                 print(f'Unrecognized token for "{line}"')
         except Exception as e:
-            print(f"*** Error decoding serial: {e}")
-
-    # Periodic function to perform receive and send operations
-    # Call this from main run loop
-    def update(self):
-        if self.ser.isOpen():
-            # Read/process any buffered messages
-            try:
-                self.buffer_string += self.ser.read(self.ser.inWaiting()).decode()
-
-                if '\n' in self.buffer_string:
-                    lines = self.buffer_string.split('\n') # Guaranteed to have at least 2 entries
-
-                    for i,line in enumerate(lines[:-1]):
-                        # Process each line
-                        # print(i, ": ", line)
-                        self.process_line(line)        
-                    
-                    # Remove processed lines
-                    self.buffer_string = lines[-1]
-            except Exception as e:
-                print(f"*** Failed to decode serial: {e}")
-
-            # Write any buffered messages
+            print(f"*** Error decoding serial \"{line}\": {e}")
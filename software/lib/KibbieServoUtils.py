@@ -4,6 +4,7 @@ Library to provide Kibbie servo functions
 For desktop development, set IS_RASPBERRY_PI to False
 """
 
+import math
 import time
 from .Persistence import Persistence
 from.Parameters import *
@@ -77,6 +78,7 @@ ANGLE_DOOR_LATCH_RIGHT_LOCKED = 65
 # This results in a total actuation time of over 2 seconds.
 # Thus, any consecutive actions should (eg., door open -> dispense food) should wait ~3s in between when queueing
 NUM_SERVO_STEPS = 10 # Number of steps to open the door in 
+MAX_SERVO_STEP_DEGREES = 13 # Largest door movement per step (~1/NUM_SERVO_STEPS of full door travel), so partial moves take fewer steps
 DELAY_SERVO_WAIT = 1 # second
 DELAY_SERVO_WAIT_STEPS = 0.1 # seconds; Special case for stepped servo operation (eg., time between door movements)
 DELAY_SERVO_LATCH_ADDITIONAL = 1.0 # seconds; additional wait before latching servo for safety (so door doesn't jamb)
@@ -88,34 +90,57 @@ DELAY_CONSECUTIVE_SERVO_STEP_WAIT = DELAY_DOOR_LATCH_SERVO_WAIT + (NUM_SERVO_STE
 # How many degrees to overshoot the servo by when moving it to a target angle
 SERVO_OVERSHOOT_ANGLE_DEGREES = 3
 
-from numpy import arange
+# Servo angles are written to disk in the background at most this often, so the servo loop never waits on the SD card
+SERVO_ANGLE_PERSIST_DEBOUNCE_S = 0.5 # seconds
+
+# Completion statuses published on the acknowledgement queue
+COMMAND_STATUS_DONE = "done"                # All servo movements for the command were performed
+COMMAND_STATUS_SUPERSEDED = "superseded"    # A newer command cleared this command's remaining movements
+COMMAND_STATUS_CANCELLED = "cancelled"      # The movement was stopped part-way (eg., door stall), the servo is holding where it was
 
 # Class to represent a servo queue item
 # Each item contains a `timestamp` at which the servo `angle` should be commanded
+# `command_id` tracks which command queued the item so completion can be reported back
 class servo_queue_item:
-    def __init__(self, time, angle):
+    def __init__(self, time, angle, command_id=None):
         self.time = time
         self.angle = angle
+        self.command_id = command_id
     
     def __str__(self):
-        return f"(t={self.time}, a={self.angle})"
+        return f"(t={self.time}, a={self.angle}, id={self.command_id})"
     
     def __repr__(self):
         return self.__str__()
 
 
 class KibbieServoUtils:
-    def __init__(self, log_queue):
+    # log_queue: Servo -> Kibbie queue for (time, source, message) logs to write to disk
+    # ack_queue: Servo -> Kibbie queue for command completion events (optional)
+    # state_board: ServoStateBoard to publish servo state into (optional)
+    def __init__(self, log_queue, ack_queue=None, state_board=None):
         # Logging
         self.log_queue = log_queue
 
+        # Command completion events
+        # Each event is a list of ["complete", command_id, status]
+        self.ack_queue = ack_queue
+        self.pending_command_ids = set()     # Commands with movements still queued
+        self.superseded_command_ids = set()  # Commands whose movements were cleared by a newer command
+        self.cancelled_command_ids = set()   # Commands whose movements were cleared by cancel_motion
+
         # Save startup time to track uptime
         self.init_time = time.time()
 
         # Counters
         self.current_angles = []   # Current servo angle
+        self.commanded_angles = [None] * NUM_CHANNELS   # Last angle written to each servo (None until first movement)
         self.dispense_count = {}   # Total number of dispenses per channel
 
+        # Shared-memory state board for other processes to read servo state from
+        self.state_board = state_board
+        self.channel_update_times = [0.0] * NUM_CHANNELS   # Time of last movement per channel
+
         # Insatnce of ServoKit to perform controls
         self.kit = ServoKit(channels=NUM_CHANNELS)
 
@@ -125,18 +150,28 @@ class KibbieServoUtils:
         self.channel_queue = []
 
         # Persistance object to store servo angles
-        self.persisted_angles = Persistence("servo_angles")
+        self.persisted_angles = Persistence("servo_angles", write_behind_seconds=SERVO_ANGLE_PERSIST_DEBOUNCE_S)
 
 
+    # Logs are written (and printed) by kibbie's LogWriter
     def log(self, s):
-        output = f"[{time.asctime()}][KibbieServoUtils] {s}"
-        self.log_queue.put(output)
-        print(output)
+        self.log_queue.put((time.time(), "KibbieServoUtils", s))
+
+
+    # Last angle written to the servo. Tracked separately because ServoKit reconstructs its angle
+    # from the PWM duty cycle, which rarely matches the commanded angle exactly.
+    # Falls back to ServoKit (None if the channel was never commanded) before the first movement.
+    def get_commanded_angle(self, channel):
+        if self.commanded_angles[channel] is not None:
+            return self.commanded_angles[channel]
+        return self.kit.servo[channel].angle
 
 
     # Use this to simultaneously move servo and persist the angle to disk
     def set_actual_servo_angle(self, channel, new_angle):
         self.kit.servo[channel].angle = new_angle
+        self.commanded_angles[channel] = new_angle
+        self.channel_update_times[channel] = time.time()
 
         # Persist the last servo angle to file
         self.persisted_angles.set(channel, new_angle)
@@ -144,32 +179,118 @@ class KibbieServoUtils:
 
     def run_loop(self):
         current_time = time.time()
-        for channel,queue in enumerate(self.channel_queue):
-            # Check for actions to perform
-            if len(queue) > 0 and queue[0].time <= current_time:
-                start_angle = self.kit.servo[channel].angle
-                new_angle = self.channel_queue[channel].pop(0).angle
 
-                # Pop the head of queue
-                self.set_actual_servo_angle(channel, new_angle)
-                if DEBUG_SERVO_QUEUE:
-                    self.log(f"[Ch {channel}]: Angle before: {start_angle} \tAngle now: {new_angle} \tQueue after run_loop: {self.channel_queue[channel]}")
+        # Persist all channels moved this tick in a single write
+        with self.persisted_angles.batch():
+            for channel,queue in enumerate(self.channel_queue):
+                # Check for actions to perform
+                if len(queue) > 0 and queue[0].time <= current_time:
+                    start_angle = self.get_commanded_angle(channel)
+                    new_angle = self.channel_queue[channel].pop(0).angle
+
+                    # Pop the head of queue
+                    self.set_actual_servo_angle(channel, new_angle)
+                    if DEBUG_SERVO_QUEUE:
+                        self.log(f"[Ch {channel}]: Angle before: {start_angle} \tAngle now: {new_angle} \tQueue after run_loop: {self.channel_queue[channel]}")
+
+        # Report any commands that no longer have movements queued
+        self.publish_completed_commands()
+
+        # Publish latest state for other processes
+        self.publish_state()
+
+
+    # Write the current servo state to the shared-memory state board
+    def publish_state(self):
+        # Wait until init_servos() has set up the per-channel state
+        if self.state_board is None or len(self.channel_queue) < NUM_CHANNELS_USED:
+            return
+
+        commanded_angles = [self.get_commanded_angle(channel) or 0.0 for channel in range(NUM_CHANNELS_USED)]
+        queue_depths = [len(queue) for queue in self.channel_queue]
+        dispense_counts = [self.dispense_count.get(channel, 0) for channel in range(NUM_CHANNELS_USED)]
+
+        self.state_board.write(self.init_time, commanded_angles, self.current_angles, queue_depths, dispense_counts, self.channel_update_times)
+
+
+    # Publish a completion event for a command back to the main process
+    def publish_command_complete(self, command_id, status=COMMAND_STATUS_DONE):
+        if command_id is None:
+            return
+
+        self.pending_command_ids.discard(command_id)
+        self.superseded_command_ids.discard(command_id)
+        self.cancelled_command_ids.discard(command_id)
 
+        if self.ack_queue is not None:
+            self.ack_queue.put(["complete", command_id, status])
 
-    def queue_angle(self, channel, target_angle, offset_seconds=0):
+        if DEBUG_SERVO_QUEUE:
+            self.log(f"Command {command_id} complete ({status})")
+
+
+    # Check pending commands and publish completion for any without queued movements
+    def publish_completed_commands(self):
+        if len(self.pending_command_ids) == 0:
+            return
+
+        queued_command_ids = set()
+        for queue in self.channel_queue:
+            for item in queue:
+                queued_command_ids.add(item.command_id)
+
+        for command_id in list(self.pending_command_ids):
+            if command_id not in queued_command_ids:
+                if command_id in self.cancelled_command_ids:
+                    self.publish_command_complete(command_id, COMMAND_STATUS_CANCELLED)
+                elif command_id in self.superseded_command_ids:
+                    self.publish_command_complete(command_id, COMMAND_STATUS_SUPERSEDED)
+                else:
+                    self.publish_command_complete(command_id)
+
+
+    # Clear a channel's queue, remembering which commands lost movements
+    # lost_command_ids: set to add those commands to (superseded unless given)
+    def clear_channel_queue(self, channel, lost_command_ids=None):
+        if lost_command_ids is None:
+            lost_command_ids = self.superseded_command_ids
+        for item in self.channel_queue[channel]:
+            if item.command_id is not None:
+                lost_command_ids.add(item.command_id)
+        self.channel_queue[channel] = []
+
+
+    # Drop a channel's queued movements and hold it at the last commanded angle (eg., after a stall)
+    # Commands that lose movements complete as cancelled
+    def cancel_motion(self, channel, command_id=None):
+        self.clear_channel_queue(channel, self.cancelled_command_ids)
+
+        # Forget the old target so the next command to it moves the servo again
+        angle = self.get_commanded_angle(channel)
+        self.current_angles[channel] = angle
+
+        self.log(f"Cancelled movement on channel {channel} (holding at {angle})")
+        self.publish_command_complete(command_id)
+
+
+    # command_id: optional ID to report completion on the acknowledgement queue
+    def queue_angle(self, channel, target_angle, offset_seconds=0, command_id=None):
         # Check if no movement was needed
         if target_angle == self.current_angles[channel]:
+            self.publish_command_complete(command_id)
             return False
 
         current_time = time.time()
 
         # Clear the queue for the current motor
-        self.channel_queue[channel] = []
+        self.clear_channel_queue(channel)
 
         # Queue servo movement for 1 s (with overshoot)
-        self.channel_queue[channel].append(servo_queue_item(current_time + 0 * DELAY_SERVO_WAIT + offset_seconds, target_angle + SERVO_OVERSHOOT_ANGLE_DEGREES))
-        self.channel_queue[channel].append(servo_queue_item(current_time + 1 * DELAY_SERVO_WAIT + offset_seconds, target_angle - SERVO_OVERSHOOT_ANGLE_DEGREES))
-        self.channel_queue[channel].append(servo_queue_item(current_time + 2 * DELAY_SERVO_WAIT + offset_seconds, target_angle))
+        self.channel_queue[channel].append(servo_queue_item(current_time + 0 * DELAY_SERVO_WAIT + offset_seconds, target_angle + SERVO_OVERSHOOT_ANGLE_DEGREES, command_id))
+        self.channel_queue[channel].append(servo_queue_item(current_time + 1 * DELAY_SERVO_WAIT + offset_seconds, target_angle - SERVO_OVERSHOOT_ANGLE_DEGREES, command_id))
+        self.channel_queue[channel].append(servo_queue_item(current_time + 2 * DELAY_SERVO_WAIT + offset_seconds, target_angle, command_id))
+        if command_id is not None:
+            self.pending_command_ids.add(command_id)
 
         # Set the angle ahead of time so that we don't double queue if we try to go to this angle again
         # Opportunity to do a "smart queue" above to only move the motor in one direction and to cancel existing movements if going the other way.
@@ -180,50 +301,64 @@ class KibbieServoUtils:
 
     # Performs operation in 3 distinct steps. Intended for door operation
     # Goal is to give the cat a warning, then move most of the way (but not pinch paws), then fully open/close
-    def queue_angle_stepped(self, channel, target_angle, latch_channel, latch_angle_unlocked, latch_angle_locked, offset_seconds=0):
+    #
+    # New targets are merged into any in-flight movement instead of replaying the whole sequence:
+    #  - The door moves from where it was last commanded, and skips the warning step if it was already moving
+    #  - Latch movements left over from the previous command (eg., locking after a move) are dropped
+    #  - The latch is only unlocked if it is not already unlocked
+    #  - Shorter moves (eg., reversing a half-open door) take proportionally fewer steps
+    def queue_angle_stepped(self, channel, target_angle, latch_channel, latch_angle_unlocked, latch_angle_locked, offset_seconds=0, command_id=None):
         # Check if no movement was needed
         if target_angle == self.current_angles[channel]:
+            self.publish_command_complete(command_id)
             return False
 
         # Get motor movement times
         current_time = time.time()
         delta_t = current_time + offset_seconds
-        
-        # Always unlatch door before moving it
-        if self.kit.servo[latch_channel].angle != latch_angle_unlocked:
-            # self.log("Unlatching before door movement")
-            self.channel_queue[latch_channel] = [servo_queue_item(delta_t, latch_angle_unlocked)]
+
+        # Door is mid-movement if it still has queued steps from a previous command
+        door_in_flight = len(self.channel_queue[channel]) > 0
+
+        # Drop superseded latch movements (the previous command's lock would otherwise fire mid-movement)
+        self.clear_channel_queue(latch_channel)
+
+        # Always unlatch door before moving it, unless it is already unlatched
+        latch_unlock_needed = self.get_commanded_angle(latch_channel) != latch_angle_unlocked
+        if latch_unlock_needed:
+            self.channel_queue[latch_channel].append(servo_queue_item(delta_t, latch_angle_unlocked, command_id))
             delta_t += DELAY_DOOR_LATCH_SERVO_WAIT
 
         # Clear the queue for the current motor
-        self.channel_queue[channel] = []
+        self.clear_channel_queue(channel)
         
         # Additional steps
         # Note: Start not from the previous target angle of the servo, but the last commanded angle to prevent sudden snapping of the door.
-        start_angle = self.kit.servo[channel].angle
+        start_angle = self.get_commanded_angle(channel)
+        if start_angle is None:
+            start_angle = target_angle
         total_movement_angle = target_angle - start_angle
 
-        # Define the proportion of the way to move at each step
-        # angle_proportions = [
-        #     0.1,
-        #     0.75,
-        #     1.0,
-        # ]
-        angle_proportions = list(arange(0.0, 1.001, 1.0 / NUM_SERVO_STEPS))
+        # Split the movement into steps of at most MAX_SERVO_STEP_DEGREES
+        # The first step (at the start angle) is the warning for the cat, which is skipped when already moving
+        num_steps = max(1, math.ceil(abs(total_movement_angle) / MAX_SERVO_STEP_DEGREES))
+        first_step = 1 if door_in_flight else 0
 
         # Compute actual angles
-        angles = [int(proportion * total_movement_angle + start_angle) for proportion in angle_proportions]
+        angles = [int(start_angle + total_movement_angle * step / num_steps) for step in range(first_step, num_steps + 1)]
 
         # Queue servo movement for 1 s (with overshoot)
         for angle in angles:
             # Always target +1 degrees to help prevent chatter
-            self.channel_queue[channel].append(servo_queue_item(delta_t, angle + SERVO_OVERSHOOT_ANGLE_DEGREES))
+            self.channel_queue[channel].append(servo_queue_item(delta_t, angle + SERVO_OVERSHOOT_ANGLE_DEGREES, command_id))
             delta_t += DELAY_SERVO_WAIT_STEPS
-        self.channel_queue[channel].append(servo_queue_item(delta_t, target_angle - SERVO_OVERSHOOT_ANGLE_DEGREES))
+        self.channel_queue[channel].append(servo_queue_item(delta_t, target_angle - SERVO_OVERSHOOT_ANGLE_DEGREES, command_id))
         delta_t += DELAY_SERVO_WAIT_STEPS
-        self.channel_queue[channel].append(servo_queue_item(delta_t, target_angle))
+        self.channel_queue[channel].append(servo_queue_item(delta_t, target_angle, command_id))
 
         # Latch door after moving it (also overshoot and return)
+        # The lock isn't part of the command (command_id=None), so the command completes as soon as the
+        # door reaches its target instead of waiting out the latch delay
         delta_t += DELAY_SERVO_WAIT_STEPS + DELAY_SERVO_LATCH_ADDITIONAL
         if latch_angle_locked < latch_angle_unlocked:
             # Servo moving from high to low, so overshoot by going to a lower angle
@@ -234,9 +369,13 @@ class KibbieServoUtils:
         self.channel_queue[latch_channel].append(servo_queue_item(delta_t, latch_target_angle_overshoot))
         delta_t += DELAY_SERVO_WAIT_STEPS
         self.channel_queue[latch_channel].append(servo_queue_item(delta_t, latch_angle_locked))
+        if command_id is not None:
+            self.pending_command_ids.add(command_id)
+
+        if DEBUG_SERVO_QUEUE:
+            self.log(f"[Ch {channel}]: Planned {start_angle} -> {target_angle} in {len(angles)} steps (in flight: {door_in_flight}, unlock latch: {latch_unlock_needed})")
 
         # Set the angle ahead of time so that we don't double queue if we try to go to this angle again
-        # Opportunity to do a "smart queue" above to only move the motor in one direction and to cancel existing movements if going the other way.
         self.current_angles[channel] = target_angle
 
         return True
@@ -275,11 +414,11 @@ class KibbieServoUtils:
         self.log("--------------")
 
 
-    def dispense_food(self, dispenser_channel):
+    def dispense_food(self, dispenser_channel, command_id=None):
         if self.current_angles[dispenser_channel] == ANGLE_DISPENSE_1:
-            self.queue_angle(dispenser_channel, ANGLE_DISPENSE_2)
+            self.queue_angle(dispenser_channel, ANGLE_DISPENSE_2, command_id=command_id)
         else:
-            self.queue_angle(dispenser_channel, ANGLE_DISPENSE_1)
+            self.queue_angle(dispenser_channel, ANGLE_DISPENSE_1, command_id=command_id)
         
         # Track number of dispenses
         if dispenser_channel in self.dispense_count:
@@ -297,21 +436,29 @@ class KibbieServoUtils:
             self.run_loop()
 
             # Check for completion
-            queues_empty = True
+            next_item_time = None
             for queue in self.channel_queue:
-                if len(queue) > 0:
-                    queues_empty = False
-                    break
+                if len(queue) > 0 and (next_item_time is None or queue[0].time < next_item_time):
+                    next_item_time = queue[0].time
             
-            if queues_empty:
+            if next_item_time is None:
                 return
             
-            # Check again after some time
-            time.sleep(0.1)
-        
+            # Sleep until the next queued movement is due
+            time.sleep(max(0, next_item_time - time.time()))
+
+
+    # Command a servo straight to an angle it should already be at (no overshoot sequence)
+    # Used at startup to re-assert a persisted angle without visibly moving the servo
+    def hold_angle(self, channel, angle):
+        self.set_actual_servo_angle(channel, angle)
+        self.current_angles[channel] = angle
+
 
     # Initial setup
     def init_servos(self):
+        init_start_time = time.time()
+
         for channel_num in range(NUM_CHANNELS_USED):
             self.kit.servo[channel_num].actuation_range = 180
             self.kit.servo[channel_num].set_pulse_width_range(500, 2500)
@@ -325,7 +472,18 @@ class KibbieServoUtils:
         # For development only, to speed up program
         if SKIP_SERVO_WAIT:
             return
-        
+
+        # Start dispenser servos from where they were (if previously initialized)
+        prev_dispenser_left_angle = self.persisted_angles.get(CHANNEL_DISPENSER_LEFT)
+        prev_dispenser_right_angle = self.persisted_angles.get(CHANNEL_DISPENSER_RIGHT)
+        left_dispenser_initialized = prev_dispenser_left_angle in [ANGLE_DISPENSE_1, ANGLE_DISPENSE_2]
+        right_dispenser_initialized = prev_dispenser_right_angle in [ANGLE_DISPENSE_1, ANGLE_DISPENSE_2]
+
+        if HEADLESS_MODE:
+            self.init_servos_headless(prev_dispenser_left_angle, prev_dispenser_right_angle, left_dispenser_initialized, right_dispenser_initialized)
+            self.log(f"Servos ready in {time.time() - init_start_time:.2f} seconds")
+            return
+
         # Start with door open (in case food falls as servos initialize)
         # Note that we do not use stepped commands here, because we may command too extreme of an angle initially
         # and a human is likely present to operate the machine.
@@ -333,61 +491,105 @@ class KibbieServoUtils:
         self.queue_angle(CHANNEL_DOOR_LATCH_RIGHT, ANGLE_DOOR_LATCH_RIGHT_UNLOCKED)
         self.queue_angle(CHANNEL_DOOR_LEFT, ANGLE_DOOR_LEFT_OPEN, offset_seconds=DELAY_DOOR_LATCH_SERVO_WAIT)
         self.queue_angle(CHANNEL_DOOR_RIGHT, ANGLE_DOOR_RIGHT_OPEN, offset_seconds=DELAY_DOOR_LATCH_SERVO_WAIT)
-        self.block_until_servos_done()
 
-        # Start dispenser servos from where they were (if previously initialized)
-        prev_dispenser_left_angle = self.persisted_angles.get(CHANNEL_DISPENSER_LEFT)
-        prev_dispenser_right_angle = self.persisted_angles.get(CHANNEL_DISPENSER_RIGHT)
-        if prev_dispenser_left_angle and prev_dispenser_left_angle in [ANGLE_DISPENSE_1, ANGLE_DISPENSE_2]:
-            # Start at previous angle (should result in no kibbles dropping)
+        # Start at previous angle (should result in no kibbles dropping)
+        # Moves concurrently with the doors opening
+        if left_dispenser_initialized:
             self.queue_angle(CHANNEL_DISPENSER_LEFT, prev_dispenser_left_angle)
-            left_dispenser_initialized = True
-        else:
-            left_dispenser_initialized = False
-        if prev_dispenser_right_angle and prev_dispenser_right_angle in [ANGLE_DISPENSE_1, ANGLE_DISPENSE_2]:
-            # Start at previous angle (should result in no kibbles dropping)
+        if right_dispenser_initialized:
             self.queue_angle(CHANNEL_DISPENSER_RIGHT, prev_dispenser_right_angle)
-            right_dispenser_initialized = True
-        else:
-            right_dispenser_initialized = False
+        self.block_until_servos_done()
 
         # Initial prompt for whether the initialization sequence should be run
-        if not HEADLESS_MODE:
-            init_cmd = input("\nInitializing servos. Does food need to be loaded into the dispenser? (Y/n): ")
-            if init_cmd == "Y":
-                # We need authority in both directions, so 90 degrees is neutral
-                print("Setting angle to neutral (90 degrees)")
-                if not left_dispenser_initialized:
-                    self.queue_angle(CHANNEL_DISPENSER_LEFT, ANGLE_NEUTRAL)
-                if not right_dispenser_initialized:
-                    self.queue_angle(CHANNEL_DISPENSER_RIGHT, ANGLE_NEUTRAL)
-                self.block_until_servos_done()
-
-                # Wait for food to be loaded
-                print("90 degrees achieved! Please pour food in")
-                _ = input("\nHit enter to continue")
-
-                # Load food into side 2 by moving paddles to side 1
-                print("Loading first side...")
-                if prev_dispenser_left_angle != ANGLE_DISPENSE_1:
-                    self.queue_angle(CHANNEL_DISPENSER_LEFT, ANGLE_DISPENSE_1)
-                else:
-                    self.queue_angle(CHANNEL_DISPENSER_LEFT, ANGLE_DISPENSE_2)
-                if prev_dispenser_right_angle != ANGLE_DISPENSE_1:
-                    self.queue_angle(CHANNEL_DISPENSER_RIGHT, ANGLE_DISPENSE_1)
-                else:
-                    self.queue_angle(CHANNEL_DISPENSER_RIGHT, ANGLE_DISPENSE_2)
-                self.block_until_servos_done()
-                time.sleep(1.5)
-
-            # Now give operator a chance to empty the tray back into the hopper
-            _ = input("\nDispenser loaded. Please empty the food tray back into the hopper and hit Enter to continue.")
-
-            # Close the door
-            print("Closing the door in 5 seconds...")
-            time.sleep(5.0)
+        init_cmd = input("\nInitializing servos. Does food need to be loaded into the dispenser? (Y/n): ")
+        if init_cmd == "Y":
+            # We need authority in both directions, so 90 degrees is neutral
+            print("Setting angle to neutral (90 degrees)")
+            if not left_dispenser_initialized:
+                self.queue_angle(CHANNEL_DISPENSER_LEFT, ANGLE_NEUTRAL)
+            if not right_dispenser_initialized:
+                self.queue_angle(CHANNEL_DISPENSER_RIGHT, ANGLE_NEUTRAL)
+            self.block_until_servos_done()
+
+            # Wait for food to be loaded
+            print("90 degrees achieved! Please pour food in")
+            _ = input("\nHit enter to continue")
+
+            # Load food into side 2 by moving paddles to side 1
+            print("Loading first side...")
+            if prev_dispenser_left_angle != ANGLE_DISPENSE_1:
+                self.queue_angle(CHANNEL_DISPENSER_LEFT, ANGLE_DISPENSE_1)
+            else:
+                self.queue_angle(CHANNEL_DISPENSER_LEFT, ANGLE_DISPENSE_2)
+            if prev_dispenser_right_angle != ANGLE_DISPENSE_1:
+                self.queue_angle(CHANNEL_DISPENSER_RIGHT, ANGLE_DISPENSE_1)
+            else:
+                self.queue_angle(CHANNEL_DISPENSER_RIGHT, ANGLE_DISPENSE_2)
+            self.block_until_servos_done()
+            time.sleep(1.5)
+
+        # Now give operator a chance to empty the tray back into the hopper
+        _ = input("\nDispenser loaded. Please empty the food tray back into the hopper and hit Enter to continue.")
+
+        # Close the door
+        print("Closing the door in 5 seconds...")
+        time.sleep(5.0)
 
         print("Closing the door...")
         self.queue_angle_stepped(CHANNEL_DOOR_LEFT, ANGLE_DOOR_LEFT_CLOSED, CHANNEL_DOOR_LATCH_LEFT, ANGLE_DOOR_LATCH_LEFT_UNLOCKED, ANGLE_DOOR_LATCH_LEFT_LOCKED)
         self.queue_angle_stepped(CHANNEL_DOOR_RIGHT, ANGLE_DOOR_RIGHT_CLOSED, CHANNEL_DOOR_LATCH_RIGHT, ANGLE_DOOR_LATCH_RIGHT_UNLOCKED, ANGLE_DOOR_LATCH_RIGHT_LOCKED)
         self.block_until_servos_done()
+        self.log(f"Servos ready in {time.time() - init_start_time:.2f} seconds")
+
+
+    # Fast unattended startup (eg., after a watchdog reboot)
+    # Plans every channel's initial movement as one concurrent schedule and skips any movement
+    # that the persisted angles show is already satisfied (eg., doors already closed and latched)
+    def init_servos_headless(self, prev_dispenser_left_angle, prev_dispenser_right_angle, left_dispenser_initialized, right_dispenser_initialized):
+        # Start dispensers at their previous angle (should result in no kibbles dropping)
+        if left_dispenser_initialized:
+            self.hold_angle(CHANNEL_DISPENSER_LEFT, prev_dispenser_left_angle)
+        if right_dispenser_initialized:
+            self.hold_angle(CHANNEL_DISPENSER_RIGHT, prev_dispenser_right_angle)
+
+        doors = [
+            (CHANNEL_DOOR_LEFT, ANGLE_DOOR_LEFT_OPEN, ANGLE_DOOR_LEFT_CLOSED, CHANNEL_DOOR_LATCH_LEFT, ANGLE_DOOR_LATCH_LEFT_UNLOCKED, ANGLE_DOOR_LATCH_LEFT_LOCKED),
+            (CHANNEL_DOOR_RIGHT, ANGLE_DOOR_RIGHT_OPEN, ANGLE_DOOR_RIGHT_CLOSED, CHANNEL_DOOR_LATCH_RIGHT, ANGLE_DOOR_LATCH_RIGHT_UNLOCKED, ANGLE_DOOR_LATCH_RIGHT_LOCKED),
+        ]
+
+        # Doors in an unknown position are opened first (see below), then closed once that finishes
+        doors_to_close_after_opening = []
+
+        for door_channel, angle_open, angle_closed, latch_channel, latch_angle_unlocked, latch_angle_locked in doors:
+            prev_door_angle = self.persisted_angles.get(door_channel)
+            prev_latch_angle = self.persisted_angles.get(latch_channel)
+
+            if prev_door_angle == angle_closed and prev_latch_angle == latch_angle_locked:
+                # Already closed and latched, so just hold position
+                self.hold_angle(latch_channel, latch_angle_locked)
+                self.hold_angle(door_channel, angle_closed)
+                self.log(f"Door on channel {door_channel} already closed and latched")
+            elif prev_door_angle == angle_closed and prev_latch_angle is not None:
+                # Closed but not latched (eg., power lost before the latch locked): just lock it.
+                # The stepped close below would see the door already closed and queue nothing.
+                self.hold_angle(latch_channel, prev_latch_angle)
+                self.hold_angle(door_channel, angle_closed)
+                self.queue_angle(latch_channel, latch_angle_locked)
+                self.log(f"Door on channel {door_channel} closed but unlatched, locking latch")
+            elif prev_door_angle is not None and prev_latch_angle is not None:
+                # Known position (eg., shut down while open): close it from where it is
+                self.hold_angle(latch_channel, prev_latch_angle)
+                self.hold_angle(door_channel, prev_door_angle)
+                self.queue_angle_stepped(door_channel, angle_closed, latch_channel, latch_angle_unlocked, latch_angle_locked)
+            else:
+                # Unknown position: open without stepping first, so the stepped close starts from a known angle
+                self.queue_angle(latch_channel, latch_angle_unlocked)
+                self.queue_angle(door_channel, angle_open, offset_seconds=DELAY_DOOR_LATCH_SERVO_WAIT)
+                doors_to_close_after_opening.append((door_channel, angle_closed, latch_channel, latch_angle_unlocked, latch_angle_locked))
+
+        if len(doors_to_close_after_opening) > 0:
+            self.block_until_servos_done()
+            for door_channel, angle_closed, latch_channel, latch_angle_unlocked, latch_angle_locked in doors_to_close_after_opening:
+                self.queue_angle_stepped(door_channel, angle_closed, latch_channel, latch_angle_unlocked, latch_angle_locked)
+
+        self.block_until_servos_done()
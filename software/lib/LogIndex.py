@@ -0,0 +1,290 @@
+"""
+Kibbie log index
+
+Builds and incrementally maintains a sidecar index over the plain-text kibbie.log written by
+`kibbie.log()`, `Dispenser.log()` and the servo process log queue, so that historical questions
+(dispenses per day, door-open durations, state machine transitions) can be answered in
+milliseconds without scanning the whole log.
+
+Log lines look like:
+    [Mon Feb 13 08:00:00 2023] Opening NOODLE_L door
+    [Mon Feb 13 08:00:00 2023][Dispenser NOODLE_L] Transitioned IDLE->SEARCHING
+    [Mon Feb 13 08:00:00 2023][KibbieServoUtils] Food dispensed for channel 11
+
+The index is a SQLite database next to the log (`kibbie.log.index.sqlite3`) containing:
+ - events: one row per recognized event (time, byte offset, type, corral, cat, detail)
+ - checkpoints: (time, byte offset) roughly every CHECKPOINT_INTERVAL_BYTES, to seek to any time
+ - meta: how far the log has been indexed, and a signature of the log's first bytes
+
+Each update only parses lines appended since the previous update. If the log was replaced or
+truncated (signature mismatch or smaller than the indexed offset), or the index was built by an
+older INDEX_VERSION, the index is rebuilt.
+
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+INDEX_SUFFIX = ".index.sqlite3"
+
+# Bump when the recognized events change, so existing indexes are rebuilt
+INDEX_VERSION = 2
+
+# Number of bytes at the start of the log used to detect that the log was replaced
+SIGNATURE_BYTES = 1024
+
+# Save a (time, offset) checkpoint roughly this often
+CHECKPOINT_INTERVAL_BYTES = 64 * 1024
+
+# Read the log in chunks of this size while indexing
+READ_CHUNK_BYTES = 4 * 1024 * 1024
+
+LOG_TIME_FORMAT = "%a %b %d %H:%M:%S %Y"
+
+# Event types
+EVENT_DOOR_OPEN = "door_open"
+EVENT_DOOR_CLOSE = "door_close"
+EVENT_DISPENSE = "dispense"
+EVENT_CAT_ENTERED = "cat_entered"
+EVENT_CAT_LEFT = "cat_left"
+EVENT_STATE_TRANSITION = "state_transition"
+EVENT_STARTUP = "startup"
+EVENT_SHUTDOWN = "shutdown"
+
+# [time] or [time][source] prefix
+LINE_PATTERN = re.compile(rb"^\[([^\]]+)\](?:\[([^\]]+)\])? ?(.*)$")
+
+# Includes the movements that back a stalled door out ("Re-opening stalled X door", "Closing stalled X door")
+DOOR_PATTERN = re.compile(r"^(Opening|Closing|Re-opening) (?:stalled )?(\S+) door$")
+DISPENSE_PATTERN = re.compile(r"^Dispensing food in corral (\S+)$")
+CAT_PATTERN = re.compile(r"^Detected (allowed|disallowed) cat (\S+) (entered|left) (\S+) corral$")
+TRANSITION_PATTERN = re.compile(r"^Transitioned (\w+)->(\w+)$")
+STARTUP_MESSAGE = "Initializing kibbie..."
+SHUTDOWN_MESSAGE = "Kibbie exited main loop. Starting shutdown procedure..."
+DISPENSER_SOURCE_PREFIX = "Dispenser "
+
+# Every recognized message contains one of these, so other lines can skip parsing entirely
+EVENT_KEYWORDS = [b" door", b"Dispensing food", b"Detected ", b"Transitioned ", STARTUP_MESSAGE.encode(), SHUTDOWN_MESSAGE.encode()]
+
+
+# Returns (type, corral, cat, detail) for a recognized log message, or None
+def classify(source, message):
+    if source is not None and source.startswith(DISPENSER_SOURCE_PREFIX):
+        match = TRANSITION_PATTERN.match(message)
+        if match:
+            return (EVENT_STATE_TRANSITION, source[len(DISPENSER_SOURCE_PREFIX):], None, f"{match.group(1)}->{match.group(2)}")
+        return None
+
+    if source is not None:
+        return None
+
+    match = DOOR_PATTERN.match(message)
+    if match:
+        return (EVENT_DOOR_CLOSE if match.group(1) == "Closing" else EVENT_DOOR_OPEN, match.group(2), None, None)
+
+    match = DISPENSE_PATTERN.match(message)
+    if match:
+        return (EVENT_DISPENSE, match.group(1), None, None)
+
+    match = CAT_PATTERN.match(message)
+    if match:
+        return (EVENT_CAT_ENTERED if match.group(3) == "entered" else EVENT_CAT_LEFT, match.group(4), match.group(2), match.group(1))
+
+    if message == STARTUP_MESSAGE:
+        return (EVENT_STARTUP, None, None, None)
+    if message == SHUTDOWN_MESSAGE:
+        return (EVENT_SHUTDOWN, None, None, None)
+
+    return None
+
+
+class LogIndex:
+    def __init__(self, log_filepath, index_filepath=None):
+        self.log_filepath = log_filepath
+        self.index_filepath = index_filepath if index_filepath is not None else log_filepath + INDEX_SUFFIX
+
+        self.connection = sqlite3.connect(self.index_filepath)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.create_tables()
+
+        # Log timestamps repeat across consecutive lines, so cache parsed times
+        self.parsed_times = {}
+
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS events (t REAL NOT NULL, offset INTEGER NOT NULL, type TEXT NOT NULL, corral TEXT, cat TEXT, detail TEXT)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_by_type_time ON events (type, t)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS events_by_time ON events (t)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS checkpoints (t REAL NOT NULL, offset INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS checkpoints_by_time ON checkpoints (t)")
+
+    def get_meta(self, key, default=None):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key, value):
+        self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def log_signature(self):
+        with open(self.log_filepath, "rb") as fin:
+            return hashlib.sha1(fin.read(SIGNATURE_BYTES)).hexdigest()
+
+    def parse_time(self, time_bytes):
+        timestamp = self.parsed_times.get(time_bytes)
+        if timestamp is None:
+            try:
+                timestamp = time.mktime(time.strptime(time_bytes.decode(), LOG_TIME_FORMAT))
+            except ValueError:
+                return None
+            if len(self.parsed_times) > 100000:
+                self.parsed_times.clear()
+            self.parsed_times[time_bytes] = timestamp
+        return timestamp
+
+
+    #############################################################
+    # Indexing
+    #############################################################
+
+    # Index any lines appended since the last update
+    # Returns the number of bytes indexed
+    def update(self):
+        log_size = os.path.getsize(self.log_filepath)
+        indexed_offset = int(self.get_meta("indexed_offset", 0))
+        signature = self.get_meta("signature")
+
+        # Rebuild if the log was replaced or truncated
+        current_signature = self.log_signature()
+        is_outdated = indexed_offset > 0 and self.get_meta("version") != str(INDEX_VERSION)
+        if is_outdated or log_size < indexed_offset or (signature is not None and indexed_offset >= SIGNATURE_BYTES and signature != current_signature):
+            self.clear()
+            indexed_offset = 0
+
+        if indexed_offset >= log_size:
+            return 0
+
+        last_checkpoint_offset = int(self.get_meta("last_checkpoint_offset", -CHECKPOINT_INTERVAL_BYTES))
+        events = []
+        checkpoints = []
+
+        with open(self.log_filepath, "rb") as fin:
+            fin.seek(indexed_offset)
+            offset = indexed_offset
+            remainder = b""
+            while True:
+                chunk = fin.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                lines = (remainder + chunk).split(b"\n")
+                remainder = lines.pop()  # Incomplete last line (indexed on a later update)
+
+                for line in lines:
+                    line_offset = offset
+                    offset += len(line) + 1
+
+                    # Cheap substring checks first (most lines are neither events nor checkpoints)
+                    needs_checkpoint = line_offset - last_checkpoint_offset >= CHECKPOINT_INTERVAL_BYTES
+                    if not needs_checkpoint and not any(keyword in line for keyword in EVENT_KEYWORDS):
+                        continue
+
+                    match = LINE_PATTERN.match(line)
+                    if match is None:
+                        continue
+                    timestamp = self.parse_time(match.group(1))
+                    if timestamp is None:
+                        continue
+
+                    if needs_checkpoint:
+                        checkpoints.append((timestamp, line_offset))
+                        last_checkpoint_offset = line_offset
+
+                    source = match.group(2).decode(errors="replace") if match.group(2) is not None else None
+                    event = classify(source, match.group(3).decode(errors="replace").rstrip("\r"))
+                    if event is not None:
+                        events.append((timestamp, line_offset) + event)
+
+        with self.connection:
+            self.connection.executemany("INSERT INTO events (t, offset, type, corral, cat, detail) VALUES (?, ?, ?, ?, ?, ?)", events)
+            self.connection.executemany("INSERT INTO checkpoints (t, offset) VALUES (?, ?)", checkpoints)
+            self.set_meta("indexed_offset", offset)
+            self.set_meta("last_checkpoint_offset", last_checkpoint_offset)
+            self.set_meta("signature", current_signature)
+            self.set_meta("version", INDEX_VERSION)
+
+        return offset - indexed_offset
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM events")
+            self.connection.execute("DELETE FROM checkpoints")
+            self.connection.execute("DELETE FROM meta")
+
+
+    #############################################################
+    # Queries
+    #############################################################
+
+    # Returns a list of (t, type, corral, cat, detail), oldest first
+    def events(self, start_time=0, end_time=float("inf"), event_types=None, corral=None):
+        query = "SELECT t, type, corral, cat, detail FROM events WHERE t >= ? AND t < ?"
+        params = [start_time, end_time]
+        if event_types is not None:
+            query += f" AND type IN ({','.join('?' * len(event_types))})"
+            params += list(event_types)
+        if corral is not None:
+            query += " AND corral = ?"
+            params.append(corral)
+        query += " ORDER BY t, offset"
+        return self.connection.execute(query, params).fetchall()
+
+    # Returns a list of (day, corral, count) of dispenses per day
+    def dispenses_per_day(self, start_time=0, end_time=float("inf")):
+        return self.connection.execute(
+            "SELECT date(t, 'unixepoch', 'localtime') AS day, corral, COUNT(*) FROM events "
+            "WHERE type = ? AND t >= ? AND t < ? GROUP BY day, corral ORDER BY day, corral",
+            (EVENT_DISPENSE, start_time, end_time)).fetchall()
+
+    # Returns a list of (corral, open_time, close_time) for each door opening
+    # Openings still in progress at end_time (or never closed) have close_time None
+    def door_open_intervals(self, start_time=0, end_time=float("inf")):
+        intervals = []
+        open_times = {}
+        for t, event_type, corral, _, _ in self.events(start_time, end_time, [EVENT_DOOR_OPEN, EVENT_DOOR_CLOSE, EVENT_STARTUP]):
+            if event_type == EVENT_STARTUP:
+                # Doors are closed on startup, so any unmatched opening ended without a logged close
+                for open_corral, open_time in open_times.items():
+                    intervals.append((open_corral, open_time, None))
+                open_times = {}
+            elif event_type == EVENT_DOOR_OPEN:
+                open_times.setdefault(corral, t)
+            elif corral in open_times:
+                intervals.append((corral, open_times.pop(corral), t))
+        for corral, open_time in open_times.items():
+            intervals.append((corral, open_time, None))
+        intervals.sort(key=lambda interval: interval[1])
+        return intervals
+
+    # Yield raw log lines (as strings) between start_time and end_time, seeking via checkpoints
+    def lines(self, start_time=0, end_time=float("inf")):
+        row = self.connection.execute("SELECT MAX(offset) FROM checkpoints WHERE t < ?", (start_time,)).fetchone()
+        start_offset = row[0] if row is not None and row[0] is not None else 0
+
+        with open(self.log_filepath, "rb") as fin:
+            fin.seek(start_offset)
+            for line in fin:
+                match = LINE_PATTERN.match(line.rstrip(b"\n"))
+                timestamp = self.parse_time(match.group(1)) if match else None
+                if timestamp is None:
+                    continue
+                if timestamp >= end_time:
+                    break
+                if timestamp >= start_time:
+                    yield line.decode(errors="replace").rstrip("\r\n")
+
+    def close(self):
+        self.connection.close()
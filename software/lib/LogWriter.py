@@ -0,0 +1,171 @@
+"""
+Log writer
+
+Asynchronous writer for kibbie.log. Producers (kibbie, Dispenser, and the servo process through
+kibbie's log queue) only enqueue records, so the vision loop never waits on the SD card or the console.
+A single writer thread formats records, writes them in batches, and flushes:
+ - at least every FLUSH_PERIOD_S, and
+ - as soon as a batch holds a record at or above FLUSH_SEVERITY (eg., "*** ..." warnings),
+   so problems reach the disk even if kibbie dies right after.
+
+Lines keep the format parsed by lib/LogIndex.py:
+    [Mon Feb 13 08:00:00 2023] Opening NOODLE_L door
+    [Mon Feb 13 08:00:00 2023][Dispenser NOODLE_L] Transitioned IDLE->SEARCHING
+
+The log is rotated once it reaches MAX_LOG_BYTES and, if ROTATE_DAILY is set, when the day changes.
+Rotated logs are renamed to `<log>.<YYYY-MM-DD>` (the day of their last line, with `.1`, `.2`, ...
+appended if needed) and can be queried with `log_query.py --log <rotated log>`.
+
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+# Record severities
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+# Messages starting with this are logged as WARNING unless a severity is given
+WARNING_PREFIX = "***"
+
+FLUSH_PERIOD_S = 1.0        # Flush at least this often while records are being written
+FLUSH_SEVERITY = WARNING    # ... and immediately after records at or above this severity
+
+MAX_LOG_BYTES = 256 * 1024 * 1024   # Rotate once the log gets this large
+ROTATE_DAILY = False                # Also rotate when the day changes (each day is then queried separately)
+
+DAY_FORMAT = "%Y-%m-%d"
+
+
+class LogWriter:
+    # echo: also print each line to the console (from the writer thread)
+    def __init__(self, log_filepath, echo=True):
+        self.log_filepath = log_filepath
+        self.echo = echo
+
+        # (time, severity, source, message) records waiting to be written, or None to stop
+        self.queue = queue.SimpleQueue()
+
+        # Current file (only touched by the writer thread)
+        self.file = None
+        self.file_day = None    # Day of the last line written to the file
+        self.last_flush_time = 0
+        self.is_dirty = False   # Lines written since the last flush
+
+        # Statistics
+        self.num_write_errors = 0
+
+        self.is_closed = False
+        self.writer_thread = threading.Thread(target=self.run, name="kibbie-log-writer", daemon=True)
+        self.writer_thread.start()
+
+        # Write whatever is still queued on exit
+        atexit.register(self.close)
+
+    # Queue a line for the log (never blocks)
+    # source: shown after the time, eg., "Dispenser NOODLE_L"
+    # severity: one of DEBUG, INFO, WARNING, ERROR. Defaults to WARNING for "*** ..." messages, INFO otherwise
+    # t: time of the record (defaults to now)
+    def log(self, message, source=None, severity=None, t=None):
+        if severity is None:
+            severity = WARNING if message.startswith(WARNING_PREFIX) else INFO
+        self.queue.put((time.time() if t is None else t, severity, source, message))
+
+    # Write all queued records and stop the writer thread
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        self.queue.put(None)
+        self.writer_thread.join()
+
+
+    #############################################################
+    # Writer thread
+    #############################################################
+
+    def run(self):
+        is_running = True
+        while is_running:
+            # Wait for the first record (or until an unflushed batch is due), then take everything queued
+            timeout = max(0.0, self.last_flush_time + FLUSH_PERIOD_S - time.time()) if self.is_dirty else None
+            try:
+                records = [self.queue.get(timeout=timeout)]
+            except queue.Empty:
+                records = []
+            while True:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if None in records:
+                records = records[:records.index(None)]
+                is_running = False
+
+            self.write_records(records)
+
+            if self.is_dirty and (not is_running or time.time() >= self.last_flush_time + FLUSH_PERIOD_S or
+                                  any(severity >= FLUSH_SEVERITY for _, severity, _, _ in records)):
+                self.flush()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def write_records(self, records):
+        for t, _, source, message in records:
+            line = f"[{time.asctime(time.localtime(t))}]{f'[{source}]' if source else ''} {message}"
+            if self.echo:
+                print(line)
+
+            try:
+                data = (line + "\n").encode()
+                self.rotate_if_needed(t, len(data))
+                self.file.write(data)
+                self.is_dirty = True
+            except OSError as e:
+                # Keep going (eg., SD card full), the console still shows the line
+                self.num_write_errors += 1
+                if self.num_write_errors == 1:
+                    print(f"*** Failed to write {self.log_filepath}: {e}")
+
+    def flush(self):
+        try:
+            if self.file is not None:
+                self.file.flush()
+        except OSError:
+            self.num_write_errors += 1
+        self.is_dirty = False
+        self.last_flush_time = time.time()
+
+    # Open the log, first rotating it if it is too large or (with ROTATE_DAILY) from a previous day
+    def rotate_if_needed(self, t, num_bytes):
+        day = time.strftime(DAY_FORMAT, time.localtime(t))
+
+        if self.file is None:
+            self.file = open(self.log_filepath, "ab")
+            if self.file.tell() > 0:
+                self.file_day = time.strftime(DAY_FORMAT, time.localtime(os.path.getmtime(self.log_filepath)))
+
+        is_new_day = ROTATE_DAILY and self.file_day is not None and day != self.file_day
+        if self.file.tell() > 0 and (is_new_day or self.file.tell() + num_bytes > MAX_LOG_BYTES):
+            self.file.close()
+            self.file = None
+            os.rename(self.log_filepath, self.rotated_filepath(self.file_day or day))
+            self.file = open(self.log_filepath, "ab")
+
+        self.file_day = day
+
+    def rotated_filepath(self, day):
+        filepath = f"{self.log_filepath}.{day}"
+        suffix = 1
+        while os.path.exists(filepath):
+            filepath = f"{self.log_filepath}.{day}.{suffix}"
+            suffix += 1
+        return filepath
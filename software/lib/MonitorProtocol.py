@@ -0,0 +1,156 @@
+"""
+Kibbie monitor binary protocol
+
+Fixed-size binary frames for high-rate current telemetry from the Arduino monitor to the Pi,
+an alternative to the text `I,<t>,<ch0>,<ch1>` lines (see ENABLE_BINARY_OUTPUT in the monitor sketch).
+
+Frame layout (little-endian, FRAME_SIZE bytes):
+
+    uint16  sync            SYNC_WORD (bytes 0x5A 0xA5 on the wire)
+    uint16  sequence        Incremented per frame (wraps), used to count dropped frames
+    uint32  time_ms         Monitor millis() when the sample was taken
+    int16   current_ma[2]   Filtered current per channel, in milliamps
+    uint8   efuse_open      Bit i set if channel i's efuse is open (blown)
+    uint8   reserved
+    uint16  crc             CRC-16/CCITT-FALSE over bytes 2..13 (everything between sync and crc)
+
+`FrameDecoder` decodes whole buffers at once with numpy (no per-byte or per-frame Python work),
+resynchronizing on the sync word and dropping frames that fail the CRC.
+
+"""
+
+import struct
+
+import numpy as np
+
+SYNC_WORD = 0xA55A
+NUM_CHANNELS = 2
+
+FRAME_FORMAT = "<HHI2hBBH"
+FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+FRAME_DTYPE = np.dtype([
+    ("sync", "<u2"),
+    ("sequence", "<u2"),
+    ("time_ms", "<u4"),
+    ("current_ma", "<i2", (NUM_CHANNELS,)),
+    ("efuse_open", "u1"),
+    ("reserved", "u1"),
+    ("crc", "<u2"),
+])
+
+# Bytes covered by the CRC
+CRC_START = 2
+CRC_END = FRAME_SIZE - 2
+
+SEQUENCE_MODULO = 1 << 16
+
+CURRENT_MA_PER_A = 1000.0
+
+
+# CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) lookup table
+def make_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xFFFF)
+    return np.array(table, dtype=np.uint16)
+
+CRC_TABLE = make_crc_table()
+
+def crc16(data):
+    crc = 0xFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ int(CRC_TABLE[(crc >> 8) ^ byte])
+    return crc
+
+# CRC of each row of a (num_frames, num_bytes) uint8 array
+def crc16_rows(rows):
+    crc = np.full(len(rows), 0xFFFF, dtype=np.uint16)
+    for column in range(rows.shape[1]):
+        crc = (crc << 8) ^ CRC_TABLE[(crc >> 8) ^ rows[:, column]]
+    return crc
+
+
+# Build a frame (used by the monitor stand-in; the sketch builds the same bytes)
+# currents_a: current per channel in amps
+def encode_frame(sequence, time_ms, currents_a, efuse_open=(False, False)):
+    current_ma = [int(max(-32768, min(32767, round(current * CURRENT_MA_PER_A)))) for current in currents_a]
+    efuse_bits = sum(1 << i for i,is_open in enumerate(efuse_open) if is_open)
+    frame = struct.pack(FRAME_FORMAT, SYNC_WORD, sequence % SEQUENCE_MODULO, time_ms & 0xFFFFFFFF, *current_ma, efuse_bits, 0, 0)
+    return frame[:CRC_END] + struct.pack("<H", crc16(frame[CRC_START:CRC_END]))
+
+
+class FrameDecoder:
+    def __init__(self):
+        # Bytes received but not yet decoded (partial frame or unsynchronized data)
+        self.buffer = bytearray()
+
+        self.last_sequence = None
+        self.num_frames = 0             # Valid frames decoded
+        self.num_dropped_frames = 0     # Frames missing according to sequence numbers
+        self.num_crc_errors = 0         # Complete frames that failed the CRC
+
+    # Forget partial data (eg., after reconnecting), keeping the statistics
+    def reset(self):
+        self.buffer = bytearray()
+        self.last_sequence = None
+
+    # Decode as many frames as possible from the received bytes
+    # Returns a structured array of FRAME_DTYPE (possibly empty)
+    def decode(self, data):
+        self.buffer += data
+        buffer = np.frombuffer(self.buffer, dtype=np.uint8)
+        num_bytes = len(buffer)
+        if num_bytes < FRAME_SIZE:
+            return np.empty(0, dtype=FRAME_DTYPE)
+
+        # Candidate frame starts: every complete frame beginning with the sync word
+        last_start = num_bytes - FRAME_SIZE
+        starts = np.flatnonzero((buffer[:last_start + 1] == (SYNC_WORD & 0xFF)) & (buffer[1:last_start + 2] == (SYNC_WORD >> 8)))
+
+        rows = buffer[starts[:, None] + np.arange(FRAME_SIZE)]
+        frames = np.ascontiguousarray(rows).view(FRAME_DTYPE).reshape(-1)
+        is_valid = crc16_rows(rows[:, CRC_START:CRC_END]) == frames["crc"]
+        self.num_crc_errors += int(np.count_nonzero(~is_valid))
+
+        # Data that happens to contain the sync word can only fail the CRC (or overlap a real frame)
+        starts = starts[is_valid]
+        frames = frames[is_valid]
+        if len(starts) > 1 and np.any(np.diff(starts) < FRAME_SIZE):
+            keep = [0]
+            for i in range(1, len(starts)):
+                if starts[i] >= starts[keep[-1]] + FRAME_SIZE:
+                    keep.append(i)
+            starts = starts[keep]
+            frames = frames[keep]
+
+        # Every complete frame start has now been checked. Keep only bytes that could begin a frame not yet received.
+        consumed = num_bytes - (FRAME_SIZE - 1)
+        if len(starts) > 0:
+            consumed = max(consumed, int(starts[-1]) + FRAME_SIZE)
+        del buffer  # Release the numpy view so the bytearray can be resized
+        del self.buffer[:consumed]
+
+        self.count_sequence(frames["sequence"])
+        self.num_frames += len(frames)
+        return frames
+
+    # Track dropped frames from gaps in the sequence numbers
+    def count_sequence(self, sequences):
+        if len(sequences) == 0:
+            return
+        sequences = sequences.astype(np.int64)
+        if self.last_sequence is not None:
+            sequences = np.concatenate(([self.last_sequence], sequences))
+        gaps = (np.diff(sequences) - 1) % SEQUENCE_MODULO
+        self.num_dropped_frames += int(gaps.sum())
+        self.last_sequence = int(sequences[-1])
+
+    # Convert decoded frames to (time_ms, currents in amps, efuse open flags per channel)
+    @staticmethod
+    def to_samples(frames):
+        currents = frames["current_ma"].astype(np.float64) / CURRENT_MA_PER_A
+        efuse_open = ((frames["efuse_open"][:, None] >> np.arange(NUM_CHANNELS)) & 1) == 1
+        return frames["time_ms"].astype(np.int64), currents, efuse_open
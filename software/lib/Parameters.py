@@ -10,9 +10,58 @@ IS_ARDUINO_MONITOR_ATTACHED = IS_RASPBERRY_PI
 # Headless mode toggle
 HEADLESS_MODE = True # True to not open doors and prompt user to initialize
 
+# KibbieSerial.py parameters
+SERIAL_PROTOCOL = "text" # "text" for I,<t>,<ch0>,<ch1> lines, or "binary" for framed samples (build the monitor sketch with ENABLE_BINARY_OUTPUT to match)
+
+# LogWriter.py parameters
+LOG_ECHO_TO_CONSOLE = True # Set to False to only write log lines to kibbie.log
+
+# SnapshotExporter.py parameters
+SNAPSHOT_FORMAT = "jpeg" # "png", "jpeg" or "webp"
+SNAPSHOT_QUALITY = 90 # 0-100 for jpeg, 1-100 for webp
+SNAPSHOT_PNG_COMPRESSION = 3 # 0-9 for png (higher is smaller and slower)
+
+# ClipRecorder.py parameters
+ENABLE_CLIP_RECORDER = True # Record a short video clip around each door open/close and dispense
+CLIP_PRE_ROLL_S = 10.0 # Seconds of video kept before each event
+CLIP_POST_ROLL_S = 10.0 # Seconds of video recorded after each event
+CLIP_JPEG_QUALITY = 80 # Quality of buffered and recorded frames (0-100)
+
+# DvrRecorder.py parameters
+ENABLE_DVR = False # Continuously record the camera into rolling segments under recordings/
+DVR_SCALE = None # Scale of recorded frames relative to the camera (None to record at the processing scale, 1.0 to record replayable camera frames)
+DVR_FPS = 10 # Nominal playback rate of segments (frame times are in each segment's .times index)
+DVR_SEGMENT_DURATION_S = 5 * 60 # Start a new segment this often
+DVR_MAX_BYTES = 4 * 1024 * 1024 * 1024 # Delete the oldest segments once recordings take more space than this
+
+# StorageManager.py parameters
+STORAGE_BUDGET_BYTES = 8 * 1024 * 1024 * 1024 # Total size of snapshots and clips (oldest periodic snapshots are deleted first)
+STORAGE_MIN_FREE_BYTES = 1024 * 1024 * 1024 # Also delete periodic snapshots and clips (only) while the disk has less free space than this
+
+# WebServer.py parameters
+ENABLE_WEB_SERVER = True # Serve snapshots, clips, status and control from kibbie (replaces running server.py)
+WEB_PORT = 8000 # http://<kibbie>:<port>/
+WEB_STATUS_PERIOD_S = 1.0 # How often kibbie publishes /status.json
+WEB_CONTROL_TOKEN = None # Secret required by POST /control (sent as "Authorization: Bearer <token>"), None to disable control
+
+# ThumbnailCache.py parameters
+ENABLE_THUMBNAILS = True # Thumbnails and the /gallery pages on the web server
+THUMBNAIL_CACHE_MAX_BYTES = 200 * 1024 * 1024 # Least recently used thumbnails are deleted beyond this
+
+# FrameBroadcaster.py parameters
+ENABLE_STREAM = True # Serve the annotated corrals view as an MJPEG stream (at /live on the web server)
+STREAM_JPEG_QUALITY = 70 # Quality of streamed frames (0-100)
+
+# TelemetryRecorder.py parameters
+ENABLE_TELEMETRY = True # Record per-frame detection internals under telemetry/ for offline analysis
+TELEMETRY_RETENTION_DAYS = 90 # Delete telemetry older than this (~60 MB per day)
+
 # KibbieServoUtils.py parameters
 DEV_VIDEO_PROCESSING = True # Set to True to skip servo motor init
 DEBUG_SERVO_QUEUE = False # Set to True to print per-channel servo queue information
 
 SKIP_SERVO_WAIT = not IS_RASPBERRY_PI and DEV_VIDEO_PROCESSING
 
+
+# Persistence.py parameters
+PERSISTENCE_BACKEND = "json" # "json" for one file per store, or "sqlite" for a single WAL-mode database shared by all processes
@@ -5,64 +5,302 @@ A python class can create a persistence object and read/update values
 
 Each persistence object is identified by an ID. Any persistence objects created with the ID will share the same datastore.
 
+Writes are atomic: the datastore is written to a temporary file which then replaces the previous file,
+so a power cut mid-write leaves the previous contents intact.
+
+By default, every changed value is written to disk before `set` returns. Hot callers can instead use
+write-behind mode (`write_behind_seconds` > 0), where changes are written by a background thread at most
+once per debounce window, and `flush` forces pending changes to disk. Use `batch` to group several
+changes into a single write in either mode.
+
+Reads (`get`) are always served from memory, so they never touch the disk or the database.
+
+Two storage backends are available (see PERSISTENCE_BACKEND in Parameters.py):
+ - "json": one `persistence/<id>.json` file per ID, rewritten in full on every write
+ - "sqlite": a single `persistence/kibbie.sqlite3` database in WAL mode, shared by all processes.
+   Only changed keys are written. Values written by other processes are picked up with `reload`.
+   Existing `persistence/<id>.json` files are imported the first time their ID is opened.
+
 """
 
+import atexit
+from contextlib import contextmanager
 import os
 import json
+import sqlite3
+import threading
+import time
+
+from .Parameters import PERSISTENCE_BACKEND
 
 PERSISTENCE_FOLDER = "persistence"
+SQLITE_FILENAME = "kibbie.sqlite3"
 
-class Persistence:
-    def __init__(self, id):
-        self.id = id
-        self.filepath = os.path.join(PERSISTENCE_FOLDER, id + ".json")
-        self.is_dirty = False
+# How long to wait for another process to finish writing to the SQLite database
+SQLITE_BUSY_TIMEOUT_MS = 5000
 
-        # The main dictionary for this persistence object
-        self.data = {}
+# fsync policy tiers (how hard to try to get each write onto the SD card before continuing)
+FSYNC_NONE = 0              # Leave it to the OS to write back (fastest, may lose the latest write on power loss)
+FSYNC_FILE = 1              # fsync the file contents before replacing the previous file
+FSYNC_FILE_AND_FOLDER = 2   # Also fsync the folder so the replacement itself survives power loss
 
-        # Create persistence folder if needed
-        os.makedirs(PERSISTENCE_FOLDER, exist_ok=True)
+# Stores each ID as a single JSON file, rewritten in full on every write
+class JsonBackend:
+    def __init__(self, id, fsync_policy):
+        self.filepath = os.path.join(PERSISTENCE_FOLDER, id + ".json")
+        self.fsync_policy = fsync_policy
 
+    def load(self):
         # Attempt to load previous state if it exists
         if os.path.exists(self.filepath):
             # Attempt to open and load CSV to a dictionary
             try:
                 with open(self.filepath, 'r') as fin:
-                    self.data = json.load(fin)
+                    return json.load(fin)
             except:
                 print(f"Failed to load persistence json {self.filepath}")
+        return {}
+
+    def write(self, data, changed_keys):
+        write_json_atomic(self.filepath, json.dumps(data), self.fsync_policy)
+
+    def close(self):
+        pass
+
+
+# Stores all IDs in one SQLite database (WAL mode) with one row per key
+# Safe to use from multiple processes at once
+class SqliteBackend:
+    def __init__(self, id, fsync_policy):
+        self.id = id
+        self.filepath = os.path.join(PERSISTENCE_FOLDER, SQLITE_FILENAME)
+        self.synchronous = {FSYNC_NONE: "OFF", FSYNC_FILE: "NORMAL", FSYNC_FILE_AND_FOLDER: "FULL"}[fsync_policy]
+
+        # One connection per thread, so the write-behind thread never shares a connection with readers
+        self.thread_local = threading.local()
+
+        self.get_connection().execute("CREATE TABLE IF NOT EXISTS persistence (id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (id, key))")
+        self.migrate_json()
+
+    def get_connection(self):
+        connection = getattr(self.thread_local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.filepath, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            self.thread_local.connection = connection
+        return connection
+
+    # Import `persistence/<id>.json` the first time this ID is opened with the SQLite backend
+    def migrate_json(self):
+        json_filepath = os.path.join(PERSISTENCE_FOLDER, self.id + ".json")
+        if not os.path.exists(json_filepath):
+            return
+
+        already_migrated = self.get_connection().execute("SELECT 1 FROM persistence WHERE id = ? LIMIT 1", (self.id,)).fetchone() is not None
+        if not already_migrated:
+            data = JsonBackend(self.id, FSYNC_NONE).load()
+            self.write(data, data.keys())
+            print(f"Migrated {len(data)} values from {json_filepath} to {self.filepath}")
+
+        # Keep the old file for reference, but out of the way of future migrations
+        os.replace(json_filepath, json_filepath + ".migrated")
+
+    def load(self):
+        rows = self.get_connection().execute("SELECT key, value FROM persistence WHERE id = ?", (self.id,)).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    # Write only the changed keys, in a single transaction
+    def write(self, data, changed_keys):
+        rows = [(self.id, key, json.dumps(data[key])) for key in changed_keys]
+        connection = self.get_connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT OR REPLACE INTO persistence (id, key, value) VALUES (?, ?, ?)", rows)
+            connection.execute("COMMIT")
+        except:
+            connection.execute("ROLLBACK")
+            raise
+
+    # Close the calling thread's connection
+    def close(self):
+        connection = getattr(self.thread_local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.thread_local.connection = None
+
+
+# Write to a temporary file, then replace the previous file in one step
+def write_json_atomic(filepath, serialized, fsync_policy):
+    temp_filepath = filepath + ".tmp"
+    with open(temp_filepath, 'w') as fout:
+        fout.write(serialized)
+        if fsync_policy >= FSYNC_FILE:
+            fout.flush()
+            os.fsync(fout.fileno())
+
+    os.replace(temp_filepath, filepath)
+
+    # Folder fsync is only supported on POSIX systems
+    if fsync_policy >= FSYNC_FILE_AND_FOLDER and hasattr(os, "O_DIRECTORY"):
+        folder_fd = os.open(os.path.dirname(filepath), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(folder_fd)
+        finally:
+            os.close(folder_fd)
+
 
+class Persistence:
+    # write_behind_seconds: 0 to write on every change, or > 0 to write from a background thread at most once per window
+    # fsync_policy: one of the FSYNC_* tiers
+    # backend: "json" or "sqlite" (defaults to PERSISTENCE_BACKEND)
+    def __init__(self, id, write_behind_seconds=0, fsync_policy=FSYNC_FILE, backend=None):
+        self.id = id
+        self.is_dirty = False
+        self.dirty_keys = set()     # Keys changed since the last write
+        self.writing_keys = set()   # Keys currently being written
+
+        self.write_behind_seconds = write_behind_seconds
+        self.fsync_policy = fsync_policy
+
+        # The main dictionary for this persistence object
+        self.data = {}
+
+        # Guards `data` and write scheduling (shared with the write-behind thread)
+        self.lock = threading.RLock()
+        self.wakeup = threading.Condition(self.lock)
+        self.write_lock = threading.Lock()  # Serializes file writes
+        self.write_deadline = None          # Time by which pending changes are written (write-behind mode)
+        self.batch_depth = 0                # Writes are deferred while inside batch()
+
+        # Create persistence folder if needed
+        os.makedirs(PERSISTENCE_FOLDER, exist_ok=True)
+
+        if backend is None:
+            backend = PERSISTENCE_BACKEND
+        if backend == "json":
+            self.backend = JsonBackend(id, fsync_policy)
+        elif backend == "sqlite":
+            self.backend = SqliteBackend(id, fsync_policy)
+        else:
+            raise Exception(f"Unknown persistence backend {backend}")
+        self.filepath = self.backend.filepath
+
+        # Load previous state if it exists
+        self.data = self.backend.load()
+
+        # Start write-behind thread
+        if self.write_behind_seconds > 0:
+            self.writer_thread = threading.Thread(target=self.writer_loop, name=f"persistence-{id}", daemon=True)
+            self.writer_thread.start()
+            atexit.register(self.flush)
+
+    # Write changes to disk now
     def persist(self):
-        with open(self.filepath, 'w') as fout:
-            fout.write(json.dumps(self.data))
-    
+        with self.write_lock:
+            with self.lock:
+                data = dict(self.data)
+                self.writing_keys = self.dirty_keys
+                self.dirty_keys = set()
+                self.is_dirty = False
+
+            try:
+                self.backend.write(data, self.writing_keys)
+            except Exception as e:
+                print(f"Failed to write persistence {self.filepath}: {e}")
+                with self.lock:
+                    self.dirty_keys |= self.writing_keys
+                    self.is_dirty = True
+            finally:
+                with self.lock:
+                    self.writing_keys = set()
+
+    # Write any pending changes to disk now
+    def flush(self):
+        with self.lock:
+            self.write_deadline = None
+            if not self.is_dirty:
+                return
+        self.persist()
+
+    # Background thread that writes pending changes once their debounce window expires
+    def writer_loop(self):
+        while True:
+            with self.lock:
+                while self.write_deadline is None or time.time() < self.write_deadline:
+                    if self.write_deadline is None:
+                        self.wakeup.wait()
+                    else:
+                        self.wakeup.wait(self.write_deadline - time.time())
+                self.write_deadline = None
+            self.persist()
+
+    # Write changes now, or schedule them for the write-behind thread
+    def request_persist(self):
+        if self.write_behind_seconds > 0:
+            with self.lock:
+                if self.write_deadline is None:
+                    self.write_deadline = time.time() + self.write_behind_seconds
+                    self.wakeup.notify()
+        else:
+            self.persist()
+
+    # Group several changes into a single write, eg.:
+    #   with persistence.batch():
+    #       persistence.set("a", 1)
+    #       persistence.set("b", 2)
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.batch_depth -= 1
+                should_persist = self.batch_depth == 0 and self.is_dirty
+            if should_persist:
+                self.request_persist()
+
+    # Pick up values written by other processes (eg., with the shared SQLite backend), keeping any
+    # newer values of our own that haven't been written yet
+    def reload(self):
+        stored_data = self.backend.load()
+        with self.lock:
+            for key_str, value in stored_data.items():
+                if key_str not in self.dirty_keys and key_str not in self.writing_keys:
+                    self.data[key_str] = value
+
     def get(self, key):
         key_str = str(key)
-        if key_str in self.data:
-            return self.data[key_str]
-        else:
-            return None
-    
+        with self.lock:
+            if key_str in self.data:
+                return self.data[key_str]
+            else:
+                return None
+
     def set(self, key, value):
         self.setWithoutPersist(key, value)
 
         # Persist to file if it has changed or is new
-        if self.is_dirty:
-            self.persist()
-            self.is_dirty = False
-    
+        with self.lock:
+            should_persist = self.is_dirty and self.batch_depth == 0
+        if should_persist:
+            self.request_persist()
+
     # Use this method if updating a lot of fields at once, then call persist afterwards
     def setWithoutPersist(self, key, value):
         key_str = str(key)
 
-        if key_str in self.data:
-            prev_value = self.data[key_str]
-        else:
-            prev_value = None
+        with self.lock:
+            if key_str in self.data:
+                prev_value = self.data[key_str]
+            else:
+                prev_value = None
 
-        self.data[key_str] = value
+            self.data[key_str] = value
 
-        if prev_value != value:
-            self.is_dirty = True
+            if prev_value != value:
+                self.dirty_keys.add(key_str)
+                self.is_dirty = True
 
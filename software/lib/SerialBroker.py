@@ -0,0 +1,301 @@
+"""
+Serial broker
+
+Lets several local tools (kibbie, plot_current.py, serial_demo/serial_monitor.py, ...) share the
+monitor's current samples without fighting over /dev/ttyACM0. The one process that owns the port
+(kibbie, or serial_broker.py when kibbie is not running) runs a SerialBroker, which publishes the
+samples read by its KibbieSerial to any number of subscribers on a Unix socket.
+
+Subscribers pick a mode when they connect:
+ - "stream": every sample, in order, in batches. Each message carries the sample number of its first
+   sample, so a subscriber that falls behind sees (and counts) the gap instead of stalling the broker.
+ - "latest": only the newest sample of each publish period (eg., a live current readout).
+
+The broker never waits on a subscriber: sends are non-blocking, and a message that doesn't fit in a
+slow subscriber's socket buffer is dropped for that subscriber only.
+
+SerialBrokerClient reads from the broker on a background thread into the same ring buffer as
+KibbieSerial (see CurrentSampleBuffer), so tools can use either one interchangeably.
+
+Messages (SOCK_SEQPACKET, so message boundaries are kept):
+    header: uint64 first sample number, uint32 number of samples, uint32 number of channels
+    samples: float64 receive time, int64 monitor time (ms), float64 current of each channel
+
+"""
+
+import os
+import select
+import selectors
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from .KibbieSerial import CurrentSampleBuffer
+
+BROKER_SOCKET_PATH = "/tmp/kibbie-serial.sock"
+
+# Subscriber modes
+MODES = ["stream", "latest"]
+
+HEADER_FORMAT = "<QII"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+# Largest message sent by the broker (stream batches are split to fit)
+MAX_MESSAGE_SIZE = 1 << 16
+
+
+# Sample layout within a message
+def sample_dtype(num_channels):
+    return np.dtype([("time", "<f8"), ("monitor_time_ms", "<i8"), ("current", "<f8", (num_channels,))])
+
+
+def encode_message(first_sample_number, times, monitor_times_ms, currents):
+    samples = np.empty(len(times), dtype=sample_dtype(currents.shape[1]))
+    samples["time"] = times
+    samples["monitor_time_ms"] = monitor_times_ms
+    samples["current"] = currents
+    return struct.pack(HEADER_FORMAT, first_sample_number, len(samples), currents.shape[1]) + samples.tobytes()
+
+
+# Returns (first sample number, samples) where samples is a structured array (see sample_dtype)
+def decode_message(message):
+    first_sample_number, num_samples, num_channels = struct.unpack_from(HEADER_FORMAT, message)
+    samples = np.frombuffer(message, dtype=sample_dtype(num_channels), count=num_samples, offset=HEADER_SIZE)
+    return first_sample_number, samples
+
+
+# True if a broker is accepting subscribers on socket_path
+def is_broker_running(socket_path=BROKER_SOCKET_PATH):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET) as sock:
+        try:
+            sock.connect(socket_path)
+            return True
+        except OSError:
+            return False
+
+
+class SerialBroker:
+    # How often new samples are published
+    PUBLISH_PERIOD_S = 0.02
+
+    # kb_serial: KibbieSerial owning the port
+    def __init__(self, kb_serial, socket_path=BROKER_SOCKET_PATH):
+        self.kb_serial = kb_serial
+        self.socket_path = socket_path
+
+        if is_broker_running(socket_path):
+            raise Exception(f"A serial broker is already running on {socket_path}")
+        if os.path.exists(socket_path):
+            # Left behind by a broker that didn't shut down cleanly
+            os.unlink(socket_path)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.server.bind(socket_path)
+        self.server.listen()
+        self.server.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.server, selectors.EVENT_READ)
+        self.subscribers = {}   # Socket -> mode (None until the subscriber says which mode it wants)
+
+        # Only publish samples received from now on
+        _, _, _, self.next_sample_number = kb_serial.snapshot()
+
+        # Statistics
+        self.num_dropped_messages = 0   # Messages not sent because a subscriber's buffer was full
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="kibbie-serial-broker", daemon=True)
+        self.thread.start()
+
+    # Stop publishing and disconnect all subscribers
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+
+        for sock in list(self.subscribers):
+            self.remove_subscriber(sock)
+        self.selector.close()
+        self.server.close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            for key, _ in self.selector.select(timeout=SerialBroker.PUBLISH_PERIOD_S):
+                if key.fileobj is self.server:
+                    self.accept_subscriber()
+                else:
+                    self.receive_mode(key.fileobj)
+            self.publish()
+
+    def accept_subscriber(self):
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ)
+        self.subscribers[sock] = None
+
+    # A subscriber's only message is its mode. Anything else (including disconnecting) removes it.
+    def receive_mode(self, sock):
+        try:
+            mode = sock.recv(64).decode(errors="replace")
+        except OSError:
+            mode = ""
+        if mode in MODES and self.subscribers[sock] is None:
+            self.subscribers[sock] = mode
+        else:
+            self.remove_subscriber(sock)
+
+    def remove_subscriber(self, sock):
+        self.selector.unregister(sock)
+        del self.subscribers[sock]
+        sock.close()
+
+    def publish(self):
+        times, monitor_times_ms, currents, num_samples = self.kb_serial.snapshot(since=self.next_sample_number)
+        self.next_sample_number = num_samples
+        if len(times) == 0 or all(mode is None for mode in self.subscribers.values()):
+            return
+
+        # Encoded once and shared by every subscriber of the same mode
+        first_sample_number = num_samples - len(times)
+        samples_per_message = (MAX_MESSAGE_SIZE - HEADER_SIZE) // sample_dtype(currents.shape[1]).itemsize
+        messages = {
+            "stream": [encode_message(first_sample_number + i, times[i:i + samples_per_message], monitor_times_ms[i:i + samples_per_message], currents[i:i + samples_per_message])
+                       for i in range(0, len(times), samples_per_message)],
+            "latest": [encode_message(num_samples - 1, times[-1:], monitor_times_ms[-1:], currents[-1:])],
+        }
+
+        for sock, mode in list(self.subscribers.items()):
+            if mode is None:
+                continue
+            for message in messages[mode]:
+                try:
+                    sock.send(message)
+                except BlockingIOError:
+                    self.num_dropped_messages += 1
+                except OSError:
+                    self.remove_subscriber(sock)
+                    break
+
+
+# Subscriber to a SerialBroker, read like a KibbieSerial
+class SerialBrokerClient(CurrentSampleBuffer):
+    # How long the reader thread waits for data before checking if it should stop
+    READ_TIMEOUT_S = 0.1
+
+    # How long to wait between attempts to (re)connect to the broker
+    RECONNECT_PERIOD_S = 1.0
+
+    # mode: "stream" for every sample, or "latest" for only the newest sample
+    def __init__(self, mode="stream", socket_path=BROKER_SOCKET_PATH):
+        if mode not in MODES:
+            raise Exception(f"Unknown serial broker mode {mode}")
+        self.mode = mode
+        self.socket_path = socket_path
+        self.sock = None
+
+        super().__init__()
+
+        # Broker sample number expected next (None until the first message after connecting)
+        self.next_broker_sample_number = None
+        self.num_dropped_samples = 0    # Samples missed because this client fell behind (stream mode)
+
+        # Start reader thread
+        self.is_connected = False
+        self.reported_connect_error = False
+        self.stop_event = threading.Event()
+        self.reader_thread = threading.Thread(target=self.reader_loop, name="kibbie-serial-client", daemon=True)
+        self.reader_thread.start()
+
+    # Stop the reader thread and disconnect
+    def close(self):
+        self.stop_event.set()
+        self.reader_thread.join()
+
+
+    #############################################################
+    # Reader thread
+    #############################################################
+
+    def reader_loop(self):
+        while not self.stop_event.is_set():
+            if self.sock is None and not self.connect():
+                self.stop_event.wait(SerialBrokerClient.RECONNECT_PERIOD_S)
+                continue
+
+            try:
+                messages, is_closed = self.receive()
+            except OSError as e:
+                print(f"*** Lost serial broker {self.socket_path}: {e}")
+                self.disconnect()
+                continue
+
+            # Only the newest message matters in latest mode
+            if self.mode == "latest":
+                messages = messages[-1:]
+            for message in messages:
+                self.process_message(message)
+
+            if is_closed:
+                print(f"*** Serial broker {self.socket_path} closed")
+                self.disconnect()
+
+        self.disconnect()
+
+    # Try to connect to the broker. Returns True on success
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            sock.connect(self.socket_path)
+            sock.send(self.mode.encode())
+        except OSError as e:
+            sock.close()
+            # Only report the first failure of each outage
+            if not self.reported_connect_error:
+                print(f"*** Failed to connect to serial broker {self.socket_path}: {e}. Retrying every {SerialBrokerClient.RECONNECT_PERIOD_S} s")
+                self.reported_connect_error = True
+            return False
+
+        self.sock = sock
+        self.is_connected = True
+        self.reported_connect_error = False
+        print(f"Connected to serial broker {self.socket_path} ({self.mode})")
+        return True
+
+    def disconnect(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.is_connected = False
+        self.next_broker_sample_number = None
+
+    # Wait up to READ_TIMEOUT_S for a message, then take every message already waiting
+    # Returns (messages, True if the broker closed the connection)
+    def receive(self):
+        messages = []
+        if not select.select([self.sock], [], [], SerialBrokerClient.READ_TIMEOUT_S)[0]:
+            return messages, False
+
+        while True:
+            try:
+                message = self.sock.recv(MAX_MESSAGE_SIZE, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return messages, False
+            if not message:
+                return messages, True
+            messages.append(message)
+
+    def process_message(self, message):
+        first_sample_number, samples = decode_message(message)
+
+        if self.mode == "stream" and self.next_broker_sample_number is not None and first_sample_number > self.next_broker_sample_number:
+            self.num_dropped_samples += first_sample_number - self.next_broker_sample_number
+        self.next_broker_sample_number = first_sample_number + len(samples)
+
+        self.add_samples(samples["time"], samples["monitor_time_ms"], samples["current"])
@@ -0,0 +1,153 @@
+"""
+Servo command protocol
+
+Typed, versioned, fixed-size binary command format for Kibbie -> Servo process commands.
+Commands are sent as raw bytes over a `multiprocessing.Pipe` (no pickling, feeder thread or lock).
+
+Frame layout (little-endian, COMMAND_FORMAT, COMMAND_SIZE bytes):
+
+    uint8   version         PROTOCOL_VERSION
+    uint8   opcode          ServoOpcode
+    uint16  reserved
+    uint32  command_id      Used to match completion acknowledgements
+    int8    channel         Servo channel (NO_CHANNEL if unused)
+    int8    latch_channel   Door latch servo channel (NO_CHANNEL if unused)
+    uint16  reserved
+    float32 target_angle
+    float32 latch_angle_unlocked
+    float32 latch_angle_locked
+    float32 offset_seconds
+
+"""
+
+from enum import IntEnum
+import math
+import struct
+
+PROTOCOL_VERSION = 1
+
+COMMAND_FORMAT = "<BBHIbbHffff"
+COMMAND_SIZE = struct.calcsize(COMMAND_FORMAT)
+
+# Channel value for fields a command does not use
+NO_CHANNEL = -1
+
+# Limits used for validation
+MAX_CHANNELS = 16
+MIN_ANGLE = 0
+MAX_ANGLE = 180
+MAX_OFFSET_SECONDS = 60
+
+
+class ServoProtocolError(Exception):
+    pass
+
+
+class ServoOpcode(IntEnum):
+    EXIT = 1
+    QUEUE_ANGLE_STEPPED = 2
+    DISPENSE_FOOD = 3
+    PRINT_STATUS = 4
+    CANCEL_MOTION = 5
+
+
+# Fields each opcode requires (anything else must be left at its default)
+OPCODE_USES_CHANNEL = {
+    ServoOpcode.EXIT: False,
+    ServoOpcode.QUEUE_ANGLE_STEPPED: True,
+    ServoOpcode.DISPENSE_FOOD: True,
+    ServoOpcode.PRINT_STATUS: False,
+    ServoOpcode.CANCEL_MOTION: True,
+}
+OPCODE_USES_LATCH = {
+    ServoOpcode.EXIT: False,
+    ServoOpcode.QUEUE_ANGLE_STEPPED: True,
+    ServoOpcode.DISPENSE_FOOD: False,
+    ServoOpcode.PRINT_STATUS: False,
+    ServoOpcode.CANCEL_MOTION: False,
+}
+
+
+class ServoCommand:
+    def __init__(self, opcode, command_id, channel=NO_CHANNEL, target_angle=0.0, latch_channel=NO_CHANNEL, latch_angle_unlocked=0.0, latch_angle_locked=0.0, offset_seconds=0.0):
+        self.opcode = opcode
+        self.command_id = command_id
+        self.channel = channel
+        self.target_angle = target_angle
+        self.latch_channel = latch_channel
+        self.latch_angle_unlocked = latch_angle_unlocked
+        self.latch_angle_locked = latch_angle_locked
+        self.offset_seconds = offset_seconds
+
+    def __str__(self):
+        if self.opcode == ServoOpcode.QUEUE_ANGLE_STEPPED:
+            return f"{self.opcode.name}(id={self.command_id}, ch={self.channel}, angle={self.target_angle}, latch={self.latch_channel}, offset={self.offset_seconds})"
+        if self.opcode in [ServoOpcode.DISPENSE_FOOD, ServoOpcode.CANCEL_MOTION]:
+            return f"{self.opcode.name}(id={self.command_id}, ch={self.channel})"
+        return f"{self.opcode.name}(id={self.command_id})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+    # Raise ServoProtocolError if any field is out of range for the opcode
+    def validate(self):
+        try:
+            self.opcode = ServoOpcode(self.opcode)
+        except ValueError:
+            raise ServoProtocolError(f"Unknown opcode {self.opcode}")
+
+        if not (0 <= self.command_id <= 0xFFFFFFFF):
+            raise ServoProtocolError(f"Command ID {self.command_id} out of range")
+
+        if OPCODE_USES_CHANNEL[self.opcode]:
+            validate_channel("channel", self.channel)
+        if OPCODE_USES_LATCH[self.opcode]:
+            validate_channel("latch_channel", self.latch_channel)
+            validate_angle("target_angle", self.target_angle)
+            validate_angle("latch_angle_unlocked", self.latch_angle_unlocked)
+            validate_angle("latch_angle_locked", self.latch_angle_locked)
+            if not (0 <= self.offset_seconds <= MAX_OFFSET_SECONDS):
+                raise ServoProtocolError(f"offset_seconds {self.offset_seconds} out of range")
+
+
+    def encode(self):
+        self.validate()
+        return struct.pack(
+            COMMAND_FORMAT,
+            PROTOCOL_VERSION,
+            self.opcode,
+            0,
+            self.command_id,
+            self.channel,
+            self.latch_channel,
+            0,
+            self.target_angle,
+            self.latch_angle_unlocked,
+            self.latch_angle_locked,
+            self.offset_seconds,
+        )
+
+
+    @staticmethod
+    def decode(data):
+        if len(data) != COMMAND_SIZE:
+            raise ServoProtocolError(f"Expected {COMMAND_SIZE} byte command, got {len(data)} bytes")
+
+        version, opcode, _, command_id, channel, latch_channel, _, target_angle, latch_angle_unlocked, latch_angle_locked, offset_seconds = struct.unpack(COMMAND_FORMAT, data)
+        if version != PROTOCOL_VERSION:
+            raise ServoProtocolError(f"Unsupported protocol version {version} (expected {PROTOCOL_VERSION})")
+
+        command = ServoCommand(opcode, command_id, channel, target_angle, latch_channel, latch_angle_unlocked, latch_angle_locked, offset_seconds)
+        command.validate()
+        return command
+
+
+def validate_channel(name, channel):
+    if not (0 <= channel < MAX_CHANNELS):
+        raise ServoProtocolError(f"{name} {channel} out of range")
+
+
+def validate_angle(name, angle):
+    if math.isnan(angle) or not (MIN_ANGLE <= angle <= MAX_ANGLE):
+        raise ServoProtocolError(f"{name} {angle} out of range")
@@ -0,0 +1,172 @@
+"""
+Servo state board
+
+Small fixed-layout shared-memory block that the servo process publishes its state into.
+Any process (kibbie's main loop, the HUD, a status endpoint) can read the latest servo
+state at any time without sending a command to the servo process and waiting for a reply.
+
+Layout (little-endian, see BOARD_HEADER_FORMAT and BOARD_CHANNEL_FORMAT):
+
+    Header:
+        uint32  sequence        Incremented before and after every write (odd while writing)
+        uint32  version         Layout version (BOARD_VERSION)
+        uint32  num_channels    Number of channel records that follow
+        uint32  reserved
+        float64 init_time       time.time() when the servo process started (for uptime)
+        float64 last_update     time.time() of the most recent write
+    Per channel:
+        float32 current_angle   Last angle commanded to the servo
+        float32 target_angle    Final angle the channel is moving towards
+        uint16  queue_depth     Number of movements still queued
+        uint16  reserved
+        uint32  dispense_count  Total number of dispenses on this channel
+        float64 last_update     time.time() of the last movement on this channel
+
+The main process creates the board and passes its name to the servo process, which attaches
+as the writer. Readers use the sequence number to retry if they raced with a write.
+
+"""
+
+import struct
+import time
+from multiprocessing import shared_memory
+
+BOARD_VERSION = 1
+
+BOARD_HEADER_FORMAT = "<IIIIdd"
+BOARD_CHANNEL_FORMAT = "<ffHHId"
+
+BOARD_HEADER_SIZE = struct.calcsize(BOARD_HEADER_FORMAT)
+BOARD_CHANNEL_SIZE = struct.calcsize(BOARD_CHANNEL_FORMAT)
+
+# Maximum number of times a reader retries when it races with the writer
+MAX_READ_ATTEMPTS = 10
+
+# Sleep between read attempts, growing by this much per attempt (the first retry only yields, with sleep(0))
+READ_RETRY_SLEEP_S = 0.0001
+
+# Snapshot of a single servo channel
+class ServoChannelState:
+    def __init__(self, current_angle, target_angle, queue_depth, dispense_count, last_update):
+        self.current_angle = current_angle
+        self.target_angle = target_angle
+        self.queue_depth = queue_depth
+        self.dispense_count = dispense_count
+        self.last_update = last_update
+
+    def __str__(self):
+        return f"(angle={self.current_angle:.1f}, target={self.target_angle:.1f}, queued={self.queue_depth}, dispenses={self.dispense_count})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+# Snapshot of the whole board
+class ServoState:
+    def __init__(self, init_time, last_update, channels):
+        self.init_time = init_time
+        self.last_update = last_update
+        self.channels = channels
+
+    # Seconds since the servo process started
+    def uptime(self):
+        if self.init_time == 0:
+            return 0
+        return time.time() - self.init_time
+
+    # Seconds since the servo process last published its state
+    def age(self):
+        if self.last_update == 0:
+            return float("inf")
+        return time.time() - self.last_update
+
+
+class ServoStateBoard:
+    # name: name of an existing board to attach to, or None to create a new one
+    def __init__(self, num_channels, name=None):
+        self.num_channels = num_channels
+        self.size = BOARD_HEADER_SIZE + num_channels * BOARD_CHANNEL_SIZE
+
+        self.is_owner = name is None
+        if self.is_owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.size)
+            self.shm.buf[:self.size] = bytes(self.size)
+            struct.pack_into(BOARD_HEADER_FORMAT, self.shm.buf, 0, 0, BOARD_VERSION, num_channels, 0, 0.0, 0.0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            _, version, board_channels, _, _, _ = struct.unpack_from(BOARD_HEADER_FORMAT, self.shm.buf, 0)
+            if version != BOARD_VERSION or board_channels != num_channels:
+                raise Exception(f"Servo state board {name} has version {version} with {board_channels} channels, expected version {BOARD_VERSION} with {num_channels} channels")
+
+        self.name = self.shm.name
+
+        # Writer-side sequence number (only the servo process writes)
+        self.sequence = 0
+
+        # Pre-build the combined format so a write is a single pack_into call
+        self.board_format = BOARD_HEADER_FORMAT + BOARD_CHANNEL_FORMAT[1:] * num_channels
+
+
+    # Publish the full servo state
+    # Each argument is a list indexed by channel
+    def write(self, init_time, current_angles, target_angles, queue_depths, dispense_counts, channel_update_times):
+        buf = self.shm.buf
+
+        # Mark write in progress (odd sequence number)
+        self.sequence += 1
+        struct.pack_into("<I", buf, 0, self.sequence)
+
+        values = []
+        for channel in range(self.num_channels):
+            values += [
+                current_angles[channel],
+                target_angles[channel],
+                queue_depths[channel],
+                0,
+                dispense_counts[channel],
+                channel_update_times[channel],
+            ]
+        struct.pack_into(self.board_format, buf, 0, self.sequence, BOARD_VERSION, self.num_channels, 0, init_time, time.time(), *values)
+
+        # Mark write complete (even sequence number)
+        self.sequence += 1
+        struct.pack_into("<I", buf, 0, self.sequence)
+
+
+    # Read a consistent snapshot of the board
+    # Returns None if a consistent snapshot could not be read (writer busy)
+    def read(self):
+        buf = self.shm.buf
+        for attempt in range(MAX_READ_ATTEMPTS):
+            # Let a preempted writer finish before retrying
+            if attempt > 0:
+                time.sleep(READ_RETRY_SLEEP_S * (attempt - 1))
+
+            sequence_before = struct.unpack_from("<I", buf, 0)[0]
+            if sequence_before % 2 == 1:
+                continue
+
+            values = struct.unpack_from(self.board_format, buf, 0)
+
+            sequence_after = struct.unpack_from("<I", buf, 0)[0]
+            if sequence_before == sequence_after:
+                break
+        else:
+            return None
+
+        init_time = values[4]
+        last_update = values[5]
+        channels = []
+        fields_per_channel = 6
+        for channel in range(self.num_channels):
+            offset = 6 + channel * fields_per_channel
+            current_angle, target_angle, queue_depth, _, dispense_count, channel_update = values[offset:offset + fields_per_channel]
+            channels.append(ServoChannelState(current_angle, target_angle, queue_depth, dispense_count, channel_update))
+
+        return ServoState(init_time, last_update, channels)
+
+
+    def close(self):
+        self.shm.close()
+        if self.is_owner:
+            self.shm.unlink()
@@ -0,0 +1,107 @@
+"""
+Snapshot exporter
+
+Encodes and writes snapshot images on a small pool of worker threads, so exporting frames
+(door open/close, periodic snapshots while a door is open, manual `e` exports) never stalls the
+vision loop. OpenCV releases the GIL while encoding, so workers run in parallel with detection.
+
+Exports wait in a bounded queue. If the queue is full (eg., the SD card is slow), new exports are
+dropped and counted instead of blocking the caller.
+
+Supported formats (see SNAPSHOT_FORMAT, SNAPSHOT_QUALITY and SNAPSHOT_PNG_COMPRESSION in Parameters.py):
+ - "png": lossless, compression level 0-9 (higher is smaller and slower)
+ - "jpeg": quality 0-100
+ - "webp": quality 1-100
+
+"""
+
+import os
+import queue
+import threading
+
+import cv2
+
+from .Parameters import SNAPSHOT_FORMAT, SNAPSHOT_PNG_COMPRESSION, SNAPSHOT_QUALITY
+
+# Format -> (file extension, OpenCV quality or compression parameter)
+FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+NUM_WORKERS = 2
+MAX_QUEUED_EXPORTS = 16
+
+
+class SnapshotExporter:
+    # log: function to report failed writes (called from worker threads)
+    # on_export: optional function called with the filepath of each written image (from worker threads)
+    # quality: jpeg and webp quality. png_compression: png compression level
+    def __init__(self, image_format=SNAPSHOT_FORMAT, quality=SNAPSHOT_QUALITY, png_compression=SNAPSHOT_PNG_COMPRESSION, num_workers=NUM_WORKERS, max_queued=MAX_QUEUED_EXPORTS, log=print, on_export=None):
+        if image_format not in FORMATS:
+            raise Exception(f"Unknown snapshot format {image_format}")
+        self.extension, quality_parameter = FORMATS[image_format]
+        self.encode_parameters = [quality_parameter, png_compression if image_format == "png" else quality]
+        self.log = log
+        self.on_export = on_export
+
+        # (filepath, image) exports waiting for a worker, or None to stop a worker
+        self.queue = queue.Queue(maxsize=max_queued)
+
+        # Statistics
+        self.num_exported = 0
+        self.num_dropped = 0
+        self.stats_lock = threading.Lock()
+
+        self.workers = [threading.Thread(target=self.run, name=f"kibbie-snapshot-{i}", daemon=True) for i in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    # Queue an image to be written to `path` + the format's extension (never blocks)
+    # The image is copied, so the caller can keep drawing on it
+    # Returns the filepath that will be written, or None if the export was dropped
+    def export(self, path, image):
+        filepath = path + self.extension
+        try:
+            self.queue.put_nowait((filepath, image.copy()))
+        except queue.Full:
+            with self.stats_lock:
+                self.num_dropped += 1
+            return None
+        return filepath
+
+    # Write all queued exports and stop the workers
+    def close(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+    #############################################################
+    # Worker threads
+    #############################################################
+
+    def run(self):
+        while True:
+            export = self.queue.get()
+            if export is None:
+                return
+            filepath, image = export
+
+            try:
+                is_encoded, data = cv2.imencode(self.extension, image, self.encode_parameters)
+                if not is_encoded:
+                    raise Exception("encoding failed")
+                os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+                with open(filepath, "wb") as fout:
+                    fout.write(data)
+            except Exception as e:
+                self.log(f"*** Failed to export {filepath}: {e}")
+                continue
+
+            with self.stats_lock:
+                self.num_exported += 1
+            if self.on_export is not None:
+                self.on_export(filepath)
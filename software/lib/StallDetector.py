@@ -0,0 +1,89 @@
+"""
+Servo stall detector
+
+Streaming detector over the door current samples from KibbieSerial. A stalled or obstructed
+door servo draws a sustained high current (see data/20230212-noodle_door-open_current_profile-ANNOTATED.png:
+"Holding door open by hand" and "Both door and lock being stuck" sit around 1.3-1.5 A for seconds),
+while a normal door movement only spikes briefly.
+
+Each channel's current is smoothed with an exponential filter whose time constant is in seconds,
+so the detector behaves the same at the text protocol's 10 Hz and the binary protocol's 500 Hz.
+A stall is reported once the filtered current stays above STALL_CURRENT_A for STALL_DURATION_S,
+and re-armed once it falls below STALL_RELEASE_CURRENT_A.
+
+"""
+
+import math
+
+# Detection thresholds
+STALL_CURRENT_A = 1.2               # Filtered current considered a stall
+STALL_RELEASE_CURRENT_A = 0.6       # Filtered current at which a stall is considered over
+STALL_DURATION_S = 0.3              # How long the current must stay above STALL_CURRENT_A
+FILTER_TIME_CONSTANT_S = 0.15       # Exponential filter time constant
+
+# Gaps longer than this (eg., serial reconnect) restart the filter
+MAX_SAMPLE_GAP_S = 1.0
+
+
+# A detected stall
+class Stall:
+    def __init__(self, channel, start_time, detect_time, current):
+        self.channel = channel
+        self.start_time = start_time        # When the filtered current first went above the threshold
+        self.detect_time = detect_time      # Time of the sample that confirmed the stall
+        self.current = current              # Filtered current when detected (A)
+
+    def __str__(self):
+        return f"Stall(ch={self.channel}, start={self.start_time:.2f}, detected={self.detect_time:.2f}, {self.current:.2f} A)"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class StallDetector:
+    def __init__(self, num_channels, stall_current_a=STALL_CURRENT_A, release_current_a=STALL_RELEASE_CURRENT_A, stall_duration_s=STALL_DURATION_S, time_constant_s=FILTER_TIME_CONSTANT_S):
+        self.num_channels = num_channels
+        self.stall_current_a = stall_current_a
+        self.release_current_a = release_current_a
+        self.stall_duration_s = stall_duration_s
+        self.time_constant_s = time_constant_s
+
+        # Per-channel state
+        self.filtered = [0.0] * num_channels
+        self.over_threshold_since = [None] * num_channels  # Time the filtered current went over the threshold
+        self.is_stalled = [False] * num_channels           # A stall was reported and has not been released yet
+        self.last_time = None
+
+    # Process new samples: times (n,), currents (n, num_channels), in time order
+    # Returns a list of Stall for stalls detected in these samples
+    def update(self, times, currents):
+        stalls = []
+        for t, sample in zip(times.tolist(), currents.tolist()):
+            if self.last_time is None or t - self.last_time > MAX_SAMPLE_GAP_S:
+                self.filtered = list(sample)
+                alpha = 1.0
+            else:
+                alpha = 1.0 - math.exp(-(t - self.last_time) / self.time_constant_s)
+            self.last_time = t
+
+            for channel in range(self.num_channels):
+                filtered = self.filtered[channel] + alpha * (sample[channel] - self.filtered[channel])
+                self.filtered[channel] = filtered
+
+                if self.is_stalled[channel]:
+                    if filtered < self.release_current_a:
+                        self.is_stalled[channel] = False
+                        self.over_threshold_since[channel] = None
+                    continue
+
+                if filtered < self.stall_current_a:
+                    self.over_threshold_since[channel] = None
+                    continue
+
+                if self.over_threshold_since[channel] is None:
+                    self.over_threshold_since[channel] = t
+                if t - self.over_threshold_since[channel] >= self.stall_duration_s:
+                    self.is_stalled[channel] = True
+                    stalls.append(Stall(channel, self.over_threshold_since[channel], t, filtered))
+
+        return stalls
@@ -0,0 +1,219 @@
+"""
+Storage manager
+
+Keeps snapshots (`snapshots/`) and event clips (`clips/`) from filling the SD card. Files are
+tracked per category, and a background thread deletes them:
+ - once they are older than their category's retention (see DEFAULT_RETENTION), and
+ - oldest first, from the least valuable category first, while the total is over STORAGE_BUDGET_BYTES
+ - oldest first, from periodic snapshots and then clips only, while the disk has less than
+   STORAGE_MIN_FREE_BYTES free (so persistence and logging keep working). Other writers (eg., DVR
+   recordings) aren't counted, so free space alone never deletes transition or manual snapshots.
+
+Usage is tracked incrementally: the folders are walked once at startup, and after that producers
+report each file they write with `add` (eg., as SnapshotExporter's `on_export` callback).
+
+Categories are taken from the file name (see `classify`):
+ - transition: door opening/closing snapshots
+ - periodic: snapshots taken every few seconds while a door is open
+ - clip: event clips
+ - manual: everything else (eg., `e` exports and current plots)
+
+"""
+
+import collections
+import os
+import queue
+import shutil
+import threading
+import time
+
+from .Parameters import STORAGE_BUDGET_BYTES, STORAGE_MIN_FREE_BYTES
+
+CATEGORY_TRANSITION = "transition"
+CATEGORY_PERIODIC = "periodic"
+CATEGORY_CLIP = "clip"
+CATEGORY_MANUAL = "manual"
+
+# (category, days to keep or None to keep until space is needed), in the order categories are
+# evicted from when over budget
+DEFAULT_RETENTION = [
+    (CATEGORY_PERIODIC, 7),
+    (CATEGORY_CLIP, 30),
+    (CATEGORY_TRANSITION, 365),
+    (CATEGORY_MANUAL, None),
+]
+
+# Categories evicted from (in this order) while the disk is low on free space
+FREE_SPACE_CATEGORIES = [CATEGORY_PERIODIC, CATEGORY_CLIP]
+
+DEFAULT_FOLDERS = ["snapshots", "clips"]
+
+# Only these files are managed (eg., clips/index.jsonl is left alone)
+MANAGED_EXTENSIONS = [".png", ".jpg", ".webp", ".avi"]
+
+# How often retention is checked when no files are being added
+CHECK_PERIOD_S = 60.0
+
+SECONDS_PER_DAY = 60 * 60 * 24
+
+
+# Category of a snapshot or clip from its file name
+def classify(filepath):
+    name = os.path.basename(filepath)
+    if name.endswith(".avi"):
+        return CATEGORY_CLIP
+    if "-opening-" in name or "-closing-" in name:
+        return CATEGORY_TRANSITION
+    if "-open-" in name:
+        return CATEGORY_PERIODIC
+    return CATEGORY_MANUAL
+
+
+class StorageManager:
+    # log: function to report evictions (called from the manager thread)
+    def __init__(self, folders=DEFAULT_FOLDERS, budget_bytes=STORAGE_BUDGET_BYTES, min_free_bytes=STORAGE_MIN_FREE_BYTES, retention=DEFAULT_RETENTION, log=print):
+        self.folders = folders
+        self.budget_bytes = budget_bytes
+        self.min_free_bytes = min_free_bytes
+        self.retention = retention
+        self.log = log
+
+        # Added files waiting to be tracked, or None to stop
+        self.queue = queue.SimpleQueue()
+
+        # Per category: (time, path, size) oldest first, and total size
+        # Only modified by the manager thread. Read `usage` for totals.
+        self.files = {category: collections.deque() for category, _ in retention}
+        self.category_bytes = {category: 0 for category, _ in retention}
+        self.entries = {}   # Path -> (category, entry in self.files), to handle files being rewritten
+
+        # Statistics
+        self.num_evicted = 0
+
+        self.thread = threading.Thread(target=self.run, name="kibbie-storage", daemon=True)
+        self.thread.start()
+
+    # Track a newly written file (never blocks)
+    # category: one of the CATEGORY_* values, or None to classify by file name
+    def add(self, filepath, category=None):
+        self.queue.put((filepath, category))
+
+    # Bytes used per category
+    def usage(self):
+        return dict(self.category_bytes)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+    #############################################################
+    # Manager thread
+    #############################################################
+
+    def run(self):
+        self.scan()
+        while True:
+            items = []
+            try:
+                items.append(self.queue.get(timeout=CHECK_PERIOD_S))
+                while True:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            for item in items:
+                if item is None:
+                    return
+                self.track(*item)
+            self.enforce()
+
+    # Walk the folders once to find files written before this run
+    def scan(self):
+        found = []
+        for folder in self.folders:
+            for dirpath, _, filenames in os.walk(folder):
+                for filename in filenames:
+                    filepath = os.path.join(dirpath, filename)
+                    try:
+                        found.append((os.path.getmtime(filepath), filepath))
+                    except OSError:
+                        pass
+        for _, filepath in sorted(found):
+            self.track(filepath, None)
+
+    def track(self, filepath, category):
+        if os.path.splitext(filepath)[1] not in MANAGED_EXTENSIONS:
+            return
+        if category is None:
+            category = classify(filepath)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return
+
+        # Rewritten file (eg., snapshots/current.png), replace its previous entry
+        if filepath in self.entries:
+            previous_category, previous_entry = self.entries.pop(filepath)
+            self.files[previous_category].remove(previous_entry)
+            self.category_bytes[previous_category] -= previous_entry[2]
+
+        entry = (stat.st_mtime, filepath, stat.st_size)
+        self.files[category].append(entry)
+        self.category_bytes[category] += stat.st_size
+        self.entries[filepath] = (category, entry)
+
+    def enforce(self):
+        # Retention
+        now = time.time()
+        for category, days in self.retention:
+            if days is None:
+                continue
+            files = self.files[category]
+            while len(files) > 0 and files[0][0] < now - days * SECONDS_PER_DAY:
+                self.evict(category, "expired")
+
+        # Budget, least valuable categories first
+        for category, _ in self.retention:
+            while len(self.files[category]) > 0 and self.is_over_budget():
+                self.evict(category, "over budget")
+
+        # Free space, only from the categories that are cheap to lose
+        for category in FREE_SPACE_CATEGORIES:
+            if category not in self.files:
+                continue
+            while len(self.files[category]) > 0 and self.is_low_on_space():
+                self.evict(category, "low on disk space")
+
+    def is_over_budget(self):
+        return sum(self.category_bytes.values()) > self.budget_bytes
+
+    def is_low_on_space(self):
+        try:
+            return shutil.disk_usage(self.folders[0] if os.path.isdir(self.folders[0]) else ".").free < self.min_free_bytes
+        except OSError:
+            return False
+
+    # Delete the oldest file of a category
+    def evict(self, category, reason):
+        _, filepath, size = self.files[category].popleft()
+        self.category_bytes[category] -= size
+        del self.entries[filepath]
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.log(f"*** Failed to delete {filepath}: {e}")
+            return
+        self.num_evicted += 1
+        if self.num_evicted % 100 == 1:
+            self.log(f"Deleted {category} snapshot {filepath} ({reason}, {self.num_evicted} deleted so far)")
+
+        # Remove emptied date and export folders
+        folder = os.path.normpath(os.path.dirname(filepath))
+        if folder not in [os.path.normpath(root) for root in self.folders]:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass
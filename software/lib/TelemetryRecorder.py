@@ -0,0 +1,218 @@
+"""
+Telemetry recorder
+
+Records kibbie's per-frame detection internals (pixel counts before and after filtering, cat
+detections, door and dispenser state, current) as fixed-width records, so months of frames can be
+loaded in seconds for offline analysis (eg., tuning minPixelThreshold from real distributions).
+
+Records are numpy structured arrays (see `make_dtype`) appended to chunk files under `telemetry/`:
+
+    telemetry/telemetry-<YYYY-MM-DD_HH-MM-SS>.bin
+
+Each chunk starts with a HEADER_BYTES JSON header (padded with spaces) describing its records,
+followed by the raw records:
+
+    {"version": 1, "dtype": <numpy dtype descr>, "corrals": ["NOODLE_L", ...], "cats": ["Noodle", ...]}
+
+so a chunk can be memory-mapped with `open_chunk` and any column read as `records["filtered_pixels"]`.
+The record count is implied by the file size, so a partial record left by a crash is ignored.
+
+Recording is cheap for the vision loop: `record` fills a row of an in-memory batch, and full
+batches (or batches older than FLUSH_PERIOD_S) are written by a background thread.
+A new chunk is started every day and every time kibbie starts (so each chunk has a single
+configuration). Chunks older than TELEMETRY_RETENTION_DAYS are deleted when a new chunk starts
+(at 10 frames per second with 2 corrals and 2 cats, a day is about 60 MB).
+
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from .Parameters import TELEMETRY_RETENTION_DAYS
+
+TELEMETRY_FOLDER = "telemetry"
+CHUNK_PREFIX = "telemetry-"
+CHUNK_SUFFIX = ".bin"
+CHUNK_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+FORMAT_VERSION = 1
+HEADER_BYTES = 4096
+
+CHUNK_DURATION_S = 60 * 60 * 24     # Start a new chunk every day
+
+BATCH_RECORDS = 256     # Records buffered in memory before being handed to the writer
+FLUSH_PERIOD_S = 10.0   # ... or once the oldest buffered record is this old
+
+SECONDS_PER_DAY = 60 * 60 * 24
+
+
+# Record layout for a configuration
+def make_dtype(num_corrals, num_cats, num_channels):
+    return np.dtype([
+        ("time", "<f8"),                                        # Frame time (s since epoch)
+        ("frame_period", "<f4"),                                # Time since the previous frame (s)
+        ("raw_pixels", "<u4", (num_corrals, num_cats)),         # Pixels matching each cat in each corral
+        ("filtered_pixels", "<f4", (num_corrals, num_cats)),    # ... after the exponential filter
+        ("allowed_cat", "?", (num_corrals,)),                   # Allowed cat detected in corral
+        ("disallowed_cat", "?", (num_corrals,)),                # Disallowed cat detected in corral
+        ("door_open", "?", (num_corrals,)),                     # Door commanded open
+        ("dispenser_state", "u1", (num_corrals,)),              # DispenserState value
+        ("current", "<f4", (num_channels,)),                    # Mean current over the frame (A), NaN if no samples
+        ("current_max", "<f4", (num_channels,)),                # Max current over the frame (A), NaN if no samples
+    ])
+
+
+# Memory-map a chunk. Returns (header, records)
+def open_chunk(filepath):
+    with open(filepath, "rb") as fin:
+        header = json.loads(fin.read(HEADER_BYTES).decode())
+    dtype = np.lib.format.descr_to_dtype(header["dtype"])
+    num_records = (os.path.getsize(filepath) - HEADER_BYTES) // dtype.itemsize
+    if num_records <= 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(filepath, dtype=dtype, mode="r", offset=HEADER_BYTES, shape=(num_records,))
+
+
+# Chunk start time from its filepath
+def chunk_start_time(filepath):
+    name = os.path.basename(filepath)[len(CHUNK_PREFIX):-len(CHUNK_SUFFIX)]
+    return time.mktime(time.strptime(name, CHUNK_TIME_FORMAT))
+
+
+# Paths of all chunks in `folder`, oldest first
+def list_chunks(folder=TELEMETRY_FOLDER):
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder, name) for name in sorted(os.listdir(folder)) if name.startswith(CHUNK_PREFIX) and name.endswith(CHUNK_SUFFIX)]
+
+
+# Records with start_time <= time < end_time from every chunk, as a list of (header, records)
+# Records are memory-mapped views, so only the pages in range are read
+def load(start_time=0, end_time=float("inf"), folder=TELEMETRY_FOLDER):
+    chunks = []
+    for filepath in list_chunks(folder):
+        header, records = open_chunk(filepath)
+        if len(records) == 0:
+            continue
+        first, last = np.searchsorted(records["time"], [start_time, end_time])
+        if last > first:
+            chunks.append((header, records[first:last]))
+    return chunks
+
+
+class TelemetryRecorder:
+    # corral_names, cat_names: configuration, stored in each chunk header to label the record axes
+    def __init__(self, corral_names, cat_names, num_channels, folder=TELEMETRY_FOLDER, log=print):
+        self.folder = folder
+        self.log = log
+        self.header = {
+            "version": FORMAT_VERSION,
+            "corrals": list(corral_names),
+            "cats": list(cat_names),
+        }
+        self.dtype = make_dtype(len(corral_names), len(cat_names), num_channels)
+        self.header["dtype"] = np.lib.format.dtype_to_descr(self.dtype)
+        os.makedirs(self.folder, exist_ok=True)
+
+        # Batch being filled by `record`
+        self.batch = np.zeros(BATCH_RECORDS, dtype=self.dtype)
+        self.batch_count = 0
+        self.last_time = None
+
+        # Full batches to write, or None to stop
+        self.batch_queue = queue.SimpleQueue()
+
+        # Active chunk (only touched by the writer thread)
+        self.chunk_file = None
+        self.chunk_start_time = 0
+
+        self.writer_thread = threading.Thread(target=self.run, name="kibbie-telemetry", daemon=True)
+        self.writer_thread.start()
+
+    # Record one frame. Array arguments are indexed [corral][cat] or [corral] (see make_dtype)
+    # currents: (n, num_channels) current samples received during the frame (may be empty)
+    def record(self, raw_pixels, filtered_pixels, allowed_cat, disallowed_cat, door_open, dispenser_state, currents, t=None):
+        if t is None:
+            t = time.time()
+
+        row = self.batch[self.batch_count]
+        row["time"] = t
+        row["frame_period"] = 0 if self.last_time is None else t - self.last_time
+        row["raw_pixels"] = raw_pixels
+        row["filtered_pixels"] = filtered_pixels
+        row["allowed_cat"] = allowed_cat
+        row["disallowed_cat"] = disallowed_cat
+        row["door_open"] = door_open
+        row["dispenser_state"] = dispenser_state
+        if len(currents) > 0:
+            row["current"] = np.mean(currents, axis=0)
+            row["current_max"] = np.max(currents, axis=0)
+        else:
+            row["current"] = np.nan
+            row["current_max"] = np.nan
+        self.batch_count += 1
+        self.last_time = t
+
+        if self.batch_count == BATCH_RECORDS or t >= self.batch["time"][0] + FLUSH_PERIOD_S:
+            self.hand_off_batch()
+
+    # Write buffered records and stop
+    def close(self):
+        self.hand_off_batch()
+        self.batch_queue.put(None)
+        self.writer_thread.join()
+
+    def hand_off_batch(self):
+        if self.batch_count == 0:
+            return
+        self.batch_queue.put(self.batch[:self.batch_count])
+        self.batch = np.zeros(BATCH_RECORDS, dtype=self.dtype)
+        self.batch_count = 0
+
+
+    #############################################################
+    # Writer thread
+    #############################################################
+
+    def run(self):
+        while True:
+            records = self.batch_queue.get()
+            if records is None:
+                break
+            try:
+                if self.chunk_file is None or records["time"][0] >= self.chunk_start_time + CHUNK_DURATION_S:
+                    self.start_chunk(records["time"][0])
+                self.chunk_file.write(records.tobytes())
+                self.chunk_file.flush()
+            except OSError as e:
+                self.log(f"*** Failed to write telemetry: {e}")
+
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+            self.chunk_file = None
+
+    def start_chunk(self, t):
+        if self.chunk_file is not None:
+            self.chunk_file.close()
+
+        # Chunk start times must be unique and increasing, since they are used to order chunks
+        start_time = max(int(t), int(self.chunk_start_time) + 1)
+        filename = CHUNK_PREFIX + time.strftime(CHUNK_TIME_FORMAT, time.localtime(start_time)) + CHUNK_SUFFIX
+        header = json.dumps(dict(self.header, start_time=start_time)).encode()
+        if len(header) > HEADER_BYTES:
+            raise OSError(f"telemetry header too large ({len(header)} bytes)")
+
+        self.chunk_file = open(os.path.join(self.folder, filename), "wb")
+        self.chunk_file.write(header.ljust(HEADER_BYTES))
+        self.chunk_start_time = start_time
+
+        # Retention
+        for filepath in list_chunks(self.folder):
+            if chunk_start_time(filepath) < start_time - TELEMETRY_RETENTION_DAYS * SECONDS_PER_DAY:
+                os.remove(filepath)
+                self.log(f"Deleted old telemetry {filepath}")
@@ -0,0 +1,145 @@
+"""
+Thumbnail cache
+
+Small JPEG thumbnails of snapshots and clips (first frame), so a day of feedings can be browsed
+from a phone without downloading every full-size image.
+
+Thumbnails are generated lazily when first requested (on a small worker pool, see `submit`), or
+eagerly right after a snapshot or clip is written (`get` from the writer's thread). They are stored
+under `thumbnails/`, keyed by the source's path, mtime and size, so a rewritten file (eg.,
+snapshots/current.png) gets a fresh thumbnail and stale ones are never served.
+
+The cache is bounded by THUMBNAIL_CACHE_MAX_BYTES: least recently used thumbnails are deleted
+first (thumbnails of deleted snapshots simply age out).
+
+"""
+
+import collections
+import concurrent.futures
+import hashlib
+import os
+import threading
+
+import cv2
+
+from .Parameters import THUMBNAIL_CACHE_MAX_BYTES
+
+THUMBNAIL_FOLDER = "thumbnails"
+THUMBNAIL_WIDTH = 240           # px (height keeps the aspect ratio)
+THUMBNAIL_JPEG_QUALITY = 60
+NUM_WORKERS = 2
+
+# Files thumbnails can be made of
+IMAGE_EXTENSIONS = [".png", ".jpg", ".jpeg", ".webp"]
+VIDEO_EXTENSIONS = [".avi"]
+
+
+# True if `filepath` is something a thumbnail can be made of
+def is_thumbnailable(filepath):
+    return os.path.splitext(filepath)[1].lower() in IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
+
+
+class ThumbnailCache:
+    def __init__(self, folder=THUMBNAIL_FOLDER, max_bytes=THUMBNAIL_CACHE_MAX_BYTES, log=print):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.log = log
+
+        # Guards the index below (thumbnails are made from several threads)
+        self.lock = threading.Lock()
+
+        # Thumbnail filepath -> size, least recently used first
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.scan()
+
+        # Statistics
+        self.num_generated = 0
+        self.num_hits = 0
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=NUM_WORKERS, thread_name_prefix="kibbie-thumbnail")
+
+    # Filepath of the thumbnail of `filepath`, making it first if needed. Blocks while the thumbnail is made.
+    # Raises OSError if the source can't be read
+    def get(self, filepath):
+        stat = os.stat(filepath)
+        key = hashlib.sha1(f"{os.path.abspath(filepath)}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+        thumbnail_path = os.path.join(self.folder, key[:2], key + ".jpg")
+
+        with self.lock:
+            if thumbnail_path in self.entries:
+                self.entries.move_to_end(thumbnail_path)
+                self.num_hits += 1
+                return thumbnail_path
+
+        data = self.make_thumbnail(filepath)
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        temp_path = thumbnail_path + f".{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as fout:
+            fout.write(data)
+        os.replace(temp_path, thumbnail_path)
+
+        with self.lock:
+            if thumbnail_path not in self.entries:
+                self.entries[thumbnail_path] = len(data)
+                self.total_bytes += len(data)
+            self.num_generated += 1
+            self.evict()
+        return thumbnail_path
+
+    # Same as `get`, on the worker pool. Returns a concurrent.futures.Future
+    def submit(self, filepath):
+        return self.executor.submit(self.get, filepath)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    # JPEG bytes of a thumbnail of an image, or of a video's first frame
+    def make_thumbnail(self, filepath):
+        if os.path.splitext(filepath)[1].lower() in VIDEO_EXTENSIONS:
+            vid = cv2.VideoCapture(filepath)
+            is_read, image = vid.read()
+            vid.release()
+            if not is_read:
+                image = None
+        else:
+            image = cv2.imread(filepath, cv2.IMREAD_COLOR)
+        if image is None:
+            raise OSError(f"could not read {filepath}")
+
+        height, width = image.shape[:2]
+        if width > THUMBNAIL_WIDTH:
+            image = cv2.resize(image, (THUMBNAIL_WIDTH, max(1, height * THUMBNAIL_WIDTH // width)), interpolation=cv2.INTER_AREA)
+        is_encoded, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY])
+        if not is_encoded:
+            raise OSError(f"could not encode thumbnail of {filepath}")
+        return data.tobytes()
+
+    # Index thumbnails left by previous runs, oldest first
+    def scan(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                filepath = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(filepath)
+                except OSError:
+                    continue
+                if filename.endswith(".tmp"):
+                    os.remove(filepath)     # Left by a crash while writing
+                    continue
+                found.append((stat.st_mtime, filepath, stat.st_size))
+        for _, filepath, size in sorted(found):
+            self.entries[filepath] = size
+            self.total_bytes += size
+        self.evict()
+
+    # Delete least recently used thumbnails until within budget (call with the lock held, or before threads start)
+    def evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 0:
+            filepath, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
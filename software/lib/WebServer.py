@@ -0,0 +1,587 @@
+"""
+Web server
+
+Serves snapshots and clips, kibbie's status and a few control commands to browsers on the LAN.
+One asyncio event loop on a background thread handles every client, so a slow phone downloading a
+large file doesn't hold up anyone else:
+ - files are sent with `loop.sendfile` (os.sendfile, no copies through Python), with Range requests
+   (resuming downloads, seeking in clips) and conditional GETs (ETag / Last-Modified, so reloading
+   a page only revalidates its images)
+ - directory indexes are built on a worker thread and cached until the directory changes
+ - connections are kept alive between requests
+
+Endpoints:
+    /                   links to the served folders and pages
+    /<folder>/<path>    files and directory indexes under the served folders (SERVED_FOLDERS under `root`,
+                        so logs, journal/ and persistence files are never exposed)
+    /status.json        latest status published by the owner with `publish_status`, plus server statistics
+    /gallery            days with snapshots or clips, newest first
+    /gallery/<day>      thumbnails of a day's snapshots and clips, newest first, GALLERY_PAGE_SIZE per page (?page=N)
+    /thumbnail/<path>   JPEG thumbnail of a snapshot or clip (see ThumbnailCache)
+    /live               page showing the live stream
+    /stream.mjpg        MJPEG stream of a FrameBroadcaster (if one is given)
+    POST /control       queue a command, eg.,
+                            curl -H "Authorization: Bearer <token>" -H "Content-Type: application/json" \\
+                                 -d '{"command": "dispense", "corral": "NOODLE_L"}' http://kibbie:8000/control
+                        Commands are put on `commands` as (name, {param: value}) for the owner to run on
+                        its own thread (only the names passed as `command_names` are accepted).
+                        Disabled unless WEB_CONTROL_TOKEN is set. Only JSON bodies with the token are
+                        accepted, and requests from other sites' pages (a foreign Origin) are refused.
+
+"""
+
+import asyncio
+import collections
+import email.utils
+import hmac
+import html
+import json
+import mimetypes
+import os
+import queue
+import re
+import socket
+import threading
+import time
+import urllib.parse
+
+from .Parameters import WEB_CONTROL_TOKEN, WEB_PORT
+from .ThumbnailCache import is_thumbnailable
+
+KEEP_ALIVE_TIMEOUT_S = 15.0     # Idle connections are closed after this long
+MAX_HEADERS = 64
+MAX_BODY_BYTES = 4096           # Only small control requests have bodies
+MAX_CACHED_INDEXES = 64         # Directory indexes kept in memory
+
+# Folders under `root` that are served (everything else under root, eg., kibbie.log, is not)
+SERVED_FOLDERS = ["snapshots", "clips", "thumbnails"]
+
+# Folders with per-day subfolders (<folder>/<YYYY-MM-DD>/) shown in the gallery
+GALLERY_FOLDERS = ["snapshots", "clips"]
+GALLERY_PAGE_SIZE = 48
+DAY_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}$")
+
+# Thumbnail URLs in the gallery carry the source's mtime, so they can be cached by the browser
+THUMBNAIL_MAX_AGE_S = 60 * 60 * 24 * 7
+
+STATUS_TEXT = {
+    200: "OK", 202: "Accepted", 206: "Partial Content", 301: "Moved Permanently", 304: "Not Modified",
+    400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 415: "Unsupported Media Type", 416: "Range Not Satisfiable", 500: "Internal Server Error",
+}
+
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+LIVE_PAGE = b"""<html>
+<head><title>Kibbie</title><meta name="viewport" content="width=device-width, initial-scale=1"></head>
+<body style="margin:0; background:black"><img src="stream.mjpg" style="width:100%"></body>
+</html>
+"""
+
+
+# Parsed request line and headers
+class Request:
+    def __init__(self, method, target, version, headers):
+        self.method = method
+        self.path, _, query = target.partition("?")
+        self.path = urllib.parse.unquote(self.path)
+        self.params = {key: values[-1] for key, values in urllib.parse.parse_qs(query).items()}
+        self.version = version
+        self.headers = headers  # Lowercase names
+        self.body = b""
+
+    def keep_alive(self):
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+# Raised while handling a request to send an error response
+class HttpError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or STATUS_TEXT.get(status, ""))
+        self.status = status
+
+
+class WebServer:
+    # root: folder the served folders are in
+    # folders: folders under root that files are served from
+    # broadcaster: FrameBroadcaster for /stream.mjpg, or None
+    # thumbnail_cache: ThumbnailCache for /thumbnail and /gallery, or None
+    # command_names: commands accepted by POST /control (empty to disable control)
+    # control_token: token POST /control requests must carry (None to disable control)
+    # Raises OSError if the port can't be opened
+    def __init__(self, root=".", folders=SERVED_FOLDERS, port=WEB_PORT, broadcaster=None, thumbnail_cache=None, command_names=(), control_token=WEB_CONTROL_TOKEN, log=print):
+        self.root = os.path.realpath(root)
+        self.folders = list(folders)
+        self.port = port
+        self.broadcaster = broadcaster
+        self.thumbnail_cache = thumbnail_cache
+        self.command_names = set(command_names) if control_token else set()
+        self.control_token = control_token
+        self.log = log
+
+        # Commands received by POST /control, as (name, params)
+        self.commands = queue.SimpleQueue()
+
+        # Status dict from `publish_status` (replaced, never modified, so it can be read from the loop)
+        self.status = {}
+
+        # Directory path -> (mtime_ns, HTML), most recently used last
+        self.index_cache = collections.OrderedDict()
+
+        # Day -> (folder mtimes, gallery entries), see `list_day`
+        self.gallery_cache = collections.OrderedDict()
+
+        # Statistics
+        self.num_clients = 0
+        self.num_requests = 0
+
+        # Bind here so a port in use is reported to the caller
+        self.sock = socket.create_server(("", port), reuse_port=False)
+        self.loop = asyncio.new_event_loop()
+        self.stop_event = asyncio.Event()
+        self.thread = threading.Thread(target=self.run, name="kibbie-web", daemon=True)
+        self.thread.start()
+        self.log(f"Web server at http://localhost:{port}/")
+        if command_names and not control_token:
+            self.log("Web control is disabled (set WEB_CONTROL_TOKEN to enable it)")
+
+    # Replace the status served at /status.json (a JSON-serializable dict)
+    def publish_status(self, status):
+        self.status = status
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.stop_event.set)
+        self.thread.join()
+
+
+    #############################################################
+    # Event loop thread
+    #############################################################
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    async def serve(self):
+        client_tasks = set()
+
+        async def on_connect(reader, writer):
+            task = asyncio.current_task()
+            client_tasks.add(task)
+            try:
+                await self.handle_client(reader, writer)
+            except asyncio.CancelledError:
+                pass    # Server closing
+            finally:
+                client_tasks.discard(task)
+
+        server = await asyncio.start_server(on_connect, sock=self.sock)
+        await self.stop_event.wait()
+        server.close()
+        for task in list(client_tasks):
+            task.cancel()
+        await asyncio.gather(*client_tasks, return_exceptions=True)
+        await server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        self.num_clients += 1
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self.read_request(reader), KEEP_ALIVE_TIMEOUT_S)
+                except HttpError as e:
+                    await self.send_error(writer, e.status, str(e), keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                self.num_requests += 1
+                try:
+                    keep_alive = await self.handle_request(request, writer)
+                except HttpError as e:
+                    keep_alive = request.keep_alive()
+                    await self.send_error(writer, e.status, str(e), keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            pass    # Client left, idled out or sent garbage (eg., an overlong header line)
+        except Exception as e:
+            self.log(f"*** Web server error: {e}")
+        finally:
+            self.num_clients -= 1
+            writer.close()
+
+    # Returns a Request, or None if the client closed the connection
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        parts = line.decode("latin-1").split()
+        if len(parts) != 3:
+            raise HttpError(400)
+        method, target, version = parts
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HttpError(400, "Too many headers")
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        request = Request(method, target, version, headers)
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413)
+        if length > 0:
+            request.body = await reader.readexactly(length)
+        return request
+
+    # Returns True to keep the connection open
+    async def handle_request(self, request, writer):
+        if request.path == "/control":
+            return await self.handle_control(request, writer)
+        if request.method not in ("GET", "HEAD"):
+            raise HttpError(405)
+        head_only = request.method == "HEAD"
+
+        if request.path == "/status.json":
+            status = dict(self.status, server={"clients": self.num_clients, "requests": self.num_requests})
+            body = json.dumps(status).encode()
+            await self.send_response(writer, 200, {"Content-Type": "application/json", "Cache-Control": "no-cache"}, body, request.keep_alive(), head_only)
+            return request.keep_alive()
+        if request.path in ("/live", "/stream.mjpg") and self.broadcaster is not None:
+            if request.path == "/live":
+                await self.send_response(writer, 200, {"Content-Type": "text/html"}, LIVE_PAGE, request.keep_alive(), head_only)
+                return request.keep_alive()
+            await self.send_stream(writer)
+            return False
+        if self.thumbnail_cache is not None:
+            if request.path.startswith("/thumbnail/"):
+                await self.send_thumbnail(request, writer, request.path[len("/thumbnail"):], head_only)
+                return request.keep_alive()
+            if request.path.rstrip("/") == "/gallery":
+                await self.send_gallery_days(request, writer, head_only)
+                return request.keep_alive()
+            if request.path.startswith("/gallery/"):
+                await self.send_gallery_page(request, writer, request.path[len("/gallery/"):].strip("/"), head_only)
+                return request.keep_alive()
+
+        if request.path == "/":
+            await self.send_home(request, writer, head_only)
+            return request.keep_alive()
+
+        path = self.resolve(request.path)
+        if os.path.isdir(path):
+            if not request.path.endswith("/"):
+                await self.send_response(writer, 301, {"Location": urllib.parse.quote(request.path) + "/"}, b"", request.keep_alive(), head_only)
+                return request.keep_alive()
+            if not os.path.isfile(os.path.join(path, "index.html")):
+                await self.send_index(request, writer, path, head_only)
+                return request.keep_alive()
+            path = os.path.join(path, "index.html")
+        await self.send_file(request, writer, path, head_only)
+        return request.keep_alive()
+
+    # Filesystem path for a URL path, refusing anything outside the served folders
+    def resolve(self, url_path):
+        path = os.path.realpath(os.path.join(self.root, url_path.lstrip("/")))
+        for folder in self.folders:
+            folder_path = os.path.realpath(os.path.join(self.root, folder))
+            if os.path.commonpath([path, folder_path]) == folder_path and os.path.exists(path):
+                return path
+        raise HttpError(404)
+
+    async def send_response(self, writer, status, headers, body, keep_alive, head_only=False):
+        head = f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        headers = dict(headers)
+        headers.setdefault("Content-Length", str(len(body)))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        head += "".join(f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n"
+        writer.write(head.encode("latin-1"))
+        if not head_only and len(body) > 0:
+            writer.write(body)
+        await writer.drain()
+
+    async def send_error(self, writer, status, message, keep_alive):
+        body = f"{status} {html.escape(message)}\n".encode()
+        await self.send_response(writer, status, {"Content-Type": "text/plain"}, body, keep_alive)
+
+    # True if the client's cached copy (If-None-Match / If-Modified-Since) is still valid
+    def is_not_modified(self, request, etag, mtime):
+        if "if-none-match" in request.headers:
+            return etag in [tag.strip() for tag in request.headers["if-none-match"].split(",")] or request.headers["if-none-match"].strip() == "*"
+        if "if-modified-since" in request.headers:
+            try:
+                return int(mtime) <= email.utils.parsedate_to_datetime(request.headers["if-modified-since"]).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    # (start, end) inclusive byte range requested, or None for the whole file
+    def parse_range(self, request, etag, size):
+        range_header = request.headers.get("range")
+        if range_header is None:
+            return None
+        if "if-range" in request.headers and request.headers["if-range"] != etag:
+            return None     # File changed since the client's partial copy, send all of it
+        match = RANGE_PATTERN.match(range_header.replace(" ", ""))
+        if match is None:
+            return None     # Multiple or unsupported ranges, send the whole file
+        first, last = match.groups()
+        if first == "":
+            if last == "" or int(last) == 0:
+                raise HttpError(416)
+            start, end = max(0, size - int(last)), size - 1
+        else:
+            start, end = int(first), size - 1 if last == "" else min(int(last), size - 1)
+        if start >= size or start > end:
+            raise HttpError(416)
+        return start, end
+
+    # cache_control: how long the browser may reuse the file without revalidating
+    async def send_file(self, request, writer, path, head_only, cache_control="no-cache"):
+        try:
+            file = open(path, "rb")
+        except OSError:
+            raise HttpError(404)
+        with file:
+            stat = os.fstat(file.fileno())
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            headers = {
+                "Content-Type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+                "ETag": etag,
+                "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+                "Accept-Ranges": "bytes",
+                "Cache-Control": cache_control,     # Revalidate by default (eg., snapshots/current.png is rewritten)
+            }
+            if self.is_not_modified(request, etag, stat.st_mtime):
+                await self.send_response(writer, 304, {"ETag": etag, "Content-Length": "0"}, b"", request.keep_alive())
+                return
+
+            try:
+                byte_range = self.parse_range(request, etag, stat.st_size)
+            except HttpError:
+                headers = {"Content-Range": f"bytes */{stat.st_size}"}
+                await self.send_response(writer, 416, headers, b"", request.keep_alive())
+                return
+
+            status, start, count = 200, 0, stat.st_size
+            if byte_range is not None:
+                start, end = byte_range
+                status, count = 206, end - start + 1
+                headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            headers["Content-Length"] = str(count)
+
+            await self.send_response(writer, status, headers, b"", request.keep_alive())
+            if not head_only and count > 0:
+                await asyncio.get_running_loop().sendfile(writer.transport, file, start, count)
+
+    # Links to the served folders and pages
+    async def send_home(self, request, writer, head_only):
+        links = [folder + "/" for folder in self.folders if os.path.isdir(os.path.join(self.root, folder))]
+        if self.thumbnail_cache is not None:
+            links.append("gallery")
+        if self.broadcaster is not None:
+            links.append("live")
+        links.append("status.json")
+
+        lines = ["<html><head><title>Kibbie</title><meta name=\"viewport\" content=\"width=device-width, initial-scale=1\"></head>",
+                 "<body><h2>Kibbie</h2><ul>"]
+        lines += [f'<li><a href="/{link}">{html.escape(link)}</a></li>' for link in links]
+        lines.append("</ul></body></html>")
+        await self.send_response(writer, 200, {"Content-Type": "text/html; charset=utf-8", "Cache-Control": "no-cache"}, "\n".join(lines).encode(), request.keep_alive(), head_only)
+
+    async def send_index(self, request, writer, path, head_only):
+        mtime_ns = os.stat(path).st_mtime_ns
+        etag = f'"dir-{mtime_ns:x}"'
+        if self.is_not_modified(request, etag, mtime_ns / 1e9):
+            await self.send_response(writer, 304, {"ETag": etag, "Content-Length": "0"}, b"", request.keep_alive())
+            return
+
+        cached = self.index_cache.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            body = cached[1]
+            self.index_cache.move_to_end(path)
+        else:
+            # Large folders (eg., a day of snapshots) take a while to list, keep that off the loop
+            body = await asyncio.get_running_loop().run_in_executor(None, self.build_index, path, request.path)
+            self.index_cache[path] = (mtime_ns, body)
+            while len(self.index_cache) > MAX_CACHED_INDEXES:
+                self.index_cache.popitem(last=False)
+
+        headers = {"Content-Type": "text/html; charset=utf-8", "ETag": etag, "Cache-Control": "no-cache"}
+        await self.send_response(writer, 200, headers, body, request.keep_alive(), head_only)
+
+    def build_index(self, path, url_path):
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    size = 0 if is_dir else entry.stat().st_size
+                except OSError:
+                    continue
+                entries.append((not is_dir, entry.name, size))
+        entries.sort()
+
+        title = html.escape(url_path)
+        lines = [f"<html><head><title>{title}</title><meta name=\"viewport\" content=\"width=device-width, initial-scale=1\"></head>",
+                 f"<body><h2>{title}</h2><ul>"]
+        if url_path != "/":
+            lines.append('<li><a href="../">../</a></li>')
+        for is_file, name, size in entries:
+            display_name = name if is_file else name + "/"
+            size_text = f" ({size / 1e3:.0f} kB)" if is_file else ""
+            lines.append(f'<li><a href="{urllib.parse.quote(display_name)}">{html.escape(display_name)}</a>{size_text}</li>')
+        lines.append("</ul></body></html>")
+        return "\n".join(lines).encode()
+
+    async def send_thumbnail(self, request, writer, url_path, head_only):
+        path = self.resolve(url_path)
+        if not os.path.isfile(path) or not is_thumbnailable(path):
+            raise HttpError(404)
+        try:
+            thumbnail_path = await asyncio.wrap_future(self.thumbnail_cache.submit(path))
+        except OSError:
+            raise HttpError(404, "Could not make thumbnail")
+        cache_control = f"max-age={THUMBNAIL_MAX_AGE_S}" if "v" in request.params else "no-cache"
+        await self.send_file(request, writer, thumbnail_path, head_only, cache_control)
+
+    async def send_gallery_days(self, request, writer, head_only):
+        days = set()
+        for folder in GALLERY_FOLDERS:
+            folder_path = os.path.join(self.root, folder)
+            if os.path.isdir(folder_path):
+                days.update(name for name in os.listdir(folder_path) if DAY_PATTERN.match(name))
+
+        lines = ["<html><head><title>Kibbie gallery</title><meta name=\"viewport\" content=\"width=device-width, initial-scale=1\"></head>",
+                 "<body><h2>Kibbie gallery</h2><ul>"]
+        lines += [f'<li><a href="/gallery/{day}">{day}</a></li>' for day in sorted(days, reverse=True)]
+        lines.append("</ul></body></html>")
+        await self.send_response(writer, 200, {"Content-Type": "text/html; charset=utf-8", "Cache-Control": "no-cache"}, "\n".join(lines).encode(), request.keep_alive(), head_only)
+
+    async def send_gallery_page(self, request, writer, day, head_only):
+        if not DAY_PATTERN.match(day):
+            raise HttpError(404)
+        entries = await self.list_day(day)
+        num_pages = max(1, (len(entries) + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE)
+        try:
+            page = min(max(int(request.params.get("page", 0)), 0), num_pages - 1)
+        except ValueError:
+            raise HttpError(400, "Invalid page")
+
+        def page_link(number, text):
+            return f'<a href="/gallery/{day}?page={number}">{text}</a>' if 0 <= number < num_pages and number != page else text
+        navigation = f'<p><a href="/gallery">All days</a> | {page_link(page - 1, "&lt; Newer")} | page {page + 1} of {num_pages} | {page_link(page + 1, "Older &gt;")}</p>'
+
+        lines = [f"<html><head><title>Kibbie {day}</title><meta name=\"viewport\" content=\"width=device-width, initial-scale=1\"></head>",
+                 f"<body><h2>{day} ({len(entries)} snapshots and clips)</h2>", navigation, "<div>"]
+        for _, url_path, name, mtime_ns in entries[page * GALLERY_PAGE_SIZE:(page + 1) * GALLERY_PAGE_SIZE]:
+            quoted = urllib.parse.quote(url_path)
+            label = html.escape(os.path.splitext(name)[0]) + (" &#9654;" if name.endswith(".avi") else "")
+            lines.append(f'<figure style="display:inline-block; margin:4px"><a href="{quoted}"><img src="/thumbnail{quoted}?v={mtime_ns}" loading="lazy" width="240"></a>'
+                         f'<figcaption style="font-size:small">{label}</figcaption></figure>')
+        lines += ["</div>", navigation, "</body></html>"]
+        await self.send_response(writer, 200, {"Content-Type": "text/html; charset=utf-8", "Cache-Control": "no-cache"}, "\n".join(lines).encode(), request.keep_alive(), head_only)
+
+    # A day's gallery entries as (mtime, URL path, name, mtime_ns), newest first
+    # Cached until one of the day's folders changes
+    async def list_day(self, day):
+        folder_paths = [os.path.join(self.root, folder, day) for folder in GALLERY_FOLDERS]
+        mtimes = tuple(os.stat(path).st_mtime_ns if os.path.isdir(path) else 0 for path in folder_paths)
+        cached = self.gallery_cache.get(day)
+        if cached is not None and cached[0] == mtimes:
+            self.gallery_cache.move_to_end(day)
+            return cached[1]
+
+        def scan():
+            entries = []
+            for folder, path in zip(GALLERY_FOLDERS, folder_paths):
+                if not os.path.isdir(path):
+                    continue
+                with os.scandir(path) as it:
+                    for entry in it:
+                        if not is_thumbnailable(entry.name):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, f"/{folder}/{day}/{entry.name}", entry.name, stat.st_mtime_ns))
+            entries.sort(reverse=True)
+            return entries
+
+        entries = await asyncio.get_running_loop().run_in_executor(None, scan)
+        self.gallery_cache[day] = (mtimes, entries)
+        while len(self.gallery_cache) > MAX_CACHED_INDEXES:
+            self.gallery_cache.popitem(last=False)
+        return entries
+
+    async def send_stream(self, writer):
+        loop = asyncio.get_running_loop()
+        latest = asyncio.Queue(maxsize=1)   # Only the newest frame is kept for a slow viewer
+
+        def put_latest(jpeg):
+            if latest.full():
+                latest.get_nowait()
+            latest.put_nowait(jpeg)
+
+        # Called from the broadcaster's encoder thread
+        def on_frame(sequence, jpeg):
+            try:
+                loop.call_soon_threadsafe(put_latest, jpeg)
+            except RuntimeError:
+                pass    # Loop closed
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=frame\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        self.broadcaster.add_listener(on_frame)
+        try:
+            while True:
+                jpeg = await latest.get()
+                writer.write(f"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n".encode() + jpeg + b"\r\n")
+                await writer.drain()
+        finally:
+            self.broadcaster.remove_listener(on_frame)
+
+    async def handle_control(self, request, writer):
+        if not self.command_names:
+            raise HttpError(404, "Control is disabled")
+        if request.method != "POST":
+            raise HttpError(405, "Use POST")
+
+        # Browsers send Origin with cross-site requests; only pages served from here may post
+        origin = request.headers.get("origin")
+        if origin is not None and urllib.parse.urlsplit(origin).netloc != request.headers.get("host"):
+            raise HttpError(403, "Foreign origin")
+
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), self.control_token.encode()):
+            raise HttpError(401, "Missing or wrong token")
+
+        # JSON only: a cross-site form can't send it without a CORS preflight, which isn't answered
+        if request.headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+            raise HttpError(415, "Send a JSON body")
+        try:
+            params = json.loads(request.body)
+        except ValueError:
+            raise HttpError(400, "Invalid JSON")
+        if not isinstance(params, dict):
+            raise HttpError(400, "Expected a JSON object")
+
+        name = params.pop("command", None)
+        if name not in self.command_names:
+            raise HttpError(400, f"Unknown command {name} (expected one of {', '.join(sorted(self.command_names))})")
+        self.commands.put((name, params))
+
+        body = json.dumps({"accepted": name, "params": params, "time": time.time()}).encode()
+        await self.send_response(writer, 202, {"Content-Type": "application/json"}, body, request.keep_alive())
+        return request.keep_alive()
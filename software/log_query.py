@@ -0,0 +1,114 @@
+"""
+Fast queries over historical kibbie.log files (see lib/LogIndex.py)
+
+The first run builds a sidecar index next to the log. Later runs only index newly appended lines.
+
+Examples:
+    python3 software/log_query.py dispenses --since 2023-02-01 --until 2023-03-01
+    python3 software/log_query.py doors --since 2023-02-12 --corral NOODLE_L
+    python3 software/log_query.py transitions --since 2023-02-12 --until 2023-02-13
+    python3 software/log_query.py events --type cat_entered --since 2023-02-12
+    python3 software/log_query.py lines --since "2023-02-12 08:00" --until "2023-02-12 08:05"
+"""
+
+import argparse
+from collections import defaultdict
+import time
+
+import lib.LogIndex as LogIndex
+
+TIME_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]
+
+EVENT_TYPES = [
+    LogIndex.EVENT_DOOR_OPEN,
+    LogIndex.EVENT_DOOR_CLOSE,
+    LogIndex.EVENT_DISPENSE,
+    LogIndex.EVENT_CAT_ENTERED,
+    LogIndex.EVENT_CAT_LEFT,
+    LogIndex.EVENT_STATE_TRANSITION,
+    LogIndex.EVENT_STARTUP,
+    LogIndex.EVENT_SHUTDOWN,
+]
+
+def parse_time(time_string):
+    for time_format in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(time_string, time_format))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f'Could not parse "{time_string}" (use YYYY-MM-DD [HH:MM[:SS]])')
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+def print_dispenses(index, args):
+    for day, corral, count in index.dispenses_per_day(args.since, args.until):
+        if args.corral is None or corral == args.corral:
+            print(f"{day}  {corral:<12} {count}")
+
+
+def print_doors(index, args):
+    durations_per_day = defaultdict(list)
+    for corral, open_time, close_time in index.door_open_intervals(args.since, args.until):
+        if args.corral is not None and corral != args.corral:
+            continue
+        if close_time is None:
+            print(f"{format_time(open_time)}  {corral:<12} (no close logged)")
+            continue
+        duration = close_time - open_time
+        durations_per_day[(time.strftime("%Y-%m-%d", time.localtime(open_time)), corral)].append(duration)
+        if args.verbose:
+            print(f"{format_time(open_time)}  {corral:<12} {duration:8.1f} s")
+
+    print(f"{'day':<10}  {'corral':<12} {'opens':>6} {'total s':>9} {'mean s':>8} {'max s':>8}")
+    for (day, corral), durations in sorted(durations_per_day.items()):
+        print(f"{day:<10}  {corral:<12} {len(durations):6d} {sum(durations):9.1f} {sum(durations) / len(durations):8.1f} {max(durations):8.1f}")
+
+
+def print_transitions(index, args):
+    for t, _, corral, _, detail in index.events(args.since, args.until, [LogIndex.EVENT_STATE_TRANSITION], args.corral):
+        print(f"{format_time(t)}  {corral:<12} {detail}")
+
+
+def print_events(index, args):
+    for t, event_type, corral, cat, detail in index.events(args.since, args.until, args.type, args.corral):
+        print(f"{format_time(t)}  {event_type:<16} {corral or '':<12} {cat or '':<8} {detail or ''}")
+
+
+def print_lines(index, args):
+    for line in index.lines(args.since, args.until):
+        print(line)
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Query historical kibbie.log files")
+    ap.add_argument("--log", default="kibbie.log", help="path to kibbie.log")
+    subparsers = ap.add_subparsers(dest="command", required=True)
+
+    commands = {
+        "dispenses": (print_dispenses, "dispense counts per day and corral"),
+        "doors": (print_doors, "door-open durations per day and corral"),
+        "transitions": (print_transitions, "dispenser state machine transitions"),
+        "events": (print_events, "all indexed events"),
+        "lines": (print_lines, "raw log lines in a time range"),
+    }
+    for name, (_, help_text) in commands.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("--since", type=parse_time, default=0, help="start time (YYYY-MM-DD [HH:MM[:SS]], inclusive)")
+        subparser.add_argument("--until", type=parse_time, default=float("inf"), help="end time (YYYY-MM-DD [HH:MM[:SS]], exclusive)")
+        subparser.add_argument("--corral", help="only this corral")
+        if name == "events":
+            subparser.add_argument("--type", action="append", choices=EVENT_TYPES, help="event type (repeatable)")
+        if name == "doors":
+            subparser.add_argument("-v", "--verbose", action="store_true", help="also print every opening")
+    args = ap.parse_args()
+
+    index = LogIndex.LogIndex(args.log)
+    start_time = time.perf_counter()
+    num_bytes = index.update()
+    if num_bytes > 0:
+        print(f"Indexed {num_bytes / 1e6:.1f} MB of new log in {time.perf_counter() - start_time:.2f} s")
+
+    commands[args.command][0](index, args)
+    index.close()
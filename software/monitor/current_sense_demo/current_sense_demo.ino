@@ -19,6 +19,13 @@
 
     F,<timestamp>,<ch0 amp-seconds>,<ch0 open>,<ch1 amp-seconds>,<ch1 open>
 
+  Binary output (ENABLE_BINARY_OUTPUT):
+
+  Instead of the text messages, sends a fixed-size frame every BINARY_OUTPUT_PERIOD_MS
+  (see software/lib/MonitorProtocol.py for the layout, which must match):
+
+    <sync 0xA55A><sequence><millis><ch0 mA><ch1 mA><efuse open bits><reserved><CRC-16/CCITT-FALSE>
+
 */
 
 // Set to true to turn on current debug message (raw sample, unfiltered voltage, unfiltered current)
@@ -27,6 +34,9 @@ const bool ENABLE_CURRENT_DEBUG = false;
 // Set to true to turn on efuse debug message (current integral)
 const bool ENABLE_EFUSE_DEBUG = false;
 
+// Set to true to send binary current frames instead of text (set SERIAL_PROTOCOL = "binary" on the Pi to match)
+const bool ENABLE_BINARY_OUTPUT = false;
+
 const float FILT_LEARNING_FACTOR = 0.95;       // Each new sample is 0.9*old + (1 - 0.9) * new
 
 const float VOLTAGE_BIAS = 2.5; // V, 0-current DC offset of current sensors
@@ -61,6 +71,13 @@ const int SAMPLE_INPUT_PERIOD_MS = 10;  // ms, period at which to run main loop
 unsigned long nextOutputTime = 0; // Next timestamp at which to report current measurement to serial
 unsigned long nextLoopTime = 0; // Next timestamp at which to sample inputs
 
+// Binary output
+const int BINARY_OUTPUT_PERIOD_MS = 2;  // ms, period at which to send binary frames (16 bytes each, 8 kB/s at 500 Hz)
+const uint16_t FRAME_SYNC_WORD = 0xA55A;
+const int FRAME_SIZE = 16;
+unsigned long nextBinaryOutputTime = 0; // Next timestamp at which to send a binary frame
+uint16_t frameSequence = 0;             // Incremented per frame so the Pi can count dropped frames
+
 // Efuse
 const int EFUSE_CALC_PERIOD_MS = 500;
 unsigned long nextEfuseCalcTime = 0;  // ms timestamp to run next efuse calculation
@@ -221,6 +238,56 @@ void reportEfuseStatusOnSerial(bool debug=false) {
   Serial.println(output);
 }
 
+// CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)
+uint16_t crc16(const uint8_t* data, int length) {
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+    }
+  }
+  return crc;
+}
+
+// Little-endian helpers for building frames
+void putUint16(uint8_t* buffer, int offset, uint16_t value) {
+  buffer[offset] = value & 0xFF;
+  buffer[offset + 1] = value >> 8;
+}
+
+void putUint32(uint8_t* buffer, int offset, uint32_t value) {
+  for (int i = 0; i < 4; i++) {
+    buffer[offset + i] = (value >> (8 * i)) & 0xFF;
+  }
+}
+
+void reportCurrentBinary() {
+  uint8_t frame[FRAME_SIZE];
+
+  putUint16(frame, 0, FRAME_SYNC_WORD);
+  putUint16(frame, 2, frameSequence++);
+  putUint32(frame, 4, millis());
+
+  uint8_t efuseOpenBits = 0;
+  for (int channel = 0; channel < NUM_CURRENT_CHANNELS; channel++) {
+    // Filtered current in milliamps, clamped to int16
+    float currentMilliamps = constrain(filteredCurrent[channel] * 1000.0, -32768.0, 32767.0);
+    putUint16(frame, 8 + 2 * channel, (uint16_t)(int16_t)currentMilliamps);
+
+    if (efuseOpenStatus[channel]) {
+      efuseOpenBits |= 1 << channel;
+    }
+  }
+  frame[12] = efuseOpenBits;
+  frame[13] = 0; // Reserved
+
+  // CRC over everything between the sync word and the CRC
+  putUint16(frame, 14, crc16(frame + 2, FRAME_SIZE - 4));
+
+  Serial.write(frame, FRAME_SIZE);
+}
+
 // the loop routine runs over and over again forever:
 void loop() {
   // Sample and filter current
@@ -239,7 +306,12 @@ void loop() {
 
   // Report filtered current and status on serial periodically
   currentTime = millis();
-  if (currentTime >= nextOutputTime) {
+  if (ENABLE_BINARY_OUTPUT) {
+    if (currentTime >= nextBinaryOutputTime) {
+      reportCurrentBinary();
+      nextBinaryOutputTime = currentTime + BINARY_OUTPUT_PERIOD_MS;
+    }
+  } else if (currentTime >= nextOutputTime) {
     if (ENABLE_CURRENT_DEBUG) {
       reportCurrentOnSerial(true);
     } else if (ENABLE_EFUSE_DEBUG) {
@@ -0,0 +1,132 @@
+"""
+Benchmark for the Kibbie -> Servo process command channel
+
+Compares the original transport (Python lists pickled through a `multiprocessing.Queue`)
+against binary ServoCommand frames sent over a `multiprocessing.Pipe`.
+
+Measures:
+  - Round-trip latency: send one command, wait for the servo side to echo its command ID
+  - Throughput: send a burst of commands, wait for the servo side to report it decoded all of them
+
+Run from the `software/` folder:
+    python3 multiprocessing_demo/servo_ipc_benchmark.py
+"""
+
+import os
+import sys
+import time
+from multiprocessing import Pipe, Process, Queue
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.ServoProtocol import ServoCommand, ServoOpcode
+
+NUM_LATENCY_SAMPLES = 2000
+NUM_THROUGHPUT_COMMANDS = 20000
+
+
+def make_list_command(command_id):
+    return ["queue_angle_stepped", command_id, 0, 138, 3, 105, 127, 0]
+
+
+def make_binary_command(command_id):
+    return ServoCommand(ServoOpcode.QUEUE_ANGLE_STEPPED, command_id, channel=0, target_angle=138, latch_channel=3,
+        latch_angle_unlocked=105, latch_angle_locked=127).encode()
+
+
+########################
+# Servo side stand-ins
+########################
+
+# Echo each command ID back, decoding the same way servo_process used to
+def queue_servo(command_queue, reply_queue):
+    while True:
+        command = command_queue.get()
+        opcode = command[0]
+        command_id = command[1]
+        if opcode == "exit":
+            return
+        reply_queue.put(command_id)
+
+
+# Echo each command ID back, decoding the same way servo_process does now
+def pipe_servo(command_conn, reply_conn):
+    while True:
+        command = ServoCommand.decode(command_conn.recv_bytes())
+        if command.opcode == ServoOpcode.EXIT:
+            return
+        reply_conn.send_bytes(command.command_id.to_bytes(4, "little"))
+
+
+########################
+# Benchmarks
+########################
+
+def summarize(name, latencies_s, throughput_s):
+    latencies_s.sort()
+    median_us = latencies_s[len(latencies_s) // 2] * 1e6
+    p99_us = latencies_s[int(len(latencies_s) * 0.99)] * 1e6
+    rate = NUM_THROUGHPUT_COMMANDS / throughput_s
+    print(f"{name:>6}: latency median {median_us:8.1f} us, p99 {p99_us:8.1f} us | throughput {rate:10.0f} commands/s")
+
+
+def benchmark_queue():
+    command_queue = Queue()
+    reply_queue = Queue()
+    process = Process(target=queue_servo, args=(command_queue, reply_queue,))
+    process.start()
+
+    latencies_s = []
+    for command_id in range(NUM_LATENCY_SAMPLES):
+        start_time = time.perf_counter()
+        command_queue.put(make_list_command(command_id))
+        reply_queue.get()
+        latencies_s.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    for command_id in range(NUM_THROUGHPUT_COMMANDS):
+        command_queue.put(make_list_command(command_id))
+    for _ in range(NUM_THROUGHPUT_COMMANDS):
+        reply_queue.get()
+    throughput_s = time.perf_counter() - start_time
+
+    command_queue.put(["exit", 0])
+    process.join()
+    summarize("Queue", latencies_s, throughput_s)
+
+
+def benchmark_pipe():
+    command_recv_conn, command_send_conn = Pipe(duplex=False)
+    reply_recv_conn, reply_send_conn = Pipe(duplex=False)
+    process = Process(target=pipe_servo, args=(command_recv_conn, reply_send_conn,))
+    process.start()
+
+    latencies_s = []
+    for command_id in range(NUM_LATENCY_SAMPLES):
+        start_time = time.perf_counter()
+        command_send_conn.send_bytes(make_binary_command(command_id))
+        reply_recv_conn.recv_bytes()
+        latencies_s.append(time.perf_counter() - start_time)
+
+    # Drain replies while sending so neither side blocks on a full pipe
+    start_time = time.perf_counter()
+    num_replies = 0
+    for command_id in range(NUM_THROUGHPUT_COMMANDS):
+        command_send_conn.send_bytes(make_binary_command(command_id))
+        while reply_recv_conn.poll():
+            reply_recv_conn.recv_bytes()
+            num_replies += 1
+    while num_replies < NUM_THROUGHPUT_COMMANDS:
+        reply_recv_conn.recv_bytes()
+        num_replies += 1
+    throughput_s = time.perf_counter() - start_time
+
+    command_send_conn.send_bytes(ServoCommand(ServoOpcode.EXIT, 0).encode())
+    process.join()
+    summarize("Pipe", latencies_s, throughput_s)
+
+
+if __name__ == '__main__':
+    print(f"Servo IPC benchmark ({NUM_LATENCY_SAMPLES} latency samples, {NUM_THROUGHPUT_COMMANDS} throughput commands)")
+    benchmark_queue()
+    benchmark_pipe()
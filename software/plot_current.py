@@ -1,54 +1,42 @@
 import time
 
-import matplotlib.pyplot as plt
 import numpy as np
 
+from lib.CurrentHistory import CurrentHistory
+from lib.CurrentPlot import CurrentPlot
 from lib.KibbieSerial import KibbieSerial
+from lib.SerialBroker import SerialBrokerClient
+
+PLOT_WINDOW_S = 2.0
+SAMPLE_PERIOD_S = 0.1
+SAVE_PERIOD_S = 0.5     # Re-render current.png at most this often
 
 class Plotter:
     def __init__(self):
-        self.current_history = []
-        self.fig, self.ax = plt.subplots()
+        self.current_history = CurrentHistory(KibbieSerial.NUM_CURRENT_CHANNELS)
+        self.current_sample_count = 0
+        self.current_plot = CurrentPlot(KibbieSerial.NUM_CURRENT_CHANNELS, xlim=(-PLOT_WINDOW_S, 0), ylim=(-0.1, 3.0))
 
-        self.kbSerial = KibbieSerial()
+        # Samples come from the serial broker (kibbie or serial_broker.py), which owns the port
+        self.kbSerial = SerialBrokerClient("stream")
     
 
     def sample_and_plot_current(self):
-        NUM_SAMPLES_TO_PLOT = 20
-
-        # Add current sample
-        for i,channel_sample in enumerate(self.kbSerial.channel_current):
-            # Initialize sample if it's the first time receiving it
-            if i == len(self.current_history):
-                self.current_history.append([channel_sample])
-            else:
-                self.current_history[i].append(channel_sample)
-
-            # Remove oldest sample if too long
-            if len(self.current_history[i]) > NUM_SAMPLES_TO_PLOT:
-                self.current_history[i] = self.current_history[i][1:]
+        # Add current samples received since the last plot
+        times, _, currents, self.current_sample_count = self.kbSerial.snapshot(since=self.current_sample_count)
+        self.current_history.extend(times, currents)
             
-        # Plot current
-        self.fig, self.ax = plt.subplots()
-        if len(self.current_history) >= 2:
-            # self.ax.plot(range(len(self.current_history[0])), 'g^', self.current_history[0], self.current_history[0]) #, 'g^', x2, y2, 'g-')
-            self.ax.plot(range(len(self.current_history[0])), self.current_history[0]) #, 'g^', x2, y2, 'g-')
-            self.ax.plot(range(len(self.current_history[1])), self.current_history[1])
-
-        self.ax.set(xlabel='sample number', ylabel='Current (A)',
-            title='Kibbie Door Current')
-        self.ax.grid()
-        self.ax.set_ylim(-0.1, 3.0)
-
-        self.fig.savefig("current.png")
-        # self.fig.show()
+        # Plot current (only the line data changes between plots)
+        now = time.time()
+        times, currents = self.current_history.raw(now - PLOT_WINDOW_S)
+        self.current_plot.update(times - now, currents)
+        self.current_plot.save("current.png", min_period_s=SAVE_PERIOD_S)
 
     def main(self):
         while 1:
-            self.kbSerial.update()
             self.sample_and_plot_current()
 
-            time.sleep(0.1)
+            time.sleep(SAMPLE_PERIOD_S)
 
 p = Plotter()
-p.main()
\ No newline at end of file
+p.main()
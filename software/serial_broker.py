@@ -0,0 +1,44 @@
+"""
+Standalone serial broker (see lib/SerialBroker.py)
+
+kibbie runs its own broker, so this is only needed to share the monitor between tools
+(eg., plot_current.py and serial_demo/serial_monitor.py) while kibbie is not running.
+kibbie subscribes to this broker instead of opening the port if it is started while this is running.
+
+Run from the `software/` folder:
+    python3 serial_broker.py
+    python3 serial_broker.py --port /dev/pts/3 --protocol binary
+        Share a monitor_simulator.py pty
+"""
+
+import argparse
+import time
+
+from lib.KibbieSerial import KibbieSerial
+from lib.SerialBroker import BROKER_SOCKET_PATH, SerialBroker
+
+STATUS_PERIOD_S = 10.0
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Share the Kibbie monitor serial port with local tools")
+    ap.add_argument("--port", default=KibbieSerial.PORT)
+    ap.add_argument("--protocol", choices=["text", "binary"], default=None, help="serial protocol (default: SERIAL_PROTOCOL)")
+    ap.add_argument("--socket", default=BROKER_SOCKET_PATH, help="Unix socket to publish on")
+    args = ap.parse_args()
+
+    kb_serial = KibbieSerial(port=args.port, protocol=args.protocol)
+    broker = SerialBroker(kb_serial, args.socket)
+    print(f"Publishing {args.port} on {args.socket}")
+
+    try:
+        last_num_samples = 0
+        while True:
+            time.sleep(STATUS_PERIOD_S)
+            num_samples = kb_serial.num_samples
+            print(f"{(num_samples - last_num_samples) / STATUS_PERIOD_S:.0f} samples/s, {len(broker.subscribers)} subscribers, {broker.num_dropped_messages} dropped messages")
+            last_num_samples = num_samples
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.close()
+        kb_serial.close()
@@ -0,0 +1,77 @@
+"""
+Build door current templates for lib/DoorProfileMatcher.py
+
+Cuts annotated segments out of a recorded current profile, resamples them to a fixed rate and
+writes them to data/door_current_templates.json. The default segments come from
+data/20230212-noodle_door-open_current_profile-ANNOTATED.png (Noodle's door, channel 0).
+
+Run from the `software/` folder:
+    python3 serial_demo/build_door_templates.py
+    python3 serial_demo/build_door_templates.py --check
+        Also classify every annotated segment (and a sweep of windows) with the written templates.
+        The templates are cut from the same recording, so this only checks that they were cut
+        correctly. They have not been validated on other recordings; check against a held-out
+        recording before relying on them.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.DoorProfileMatcher import DEFAULT_TEMPLATES_FILEPATH, DoorProfileMatcher
+from monitor_simulator import DEFAULT_PROFILE, load_profile
+
+SAMPLE_PERIOD_S = 0.05
+TEMPLATE_DURATION_S = 3.0
+
+# (template name, current channel, start s) within the default profile
+DEFAULT_SEGMENTS = [
+    ("normal_close", 0, 8.0),
+    ("normal_open", 0, 20.0),
+    ("obstructed", 0, 27.2),     # Holding door open by hand
+    ("stall", 0, 37.2),          # Both door and lock being stuck
+]
+
+# Live windows are longer than templates, since the movement starts some time after the command
+CHECK_WINDOW_S = 4.0
+
+
+def cut_segment(times_s, currents, channel, start_s, duration_s):
+    grid = start_s + np.arange(int(round(duration_s / SAMPLE_PERIOD_S))) * SAMPLE_PERIOD_S
+    return np.interp(grid, times_s, currents[:, channel])
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Build door current templates from a recorded profile")
+    ap.add_argument("--profile", default=DEFAULT_PROFILE, help="current profile CSV (time(ms) and '... I filt' columns)")
+    ap.add_argument("--output", default=DEFAULT_TEMPLATES_FILEPATH, help="templates JSON to write")
+    ap.add_argument("--check", action="store_true", help="classify the annotated segments with the written templates")
+    args = ap.parse_args()
+
+    times_ms, currents = load_profile(args.profile)
+    times_s = times_ms / 1000.0
+
+    templates = []
+    for name, channel, start_s in DEFAULT_SEGMENTS:
+        segment = cut_segment(times_s, currents, channel, start_s, TEMPLATE_DURATION_S)
+        templates.append({"name": name, "current": [round(float(current), 3) for current in segment]})
+        print(f"{name:<14} {start_s:5.1f}-{start_s + TEMPLATE_DURATION_S:5.1f} s  mean {segment.mean():.2f} A, max {segment.max():.2f} A")
+
+    with open(args.output, "w") as fout:
+        json.dump({"sample_period_s": SAMPLE_PERIOD_S, "templates": templates}, fout, indent=1)
+    print(f"Wrote {len(templates)} templates to {args.output}")
+
+    if args.check:
+        matcher = DoorProfileMatcher(args.output)
+        print(f"Classifying {CHECK_WINDOW_S} s windows starting up to 1 s before each segment:")
+        for name, channel, start_s in DEFAULT_SEGMENTS:
+            for lead_s in [0.0, 0.5, 1.0]:
+                window_start_s = start_s - lead_s
+                selected = (times_s >= window_start_s) & (times_s < window_start_s + CHECK_WINDOW_S)
+                match = matcher.classify(times_s[selected], currents[selected, channel])
+                print(f"    {name:<14} -{lead_s:.1f} s: {match}")
@@ -0,0 +1,136 @@
+"""
+Kibbie monitor stand-in
+
+Emulates the Arduino current monitor on a pseudo-terminal, so KibbieSerial (text or binary protocol)
+can be exercised without the board. Current is replayed from a recorded profile CSV
+(default: data/20230212-noodle_door-open_current_profile.csv, "I filt" columns), looping forever.
+
+Run from the `software/` folder:
+    python3 serial_demo/monitor_simulator.py --protocol binary --rate 500
+        Prints the pty path to pass as KibbieSerial(port=...)
+    python3 serial_demo/monitor_simulator.py --protocol binary --rate 500 --check
+        Also reads the pty with KibbieSerial and reports received samples per second
+    python3 serial_demo/monitor_simulator.py --protocol binary --noise 0.01 --check
+        Corrupts about 1% of bytes to exercise resynchronization
+"""
+
+import argparse
+import csv
+import os
+import pty
+import random
+import sys
+import threading
+import time
+import tty
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.KibbieSerial import KibbieSerial
+from lib.MonitorProtocol import encode_frame
+
+DEFAULT_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "20230212-noodle_door-open_current_profile.csv")
+
+# Write this often, batching all samples that are due (like a USB serial link delivering packets)
+WRITE_PERIOD_S = 0.005
+
+
+# Returns (times_ms, currents) where currents has one column per channel
+def load_profile(filepath):
+    with open(filepath, newline="") as fin:
+        reader = csv.reader(fin)
+        header = [column.strip() for column in next(reader)]
+        time_column = header.index("time(ms)")
+        current_columns = [i for i,column in enumerate(header) if column.endswith("I filt")]
+        rows = [row for row in reader if len(row) == len(header)]
+    times_ms = np.array([float(row[time_column]) for row in rows])
+    currents = np.array([[float(row[i]) for i in current_columns] for row in rows])
+    return times_ms, currents
+
+
+class MonitorSimulator:
+    def __init__(self, protocol, rate_hz, profile_filepath, noise):
+        self.protocol = protocol
+        self.period_ms = 1000.0 / rate_hz
+        self.noise = noise
+        self.profile_times_ms, self.profile_currents = load_profile(profile_filepath)
+        self.profile_duration_ms = self.profile_times_ms[-1] + (self.profile_times_ms[-1] - self.profile_times_ms[-2])
+
+        # Create pseudo-terminal. The slave side is what KibbieSerial opens.
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+
+        self.sequence = 0
+        self.start_time = time.time()
+
+    # Current per channel at a time (interpolated, looping over the profile)
+    def current_at(self, time_ms):
+        t = time_ms % self.profile_duration_ms
+        return [np.interp(t, self.profile_times_ms, self.profile_currents[:, channel]) for channel in range(self.profile_currents.shape[1])]
+
+    def encode_sample(self, time_ms):
+        currents = self.current_at(time_ms)
+        if self.protocol == "binary":
+            data = encode_frame(self.sequence, int(time_ms), currents)
+        else:
+            data = ("I," + str(int(time_ms)) + "," + ",".join(f"{current:.2f}" for current in currents) + "\r\n").encode()
+        self.sequence += 1
+        return data
+
+    def corrupt(self, data):
+        data = bytearray(data)
+        for i in range(len(data)):
+            if random.random() < self.noise:
+                data[i] = random.randrange(256)
+        return bytes(data)
+
+    def run(self):
+        next_sample_ms = 0.0
+        while True:
+            now_ms = (time.time() - self.start_time) * 1000
+            data = b""
+            while next_sample_ms <= now_ms:
+                data += self.encode_sample(next_sample_ms)
+                next_sample_ms += self.period_ms
+            if data:
+                os.write(self.master_fd, self.corrupt(data) if self.noise > 0 else data)
+            time.sleep(WRITE_PERIOD_S)
+
+
+def check(port, protocol, rate_hz):
+    kb_serial = KibbieSerial(port=port, protocol=protocol)
+    last_num_samples = 0
+    while True:
+        time.sleep(1.0)
+        _, _, currents, num_samples = kb_serial.snapshot(since=last_num_samples)
+        latest = currents[-1] if len(currents) > 0 else []
+        stats = ""
+        if protocol == "binary":
+            decoder = kb_serial.frame_decoder
+            stats = f", {decoder.num_dropped_frames} dropped, {decoder.num_crc_errors} CRC errors"
+        print(f"Received {num_samples - last_num_samples} samples/s (expected {rate_hz}){stats}, latest {latest}")
+        last_num_samples = num_samples
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Emulate the Kibbie current monitor on a pseudo-terminal")
+    ap.add_argument("--protocol", choices=["text", "binary"], default="binary")
+    ap.add_argument("--rate", type=float, default=500, help="samples per second")
+    ap.add_argument("--profile", default=DEFAULT_PROFILE, help="current profile CSV to replay")
+    ap.add_argument("--noise", type=float, default=0, help="probability of corrupting each byte")
+    ap.add_argument("--check", action="store_true", help="read the pty with KibbieSerial and report statistics")
+    args = ap.parse_args()
+
+    simulator = MonitorSimulator(args.protocol, args.rate, args.profile, args.noise)
+    print(f"Simulating Kibbie monitor ({args.protocol}, {args.rate:g} samples/s) on {simulator.port}")
+
+    if args.check:
+        threading.Thread(target=check, args=(simulator.port, args.protocol, args.rate), daemon=True).start()
+
+    try:
+        simulator.run()
+    except KeyboardInterrupt:
+        pass
@@ -1,44 +1,43 @@
-import serial
-import time
-
-ser = serial.Serial(
-    port='/dev/ttyACM0',
-    baudrate=9600,
-    parity=serial.PARITY_ODD,
-    stopbits=serial.STOPBITS_TWO,
-    bytesize=serial.SEVENBITS
-)
-
-try: 
-    if(ser.isOpen() == False):
-        ser.open()
-except Exception as e:
-    print("error open serial port: ", e)
-    exit()
-
-buffer_string = ''
+"""
+Print the Kibbie monitor's current samples as they arrive
 
-def update():
-    global buffer_string
+Subscribes to the serial broker (kibbie or serial_broker.py), so it can run next to kibbie
+without taking over the serial port.
 
-    buffer_string = buffer_string + ser.read(ser.inWaiting()).decode()
+Run from the `software/` folder:
+    python3 serial_demo/serial_monitor.py
+    python3 serial_demo/serial_monitor.py --mode latest
+"""
 
-    print(f'buffer string: "{buffer_string}"')
-
-    if '\n' in buffer_string:
-        lines = buffer_string.split('\n') # Guaranteed to have at least 2 entries
-
-        for i,line in enumerate(lines[:-1]):
-            # Process each line
-            print(i, ":\t ", line)
-        
-        # Remove processed lines
-        buffer_string = lines[-1]
-
-if ser.isOpen():
-    while 1:
-        update()
+import argparse
+import os
+import sys
+import time
 
-        # Wait some time for buffer to grow
-        time.sleep(1.0)
- 
\ No newline at end of file
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.SerialBroker import BROKER_SOCKET_PATH, MODES, SerialBrokerClient
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Print current samples from the serial broker")
+    ap.add_argument("--mode", choices=MODES, default="stream", help="every sample, or only the latest sample")
+    ap.add_argument("--socket", default=BROKER_SOCKET_PATH)
+    ap.add_argument("--period", type=float, default=1.0, help="seconds between prints")
+    args = ap.parse_args()
+
+    client = SerialBrokerClient(args.mode, args.socket)
+    last_num_samples = 0
+    try:
+        while True:
+            # Wait some time for samples to arrive
+            time.sleep(args.period)
+
+            times, monitor_times_ms, currents, last_num_samples = client.snapshot(since=last_num_samples)
+            for t, monitor_time_ms, current in zip(times, monitor_times_ms, currents):
+                print(f"{t:.3f}\t{monitor_time_ms}\t" + "\t".join(f"{value:.3f}" for value in current))
+            if client.num_dropped_samples > 0:
+                print(f"*** {client.num_dropped_samples} samples dropped")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
@@ -0,0 +1,86 @@
+"""
+Stall detector replay test
+
+Replays a recorded current profile through lib/StallDetector.py and checks the detections against
+annotated stall windows. By default uses data/20230212-noodle_door-open_current_profile.csv, whose
+annotations (see the -ANNOTATED.png) mark the door being held open by hand and the door and lock being
+stuck, alongside a normal close and open that must not be reported.
+
+The profile is replayed at its recorded rate (10 Hz, like the text protocol) and resampled to
+the binary protocol's rate, so both serial protocols are covered.
+
+Run from the `software/` folder:
+    python3 serial_demo/stall_replay.py
+Exits with a non-zero status if any expected stall is missed, detected too late, or a stall is
+reported outside the annotated windows.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.StallDetector import StallDetector
+from monitor_simulator import DEFAULT_PROFILE, load_profile
+
+# (channel, start s, end s) of annotated stalls in the default profile
+DEFAULT_STALL_WINDOWS = [
+    (0, 27.5, 31.5),    # Holding door open by hand
+    (0, 37.3, 42.0),    # Both door and lock being stuck
+]
+
+# A stall must be reported this soon after its window starts
+MAX_DETECTION_LATENCY_S = 1.0
+
+# Rates (Hz) to resample the profile to, in addition to its recorded rate
+RESAMPLE_RATES_HZ = [500]
+
+
+def replay(times_s, currents, windows):
+    stalls = StallDetector(currents.shape[1]).update(times_s, currents)
+    failures = []
+
+    for stall in stalls:
+        in_window = any(stall.channel == channel and start <= stall.detect_time <= end for channel, start, end in windows)
+        print(f"    {stall}{'' if in_window else '  <-- not in an annotated window'}")
+        if not in_window:
+            failures.append(f"unexpected {stall}")
+
+    for channel, start, end in windows:
+        detections = [stall for stall in stalls if stall.channel == channel and start <= stall.detect_time <= end]
+        if len(detections) == 0:
+            failures.append(f"missed stall on channel {channel} at {start}-{end} s")
+        elif detections[0].detect_time - start > MAX_DETECTION_LATENCY_S:
+            failures.append(f"stall on channel {channel} at {start} s detected after {detections[0].detect_time - start:.2f} s")
+
+    return failures
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Replay a current profile through the stall detector")
+    ap.add_argument("--profile", default=DEFAULT_PROFILE, help="current profile CSV (time(ms) and '... I filt' columns)")
+    args = ap.parse_args()
+
+    times_ms, currents = load_profile(args.profile)
+    windows = DEFAULT_STALL_WINDOWS if args.profile == DEFAULT_PROFILE else []
+
+    failures = []
+    recorded_rate = 1000.0 / np.median(np.diff(times_ms))
+    print(f"Recorded rate ({recorded_rate:.0f} Hz):")
+    failures += replay(times_ms / 1000.0, currents, windows)
+
+    for rate in RESAMPLE_RATES_HZ:
+        resampled_times_ms = np.arange(times_ms[0], times_ms[-1], 1000.0 / rate)
+        resampled_currents = np.stack([np.interp(resampled_times_ms, times_ms, currents[:, channel]) for channel in range(currents.shape[1])], axis=1)
+        print(f"Resampled to {rate} Hz:")
+        failures += replay(resampled_times_ms / 1000.0, resampled_currents, windows)
+
+    if len(failures) > 0:
+        print("FAILED:")
+        for failure in failures:
+            print(f"    {failure}")
+        sys.exit(1)
+    print("PASSED")
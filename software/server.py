@@ -1,12 +1,33 @@
-# Source: https://stackabuse.com/serving-files-with-pythons-simplehttpserver-module/
+"""
+Serve snapshots, clips and their thumbnail gallery to browsers on the LAN without running kibbie
 
-import http.server
-import socketserver
+kibbie serves the same files (plus status, control and the live stream) itself when
+ENABLE_WEB_SERVER is set, so only run this while kibbie is stopped, or give it another port.
 
-PORT = 8000
+Example (run from the folder kibbie is run from):
+    python3 software/server.py
+    python3 software/server.py --port 8080
+"""
 
-handler = http.server.SimpleHTTPRequestHandler
+import argparse
+import os
 
-with socketserver.TCPServer(("", PORT), handler) as httpd:
-    print("Server started at localhost:" + str(PORT))
-    httpd.serve_forever()
\ No newline at end of file
+from lib.Parameters import ENABLE_THUMBNAILS, WEB_PORT
+from lib.ThumbnailCache import THUMBNAIL_FOLDER, ThumbnailCache
+from lib.WebServer import WebServer
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="Serve kibbie's files over HTTP")
+    ap.add_argument("--port", type=int, default=WEB_PORT, help="port to listen on")
+    ap.add_argument("--root", default=".", help="folder kibbie runs from (only its snapshots, clips and thumbnails are served)")
+    args = ap.parse_args()
+
+    # Thumbnails for /gallery and /thumbnail, shared with kibbie's cache
+    thumbnail_cache = ThumbnailCache(folder=os.path.join(args.root, THUMBNAIL_FOLDER)) if ENABLE_THUMBNAILS else None
+    server = WebServer(root=args.root, port=args.port, thumbnail_cache=thumbnail_cache)
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.close()
+        if thumbnail_cache:
+            thumbnail_cache.close()